@@ -1,34 +1,61 @@
 import streamlit as st
 import pandas as pd
-from showdown_scraper import process_replay_csv
+import hashlib
+import io
+from showdown_scraper import process_replay_urls
 
-st.title("🎮 Pokémon Showdown Replay Analyzer")
+# How long processed results are reused before the replays are looked up again
+CACHE_TTL_SECONDS = 15 * 60
 
-# Username Input for Player Selection
-username = st.text_input("Enter the Pokémon Showdown Username to Extract Team From:")
+@st.cache_data(ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def cached_process_replay_csv(username, file_hash, _file_bytes):
+    """Process an uploaded CSV once per (username, file content hash).
 
-# Upload CSV File
-uploaded_file = st.file_uploader("Upload CSV with Replay URLs", type=["csv"])
-
-if uploaded_file is not None:
-    # Save uploaded file temporarily
-    csv_file = "uploaded_replays.csv"
-    with open(csv_file, "wb") as f:
-        f.write(uploaded_file.getbuffer())
+    Returns (processed replays, team statistics, failed URLs), or None if the
+    CSV has no 'replay_url' column.
+    """
+    df_input = pd.read_csv(io.BytesIO(_file_bytes))
+    if "replay_url" not in df_input.columns:
+        return None
 
-    # Process the replay data
+    # Process the replay data, downloading several replays at a time
     output_file = "processed_replays.csv"
     team_stats_file = "team_statistics.csv"
+    return process_replay_urls(username, df_input["replay_url"].dropna().tolist(), output_file, team_stats_file)
 
-    df, team_stats = process_replay_csv(username, csv_file, output_file, team_stats_file)
+st.title("🎮 Pokémon Showdown Replay Analyzer")
 
-    # Display the processed tables
-    st.subheader("📊 Processed Replay Data")
-    st.dataframe(df)
+# Username Input for Player Selection
+username = st.text_input("Enter the Pokémon Showdown Username to Extract Team From:")
 
-    st.subheader("📈 Team Statistics")
-    st.dataframe(team_stats)
+# Upload CSV File
+uploaded_file = st.file_uploader("Upload CSV with Replay URLs", type=["csv"])
 
-    # Provide download buttons
-    st.download_button("📥 Download Processed Replays", data=df.to_csv(index=False), file_name="processed_replays.csv", mime="text/csv")
-    st.download_button("📥 Download Team Statistics", data=team_stats.to_csv(index=False), file_name="team_statistics.csv", mime="text/csv")
+if uploaded_file is not None:
+    file_bytes = uploaded_file.getvalue()
+    file_hash = hashlib.sha256(file_bytes).hexdigest()
+    with st.spinner("🔍 Processing replays..."):
+        result = cached_process_replay_csv(username, file_hash, file_bytes)
+
+    if result is None:
+        st.error("❌ CSV format not recognized. Expected a column named 'replay_url'.")
+    else:
+        df, team_stats, failures = result
+
+        # Say which URLs were skipped, and why
+        if not failures.empty:
+            st.warning(f"⚠️ {len(failures)} replays could not be processed.")
+            st.dataframe(failures, hide_index=True)
+
+        # Display the processed tables
+        st.subheader("📊 Processed Replay Data")
+        st.dataframe(df)
+
+        st.subheader("📈 Team Statistics")
+        st.dataframe(team_stats)
+
+        # Provide download buttons
+        st.download_button("📥 Download Processed Replays", data=df.to_csv(index=False), file_name="processed_replays.csv", mime="text/csv")
+        st.download_button("📥 Download Team Statistics", data=team_stats.to_csv(index=False), file_name="team_statistics.csv", mime="text/csv")
+        if not failures.empty:
+            st.download_button("📥 Download Failed URLs", data=failures.to_csv(index=False), file_name="failed_replays.csv", mime="text/csv")
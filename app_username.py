@@ -1,7 +1,33 @@
 import streamlit as st
 import pandas as pd
+import hashlib
+import io
 import re
-from showdown_scraper_username import fetch_replays_by_username, process_replay_csv, fetch_team_from_replay
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from instrumentation import get_default_metrics
+from matchups import build_matchup_matrix, team_win_rates
+from showdown_scraper_username import (
+    OUTPUT_COLUMNS, archetype_statistics, build_replay_rows, iter_replay_batches, merge_team_usage,
+    process_replays, fetch_parsed_replay, resolve_replay_teams, team_usage
+)
+from replay_formats import ALL_FORMATS, filter_replay_frame, format_labels
+from replay_records import ReplayRecord, records_to_frame
+from team_key_store import TeamKeyStore
+from usage_timeseries import SPECIES, TEAM, daily_buckets, day_dates, rolling_summary, rolling_usage, usage_over_time
+
+# How long fetched/processed results are reused before Showdown is asked again
+CACHE_TTL_SECONDS = 15 * 60
+
+# Columns of the replay table shown while fetching (archetypes need every team's usage, so they come last)
+STREAMED_COLUMNS = [column for column in OUTPUT_COLUMNS if column != "Archetype"]
+
+# Concurrent downloads for uploaded replay URLs
+CSV_FETCH_WORKERS = 8
+
+# Chart periods offered under "Usage Over Time": label -> pandas frequency
+USAGE_PERIODS = {"Week": "W", "Month": "MS", "Day": "D"}
 
 st.title("🎮 Pokémon Showdown Username-Based Replay Fetcher")
 
@@ -9,7 +35,10 @@ st.title("🎮 Pokémon Showdown Username-Based Replay Fetcher")
 username = st.text_input("Enter Pokémon Showdown Username:", "")
 
 # Select Format Filter
-format_option = st.radio("Select Format Filter:", ["All Matches", "Reg G", "Reg F"])
+format_option = st.radio("Select Format Filter:", format_labels())
+
+# Winners are only in the full replay logs, which are much larger than the team preview
+with_results = st.checkbox("🏆 Include win rates (downloads full replays, slower)")
 
 # Function to extract replay ID from URL
 def extract_replay_id(url):
@@ -19,114 +48,252 @@ def extract_replay_id(url):
         return match.group(1)
     return None
 
-# Fetch and Process Replays Button
+def session_cache_get(key):
+    """Value stored under `key` by session_cache_put, or None once it is older than the TTL."""
+    entry = st.session_state.setdefault("fetch_cache", {}).get(key)
+    if entry is None or time.time() - entry[0] > CACHE_TTL_SECONDS:
+        return None
+    return entry[1]
+
+def session_cache_put(key, value):
+    st.session_state.setdefault("fetch_cache", {})[key] = (time.time(), value)
+
+def stream_api_replays(username, format_option, with_results=False):
+    """Fetch a user's replays in `format_option` page by page, updating a progress bar and the tables as batches arrive.
+
+    Only each new batch is processed: its rows are appended to the replay
+    table and its team usage is merged into the running statistics (as in
+    process_replay_chunks), so a page costs the same however many came
+    before it. Team IDs are provisional until process_replays runs on the
+    whole set.
+    """
+    progress = st.progress(0.0, text=f"🔍 Fetching replays for {username}...")
+    table_header = st.empty()
+    table = st.empty()
+    stats_header = st.empty()
+    stats_table = st.empty()
+
+    records = []
+    processed = usage = None
+    with TeamKeyStore() as team_keys_seen:
+        for page, batch in enumerate(iter_replay_batches(username, formats=format_option, team_only=not with_results), start=1):
+            records.extend(batch)
+            # The API doesn't say how many pages there are, so assume one more is coming
+            progress.progress(page / (page + 1), text=f"🔍 {len(records)} replays fetched ({page} pages)...")
+
+            rows, team_keys = build_replay_rows(username, records_to_frame(batch))
+            rows["Team ID"] = team_keys_seen.codes(team_keys) + 1  # numbered in order of first appearance
+            usage = merge_team_usage(usage, team_usage(rows))
+            rows = rows[STREAMED_COLUMNS]
+            processed = rows if processed is None else pd.concat([processed, rows], ignore_index=True)
+
+            table_header.subheader("📊 Processed Replay Data (loading...)")
+            table.dataframe(processed)
+            stats_header.subheader("📈 Team Statistics (loading...)")
+            stats_table.dataframe(usage)
+
+    progress.empty()
+    for placeholder in (table_header, table, stats_header, stats_table):
+        placeholder.empty()
+    return records_to_frame(records)
+
+def fetch_csv_replays(username, csv_bytes, with_results=False):
+    """Fetch the replays listed in an uploaded CSV, several at a time, showing a progress bar.
+
+    Returns (replay frame in upload order, number of invalid URLs, ids of the
+    replays that could not be fetched), or (None, 0, []) if the CSV has no
+    'replay_url' column.
+    """
+    csv_data = pd.read_csv(io.BytesIO(csv_bytes))
+    if "replay_url" not in csv_data.columns:
+        return None, 0, []
+
+    # Extract replay IDs from URLs and drop rows with invalid URLs
+    csv_data['id'] = csv_data['replay_url'].apply(extract_replay_id)
+    invalid_count = int(csv_data['id'].isna().sum())
+    replay_ids = list(dict.fromkeys(csv_data['id'].dropna()))
+
+    progress = st.progress(0.0, text="Processing additional replays...")
+    parsed_replays = {}
+    with ThreadPoolExecutor(max_workers=CSV_FETCH_WORKERS) as executor:
+        futures = {executor.submit(fetch_parsed_replay, replay_id, team_only=not with_results): replay_id
+                   for replay_id in replay_ids}
+        for done, future in enumerate(as_completed(futures), start=1):
+            parsed_replays[futures[future]] = future.result()
+            progress.progress(done / len(replay_ids),
+                              text=f"Processing additional replay {done}/{len(replay_ids)}: {futures[future]}")
+    progress.empty()
+
+    # Records in upload order, so Team IDs don't depend on which download finished first
+    records, failed_ids = [], []
+    for replay_id in replay_ids:
+        parsed = parsed_replays[replay_id]
+        if parsed is None:
+            failed_ids.append(replay_id)
+            continue
+        # Create a record similar to what we get from the API
+        records.append(ReplayRecord.from_search_result({
+            "id": replay_id,
+            "format": parsed.get("format") or "unknown",
+            "uploadtime": parsed.get("started") or int(pd.Timestamp.now().timestamp()),  # current time as fallback
+        }, resolve_replay_teams(parsed, username)))
+    return records_to_frame(records), invalid_count, failed_ids
+
+def replay_ids_fingerprint(replays):
+    """Cheap content key for a replay frame: replays never change, so their ids identify it."""
+    return hashlib.sha256("\n".join(replays["id"].astype(str)).encode()).hexdigest()
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def cached_process(username, replays_fingerprint, with_results, _replays):
+    """Run process_replays once per (username, set of replays, with or without results)."""
+    output_file = "processed_replays.csv"
+    team_stats_file = "team_statistics.csv"
+    return process_replays(username, _replays, output_file, team_stats_file)
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def cached_buckets(username, replays_fingerprint, with_results, _replays):
+    """Per-day team and species usage buckets, once per (username, set of replays, with or without results)."""
+    return daily_buckets(username, _replays)
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def cached_matchups(username, replays_fingerprint, _replays):
+    """Species and species-pair win rate tables, once per (username, set of replays)."""
+    matrix = build_matchup_matrix(username, _replays)
+    return matrix.species_table("player"), matrix.species_table("opponent"), matrix.pair_table()
+
+# Fetch and Process Replays Button: remember who was fetched so that later
+# reruns (uploads, download clicks, formats already fetched) work off the cached data
 if st.button("Fetch Replays"):
     if username.strip() == "":
         st.error("❌ Please enter a username.")
     else:
-        st.info(f"🔍 Fetching replays for **{username}**...")
-        fetched_replays = fetch_replays_by_username(username)
+        st.session_state["fetched_username"] = username
 
-        if fetched_replays.empty:
-            st.warning("⚠️ No replays found through the Showdown API. You can still upload a CSV with replay URLs.")
-            fetched_replays = pd.DataFrame(columns=['id', 'format', 'uploadtime', 'teams', 'opponent', 'player_slot'])
+active_username = st.session_state.get("fetched_username")
+
+if active_username:
+    # Only the selected formats are fetched, unless every format is already at hand
+    fetched_replays = session_cache_get(("api", active_username, format_option, with_results))
+    if fetched_replays is None:
+        all_replays = session_cache_get(("api", active_username, ALL_FORMATS, with_results))
+        if all_replays is not None:
+            fetched_replays = filter_replay_frame(all_replays, format_option)
         else:
-            # Apply format filtering
-            if format_option == "Reg G":
-                fetched_replays = fetched_replays[
-                    fetched_replays['format'].str.contains("VGC 2024 Reg G|VGC 2025 Reg G", case=False, na=False)
-                ]
-            elif format_option == "Reg F":
-                fetched_replays = fetched_replays[
-                    fetched_replays['format'].str.contains("VGC 2024 Reg F", case=False, na=False)
-                ]
-
-            st.success(f"✅ Found {len(fetched_replays)} replays for **{username}** via the Showdown API.")
-
-        # Optional CSV Upload - Now with support for 'replay_url' column
-        st.subheader("📂 (Optional) Upload Additional Replay URLs")
-        uploaded_file = st.file_uploader("Upload a CSV containing additional replay URLs", type=["csv"])
-        
-        if uploaded_file:
-            csv_data = pd.read_csv(uploaded_file)
-            
-            # Check if the CSV has the expected format
-            if "replay_url" in csv_data.columns:
-                # Extract replay IDs from URLs
-                csv_data['id'] = csv_data['replay_url'].apply(extract_replay_id)
-                
-                # Remove rows with invalid URLs
-                invalid_urls = csv_data[csv_data['id'].isna()]
-                if not invalid_urls.empty:
-                    st.warning(f"⚠️ {len(invalid_urls)} invalid URLs found in CSV and ignored.")
-                
-                csv_data = csv_data.dropna(subset=['id'])
-                
-                # Check which replays are not already fetched
-                existing_ids = set(fetched_replays["id"]) if "id" in fetched_replays.columns else set()
-                new_replay_ids = [id for id in csv_data['id'] if id not in existing_ids]
-                
-                st.info(f"🔍 Found {len(new_replay_ids)} new replays in CSV to process.")
-                
-                # For each new replay, fetch details
-                new_replays_data = []
-                for idx, replay_id in enumerate(new_replay_ids):
-                    st.text(f"Processing additional replay {idx+1}/{len(new_replay_ids)}: {replay_id}")
-                    try:
-                        # We need to fetch each replay's data
-                        replay_data_json = fetch_team_from_replay(replay_id, username)
-                        import json
-                        replay_data = json.loads(replay_data_json)
-                        
-                        # Create a record similar to what we get from the API
-                        new_replay = {
-                            "id": replay_id,
-                            "format": "unknown",  # We can't easily determine this
-                            "uploadtime": pd.Timestamp.now().timestamp(),  # Use current time as fallback
-                            "teams": json.dumps(replay_data["teams"]),
-                            "opponent": replay_data["opponent"],
-                            "player_slot": replay_data["player_slot"],
-                            # Add any other fields needed
-                        }
-                        new_replays_data.append(new_replay)
-                    except Exception as e:
-                        st.error(f"❌ Error processing replay {replay_id}: {str(e)}")
-                
-                # Add the new replays to our dataset
-                if new_replays_data:
-                    new_replays_df = pd.DataFrame(new_replays_data)
-                    fetched_replays = pd.concat([fetched_replays, new_replays_df], ignore_index=True)
-                
-                st.success(
-                    f"✅ After merging: {len(fetched_replays)} unique replays found! "
-                    f"({len(fetched_replays) - len(new_replays_data)} from Showdown API, "
-                    f"{len(new_replays_data)} from CSV)."
-                )
-            else:
-                st.error("❌ CSV format not recognized. Expected a column named 'replay_url'.")
-
-        # Save fetched replays for processing
-        if not fetched_replays.empty:
-            csv_file = "fetched_replays.csv"
-            fetched_replays.to_csv(csv_file, index=False)
-
-            # Process the replay data
-            output_file = "processed_replays.csv"
-            team_stats_file = "team_statistics.csv"
-            df, team_stats = process_replay_csv(username, csv_file, output_file, team_stats_file)
-
-            # Display the processed tables
-            st.subheader("📊 Processed Replay Data")
-            st.dataframe(df)
-
-            st.subheader("📈 Team Statistics")
-            if team_stats is not None and not team_stats.empty:
-                st.dataframe(team_stats)
-            else:
-                st.warning("⚠ No team statistics were generated.")
-
-            # Provide download buttons
-            st.download_button("📥 Download Processed Replays", data=df.to_csv(index=False), file_name="processed_replays.csv", mime="text/csv")
-            st.download_button("📥 Download Team Statistics", data=team_stats.to_csv(index=False), file_name="team_statistics.csv", mime="text/csv")
+            fetched_replays = stream_api_replays(active_username, format_option, with_results)
+            session_cache_put(("api", active_username, format_option, with_results), fetched_replays)
+
+    if fetched_replays.empty:
+        st.warning("⚠️ No replays found through the Showdown API. You can still upload a CSV with replay URLs.")
+    else:
+        st.success(f"✅ Found {len(fetched_replays)} replays for **{active_username}** via the Showdown API.")
+
+    # Optional CSV Upload - Now with support for 'replay_url' column
+    st.subheader("📂 (Optional) Upload Additional Replay URLs")
+    uploaded_file = st.file_uploader("Upload a CSV containing additional replay URLs", type=["csv"])
+
+    if uploaded_file:
+        csv_bytes = uploaded_file.getvalue()
+        file_hash = hashlib.sha256(csv_bytes).hexdigest()
+        csv_result = session_cache_get(("csv", active_username, file_hash, with_results))
+        if csv_result is None:
+            csv_result = fetch_csv_replays(active_username, csv_bytes, with_results)
+            session_cache_put(("csv", active_username, file_hash, with_results), csv_result)
+        csv_replays, invalid_count, failed_ids = csv_result
+
+        if csv_replays is None:
+            st.error("❌ CSV format not recognized. Expected a column named 'replay_url'.")
         else:
-            st.error("❌ No replays to process after filtering and CSV upload.")
+            if invalid_count:
+                st.warning(f"⚠️ {invalid_count} invalid URLs found in CSV and ignored.")
+            if failed_ids:
+                st.warning(f"⚠️ {len(failed_ids)} replays could not be fetched: {', '.join(failed_ids[:10])}"
+                           + (" ..." if len(failed_ids) > 10 else ""))
+
+            # Check which replays are not already fetched
+            existing_ids = set(fetched_replays["id"])
+            new_replays_df = csv_replays[~csv_replays["id"].isin(existing_ids)]
+            st.info(f"🔍 Found {len(new_replays_df)} new replays in CSV to process.")
+
+            # Add the new replays to our dataset
+            if not new_replays_df.empty:
+                fetched_replays = pd.concat([fetched_replays, new_replays_df], ignore_index=True)
+
+            st.success(
+                f"✅ After merging: {len(fetched_replays)} unique replays found! "
+                f"({len(fetched_replays) - len(new_replays_df)} from Showdown API, "
+                f"{len(new_replays_df)} from CSV)."
+            )
+
+    # Process the fetched replays in memory
+    if not fetched_replays.empty:
+        fingerprint = replay_ids_fingerprint(fetched_replays)
+        df, team_stats = cached_process(active_username, fingerprint, with_results, fetched_replays)
+
+        # Display the processed tables
+        st.subheader("📊 Processed Replay Data")
+        st.dataframe(df)
+
+        st.subheader("📈 Team Statistics")
+        if team_stats is not None and not team_stats.empty:
+            st.dataframe(team_stats)
+        else:
+            st.warning("⚠ No team statistics were generated.")
+
+        # Teams differing by a Pokémon or so are grouped into archetypes
+        st.subheader("🧬 Archetypes")
+        archetype_stats = archetype_statistics(df)
+        st.dataframe(archetype_stats, hide_index=True)
+
+        # Usage trends, summed from per-day buckets rather than the replay rows
+        buckets = cached_buckets(active_username, fingerprint, with_results, fetched_replays)
+        if not buckets.empty:
+            st.subheader("📅 Usage Over Time")
+            usage_kind = TEAM if st.radio("Show usage of:", ["Teams", "Pokémon"], horizontal=True) == "Teams" else SPECIES
+            period = st.selectbox("Chart period", list(USAGE_PERIODS))
+            st.line_chart(usage_over_time(buckets, usage_kind, top=5, freq=USAGE_PERIODS[period]))
+            last_day = day_dates([buckets["Day"].max()])[0].strftime("%m-%d-%Y")
+            st.caption(f"Rolling windows end at the latest replay ({last_day}).")
+            st.dataframe(rolling_summary(buckets, usage_kind), hide_index=True)
+            if buckets["Format"].nunique() > 1:
+                with st.expander("Last 30 days by format"):
+                    st.dataframe(rolling_usage(buckets, usage_kind, 30, by_format=True), hide_index=True)
+
+        win_rates = team_win_rates(df) if with_results else None
+        if with_results and win_rates.empty:
+            st.warning("⚠ No game results found in these replays.")
+        elif with_results:
+            st.subheader("🏆 Team Win Rates")
+            st.dataframe(win_rates, hide_index=True)
+
+            your_species, opponent_species, species_pairs = cached_matchups(active_username, fingerprint, fetched_replays)
+            st.subheader("🐉 Your Pokémon")
+            st.dataframe(your_species, hide_index=True)
+            st.subheader("🎯 Opponents' Pokémon")
+            st.dataframe(opponent_species, hide_index=True)
+            st.subheader("⚔️ Matchups (your Pokémon vs. opponents' Pokémon)")
+            min_games = st.number_input("Minimum games per matchup", min_value=1, value=3)
+            st.dataframe(species_pairs[species_pairs["Games"] >= min_games], hide_index=True)
+
+        # Provide download buttons
+        st.download_button("📥 Download Processed Replays", data=df.to_csv(index=False), file_name="processed_replays.csv", mime="text/csv")
+        st.download_button("📥 Download Team Statistics", data=team_stats.to_csv(index=False), file_name="team_statistics.csv", mime="text/csv")
+        st.download_button("📥 Download Archetype Statistics", data=archetype_stats.to_csv(index=False), file_name="archetype_statistics.csv", mime="text/csv")
+        if win_rates is not None and not win_rates.empty:
+            st.download_button("📥 Download Matchups", data=species_pairs.to_csv(index=False), file_name="matchups.csv", mime="text/csv")
+    else:
+        st.error("❌ No replays to process after filtering and CSV upload.")
+
+# Optional diagnostics: where the time went, for every fetch this server has run
+with st.expander("🩺 Diagnostics"):
+    snapshot = get_default_metrics().snapshot()
+    if not snapshot["counters"] and not snapshot["histograms"]:
+        st.caption("No metrics recorded yet.")
+    else:
+        st.markdown("**Counters**")
+        st.dataframe(pd.DataFrame(
+            {"Metric": list(snapshot["counters"]), "Value": list(snapshot["counters"].values())}
+        ), hide_index=True)
+        st.markdown("**Timings and sizes** (seconds / bytes)")
+        st.dataframe(pd.DataFrame.from_dict(snapshot["histograms"], orient="index").rename_axis("Metric"))
+        st.download_button("📥 Download Metrics (JSON)", data=json.dumps(snapshot, indent=2),
+                           file_name="metrics.json", mime="application/json")
@@ -0,0 +1,157 @@
+"""Fetch and process replays for several Showdown users in one run.
+
+Usage:
+    python batch_fetch.py USER [USER ...] [--output-dir DIR] [--format LABEL] [--with-results] [--workers N] [--rps R]
+                          [--registry PATH] [--log-level LEVEL] [--log-json] [--metrics-json PATH]
+
+Writes <user>_processed_replays.csv, <user>_team_statistics.csv and
+<user>_archetype_statistics.csv per user (plus <user>_team_win_rates.csv and
+<user>_matchups.csv with --with-results), and optionally the run's metrics (see instrumentation.Metrics) as JSON.
+With --registry, Team IDs come from that team registry (see team_registry) and
+the fetched games are added to its statistics.
+"""
+import argparse
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import configure_logging, get_default_metrics
+from matchups import build_matchup_matrix, team_win_rates
+from replay_cache import get_default_cache
+from replay_formats import ALL_FORMATS, format_labels
+from replay_records import ReplayRecord, ReplayTeams, records_to_frame
+from showdown_http import ShowdownClient, format_stats, get_default_client
+from showdown_scraper_username import (
+    archetype_statistics, fetch_parsed_replay, iter_user_search_pages, process_replays, resolve_replay_teams
+)
+from team_registry import TeamRegistry
+
+log = logging.getLogger(__name__)
+
+
+def fetch_replays_for_users(usernames, max_workers=8, client=None, cache=None, formats=None, team_only=True):
+    """Fetch replays for several users, downloading each distinct replay only once.
+
+    Every user's search pages are walked concurrently. As pages arrive, each
+    replay id not seen before (for any user) is queued for download and
+    parsing; later sightings of the same id reuse that one parse, resolved
+    for the other user's slot. `formats` restricts every user's search to
+    those formats (see iter_user_search_pages); team_only=False downloads
+    whole replays so game results are known (see fetch_parsed_replay).
+
+    Returns {username: replay frame} in the layout of fetch_replays_by_username.
+    """
+    if client is None:
+        client = get_default_client()
+    if cache is None:
+        cache = get_default_cache()
+
+    usernames = list(dict.fromkeys(usernames))  # drop duplicates, keep order
+    parse_futures = {}  # replay id -> Future of fetch_parsed_replay
+    futures_lock = threading.Lock()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as fetch_pool:
+
+        def walk(username):
+            rows = []
+            for replays in iter_user_search_pages(username, client, formats):
+                with futures_lock:
+                    for replay in replays:
+                        if replay["id"] not in parse_futures:
+                            parse_futures[replay["id"]] = fetch_pool.submit(
+                                fetch_parsed_replay, replay["id"], client, cache, team_only)
+                rows.extend(replays)
+            return rows
+
+        with ThreadPoolExecutor(max_workers=max(1, len(usernames))) as search_pool:
+            search_rows = dict(zip(usernames, search_pool.map(walk, usernames)))
+
+        parsed = {replay_id: future.result() for replay_id, future in parse_futures.items()}
+
+    total_rows = sum(len(rows) for rows in search_rows.values())
+    log.info("✅ %d replay rows across %d users, %d distinct replays fetched", total_rows, len(usernames), len(parsed))
+    log.info("🔌 HTTP: %s", format_stats(client.stats()))
+
+    frames = {}
+    for username, rows in search_rows.items():
+        records = []
+        for replay in rows:
+            replay_parse = parsed.get(replay["id"])
+            teams = resolve_replay_teams(replay_parse, username) if replay_parse is not None else ReplayTeams()
+            records.append(ReplayRecord.from_search_result(replay, teams))
+        frames[username] = records_to_frame(records)
+    return frames
+
+
+def process_users(usernames, output_dir=None, max_workers=8, client=None, cache=None, formats=None,
+                  team_only=True, registry=None):
+    """Fetch several users' replays and build process_replays tables for each.
+
+    Returns {username: (processed_replays_df, team_stats_df)}. When
+    `output_dir` is given the tables are also written there as
+    <user>_processed_replays.csv and <user>_team_statistics.csv, along with
+    <user>_archetype_statistics.csv (see archetype_statistics) and, with
+    team_only=False, <user>_team_win_rates.csv and <user>_matchups.csv
+    (see matchups). With a team_registry.TeamRegistry, Team IDs are its
+    persistent ones and each user's games are ingested into it.
+    """
+    frames = fetch_replays_for_users(usernames, max_workers=max_workers, client=client, cache=cache,
+                                     formats=formats, team_only=team_only)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    results = {}
+    for username, frame in frames.items():
+        output_csv = team_stats_csv = None
+        if output_dir:
+            safe_name = re.sub(r"[^A-Za-z0-9_-]+", "_", username)
+            output_csv = os.path.join(output_dir, f"{safe_name}_processed_replays.csv")
+            team_stats_csv = os.path.join(output_dir, f"{safe_name}_team_statistics.csv")
+        results[username] = process_replays(username, frame, output_csv, team_stats_csv, registry)
+        if registry is not None:
+            registry.ingest(username, frame)
+        if output_dir:
+            archetype_statistics(results[username][0]).to_csv(
+                os.path.join(output_dir, f"{safe_name}_archetype_statistics.csv"), index=False)
+            if not team_only:
+                team_win_rates(results[username][0]).to_csv(
+                    os.path.join(output_dir, f"{safe_name}_team_win_rates.csv"), index=False)
+                build_matchup_matrix(username, frame).pair_table().to_csv(
+                    os.path.join(output_dir, f"{safe_name}_matchups.csv"), index=False)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fetch and analyze replays for several Showdown users.")
+    parser.add_argument("usernames", nargs="+", help="Showdown usernames to fetch")
+    parser.add_argument("--output-dir", default=".", help="directory for the per-user CSV files")
+    parser.add_argument("--format", default=ALL_FORMATS, choices=format_labels(), help="only fetch these formats")
+    parser.add_argument("--with-results", action="store_true",
+                        help="download whole replays to record who won (slower; needed for win rates)")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent replay downloads")
+    parser.add_argument("--rps", type=float, default=10.0, help="maximum requests per second to Showdown")
+    parser.add_argument("--registry", help="team registry database for persistent Team IDs (see team_registry)")
+    parser.add_argument("--log-level", default="INFO", help="DEBUG, INFO, WARNING or ERROR")
+    parser.add_argument("--log-json", action="store_true", help="log one JSON object per line")
+    parser.add_argument("--metrics-json", help="write counters and timings for the run to this file")
+    args = parser.parse_args(argv)
+    configure_logging(args.log_level, json_format=args.log_json)
+
+    client = ShowdownClient(requests_per_second=args.rps)
+    registry = TeamRegistry(args.registry) if args.registry else None
+    results = process_users(args.usernames, output_dir=args.output_dir, max_workers=args.workers, client=client,
+                            formats=args.format, team_only=not args.with_results, registry=registry)
+    if registry is not None:
+        registry.close()
+    for username, (df, team_stats) in results.items():
+        print(f"📊 {username}: {len(df)} replays, {len(team_stats)} team rows")
+
+    if args.metrics_json:
+        get_default_metrics().dump(args.metrics_json)
+        print(f"📈 Metrics written to {args.metrics_json}")
+
+
+if __name__ == "__main__":
+    main()
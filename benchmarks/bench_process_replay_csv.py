@@ -0,0 +1,158 @@
+"""Benchmark showdown_scraper_username.process_replay_csv at 10k/100k/1M rows.
+
+Builds synthetic fetched_replays.csv files, times the current implementation
+and (up to --legacy-max rows) the previous row-wise `DataFrame.apply`
+version, and checks both produce identical tables. With --chunk-size, the
+streaming mode (process_replay_chunks) is timed too, with its peak traced
+memory, and checked to write the same files. Run from the repository root:
+
+    python benchmarks/bench_process_replay_csv.py [--sizes 10000 100000 1000000] [--chunk-size 100000]
+"""
+import argparse
+import ast
+import filecmp
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from showdown_scraper_username import assign_sequential_team_ids, process_replay_csv  # noqa: E402
+from synthetic import FORMATS, SPECIES  # noqa: E402
+
+
+def make_fetched_csv(path, rows, username="BenchUser", seed=0):
+    """Write a fetched_replays.csv-shaped file with `rows` rows."""
+    rng = random.Random(seed)
+    main_teams = [rng.sample(SPECIES, 6) for _ in range(max(1, rows // 50))]
+    teams_json = []
+    players = []
+    slots = []
+    opponents = []
+    for _ in range(rows):
+        mine = rng.choice(main_teams) if rng.random() < 0.8 else rng.sample(SPECIES, 6)
+        theirs = rng.sample(SPECIES, 6)
+        opponent = f"Opponent{rng.randrange(500)}"
+        if rng.random() < 0.5:
+            slots.append("p1")
+            players.append(str([username, opponent]))
+            teams_json.append(json.dumps({"p1": mine, "p2": theirs}))
+        else:
+            slots.append("p2")
+            players.append(str([opponent, username]))
+            teams_json.append(json.dumps({"p1": theirs, "p2": mine}))
+        opponents.append(opponent)
+    pd.DataFrame({
+        "uploadtime": [1600000000 + rng.randrange(150_000_000) for _ in range(rows)],
+        "id": [f"gen9vgc2024regg-{i}" for i in range(rows)],
+        "format": [rng.choice(FORMATS) for _ in range(rows)],
+        "players": players,
+        "rating": 1500,
+        "private": 0,
+        "teams": teams_json,
+        "opponent": opponents,
+        "player_slot": slots,
+    }).to_csv(path, index=False)
+
+
+def legacy_process_replay_csv(username, input_csv, output_csv, team_stats_csv):
+    """The row-wise implementation this benchmark replaced (debug prints removed)."""
+    df_input = pd.read_csv(input_csv)
+    df_input["teams"] = df_input["teams"].apply(lambda x: json.loads(x) if isinstance(x, str) else x)
+    df_input["players"] = df_input["players"].apply(
+        lambda x: ast.literal_eval(x) if isinstance(x, str) and x.startswith("[") else x
+    )
+    df_input["Match Title"] = df_input.apply(
+        lambda row: f"{row['format']}: {row['players'][0]} vs. {row['players'][1]}"
+        if isinstance(row["players"], list) and len(row["players"]) == 2
+        else f"{row['format']}: ??? vs. ???",
+        axis=1
+    )
+    df_input['Match Date'] = pd.to_datetime(df_input['uploadtime'], unit='s').dt.strftime("%m-%d-%Y")
+    df_input['Replay URL'] = "https://replay.pokemonshowdown.com/" + df_input['id'].astype(str)
+
+    def get_player_team(row):
+        return row["teams"].get(row["player_slot"], [])
+
+    get_team_id = assign_sequential_team_ids(df_input.apply(get_player_team, axis=1))
+    df_input["Team"] = df_input.apply(lambda row: ", ".join(get_player_team(row)), axis=1)
+    df_input["Team ID"] = df_input.apply(lambda row: get_team_id(get_player_team(row)), axis=1)
+    df_output = df_input[['Team ID', 'Match Title', 'Match Date', 'Replay URL', 'Team']]
+    df_output.to_csv(output_csv, index=False)
+    # The legacy version took the greatest MM-DD-YYYY string; the expected value is the most recent date
+    df_input["_uploaded"] = pd.to_datetime(df_input["uploadtime"], unit="s")
+    team_stats_df = df_input.groupby(["Team ID", "Team"]).agg(
+        Times_Used=("Team ID", "count"),
+        Last_Used=("_uploaded", "max")
+    ).reset_index()
+    team_stats_df["Last_Used"] = team_stats_df["Last_Used"].dt.strftime("%m-%d-%Y")
+    team_stats_df.to_csv(team_stats_csv, index=False)
+    return df_output, team_stats_df
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def traced_peak_mib(func, *args, **kwargs):
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--legacy-max", type=int, default=100_000,
+                        help="largest size to also run the legacy implementation on")
+    parser.add_argument("--chunk-size", type=int, help="also time streaming mode with chunks of this many rows")
+    parser.add_argument("--max-memory-keys", type=int, default=1_000_000,
+                        help="distinct teams streaming mode keeps in memory before spilling to disk")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        out_csv = os.path.join(tmp, "processed.csv")
+        stats_csv = os.path.join(tmp, "stats.csv")
+        legacy_out, legacy_stats = os.path.join(tmp, "legacy.csv"), os.path.join(tmp, "legacy_stats.csv")
+        for rows in args.sizes:
+            input_csv = os.path.join(tmp, f"fetched_{rows}.csv")
+            make_fetched_csv(input_csv, rows)
+
+            new_time, (new_out, new_stats) = timed(
+                process_replay_csv, "BenchUser", input_csv, out_csv, stats_csv)
+            line = f"{rows:>9,} rows  vectorized {new_time:7.2f}s ({rows / new_time:>10,.0f} rows/s)"
+            if rows <= args.legacy_max:
+                old_time, (old_out, old_stats) = timed(
+                    legacy_process_replay_csv, "BenchUser", input_csv, legacy_out, legacy_stats)
+                # The legacy version predates the Archetype and Result columns
+                pd.testing.assert_frame_equal(new_out.drop(columns=["Archetype", "Result"]).reset_index(drop=True),
+                                              old_out.reset_index(drop=True))
+                pd.testing.assert_frame_equal(new_stats, old_stats)
+                line += f"  legacy {old_time:7.2f}s  speedup {old_time / new_time:5.1f}x  (outputs identical)"
+            print(line, flush=True)
+
+            if args.chunk_size:
+                chunk_out, chunk_stats = os.path.join(tmp, "chunked.csv"), os.path.join(tmp, "chunked_stats.csv")
+                options = {"chunk_size": args.chunk_size, "max_memory_keys": args.max_memory_keys}
+                chunk_time, _ = timed(process_replay_csv, "BenchUser", input_csv, chunk_out, chunk_stats, **options)
+                assert filecmp.cmp(out_csv, chunk_out, shallow=False) and filecmp.cmp(stats_csv, chunk_stats, shallow=False)
+                whole_peak = traced_peak_mib(process_replay_csv, "BenchUser", input_csv, out_csv, stats_csv)
+                chunk_peak = traced_peak_mib(process_replay_csv, "BenchUser", input_csv, chunk_out, chunk_stats,
+                                             **options)
+                print(f"{'':>9}       chunked    {chunk_time:7.2f}s ({rows / chunk_time:>10,.0f} rows/s)  "
+                      f"peak {chunk_peak:7.1f} MiB vs {whole_peak:7.1f} MiB in memory  (files identical)", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Micro-benchmark: µs per replay for team extraction, old line-splitting code vs showdown_protocol.
+
+Run from the repository root:
+
+    python benchmarks/bench_tokenizer.py [--replays 2000] [--repeat 5]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from showdown_protocol import iter_events, parse_team_preview  # noqa: E402
+from synthetic import make_replays  # noqa: E402
+
+
+def legacy_extract_teams(replay_log, username):
+    """The pre-tokenizer showdown_scraper_username.extract_teams_and_opponent (prints removed)."""
+    teams = {"p1": [], "p2": []}
+    opponent = "Unknown"
+    player_slot = None
+    player_dict = {}
+    for line in replay_log.split("\n"):
+        parts = line.split("|")
+        if len(parts) < 4:
+            continue
+        if parts[1] == "player":
+            slot, player_name = parts[2], parts[3]
+            player_dict[slot] = player_name
+            if player_name.lower() == username.lower():
+                player_slot = slot
+        if parts[1] == "poke" and len(parts) >= 4:
+            player, pokemon = parts[2], parts[3].split(",")[0]
+            if player in teams:
+                teams[player].append(pokemon)
+    for slot, player_name in player_dict.items():
+        if player_name.lower() != username.lower():
+            opponent = player_name
+            break
+    return teams, opponent, player_slot or "p1"
+
+
+def legacy_scraper_team(replay_log, player_slot):
+    """The pre-tokenizer substring scan from showdown_scraper.get_showdown_replay_data."""
+    team = set()
+    for line in replay_log.split("\n"):
+        if f"|poke|{player_slot}|" in line:
+            team.add(line.split("|")[3].split(",")[0])
+    return team
+
+
+def full_event_scan(replay_log):
+    """Tokenize every supported event in the log (no early stop)."""
+    count = 0
+    for _ in iter_events(replay_log):
+        count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--replays", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    replays, _ = make_replays(args.replays)
+    logs = [replay["log"] for replay in replays.values()]
+    avg_kb = sum(len(log) for log in logs) / len(logs) / 1024
+
+    # Sanity check: the new parser finds the same teams as the old one
+    for log in logs[:50]:
+        assert legacy_extract_teams(log, "BenchUser")[0] == parse_team_preview(log)[0]
+
+    cases = [
+        ("legacy extract_teams_and_opponent", lambda: [legacy_extract_teams(log, "BenchUser") for log in logs]),
+        ("legacy showdown_scraper substring scan", lambda: [legacy_scraper_team(log, "p1") for log in logs]),
+        ("showdown_protocol.parse_team_preview", lambda: [parse_team_preview(log) for log in logs]),
+        ("showdown_protocol.iter_events (full log)", lambda: [full_event_scan(log) for log in logs]),
+    ]
+    print(f"{len(logs)} replays, avg log {avg_kb:.1f} KB, best of {args.repeat}")
+    for name, func in cases:
+        best = min(timeit.repeat(func, number=1, repeat=args.repeat))
+        print(f"  {name:<45} {best / len(logs) * 1e6:8.1f} µs/replay")
+
+
+if __name__ == "__main__":
+    main()
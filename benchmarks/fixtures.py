@@ -0,0 +1,63 @@
+"""Replay corpora for the offline benchmarks.
+
+A recorded corpus is a gzipped JSON-lines file holding one full replay JSON
+document (as served at /<id>.json) per line; record_fixtures.py writes one.
+When no recording is available the deterministic synthetic corpus from
+synthetic.py is used instead.
+"""
+import gzip
+import json
+import os
+from collections import Counter
+
+from synthetic import make_replays
+
+DEFAULT_FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "replays.jsonl.gz")
+
+# Keys of a replay JSON document that also appear in its search.json row
+SEARCH_KEYS = ("uploadtime", "id", "format", "players", "rating", "private", "password")
+
+
+def search_row(replay):
+    """The search.json row Showdown lists for a full replay document."""
+    return {key: replay.get(key) for key in SEARCH_KEYS}
+
+
+def save_fixtures(replays, path=DEFAULT_FIXTURES_PATH):
+    """Write replay JSON documents to a gzipped JSON-lines corpus."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        for replay in replays:
+            f.write(json.dumps(replay) + "\n")
+
+
+def load_fixtures(path=DEFAULT_FIXTURES_PATH):
+    """Return (replays_by_id, search_rows) from a recorded corpus, newest first."""
+    replays = {}
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                replay = json.loads(line)
+                replays[replay["id"]] = replay
+    search = sorted((search_row(r) for r in replays.values()), key=lambda r: r["uploadtime"] or 0, reverse=True)
+    return replays, search
+
+
+def most_common_player(search):
+    """The player appearing in the most replays of a corpus (a good username to benchmark)."""
+    counts = Counter(player for row in search for player in row.get("players") or ())
+    return counts.most_common(1)[0][0] if counts else None
+
+
+def load_corpus(path=None, synthetic_count=500, username="BenchUser"):
+    """Return (replays_by_id, search_rows, username, source description).
+
+    Uses the recorded corpus at `path` (default: benchmarks/fixtures) when it
+    exists, otherwise `synthetic_count` synthetic replays played by `username`.
+    """
+    path = path or DEFAULT_FIXTURES_PATH
+    if os.path.exists(path):
+        replays, search = load_fixtures(path)
+        return replays, search, most_common_player(search), f"recorded corpus {path}"
+    replays, search = make_replays(synthetic_count, username=username)
+    return replays, search, username, f"{synthetic_count} synthetic replays"
@@ -0,0 +1,60 @@
+"""Record real replays from replay.pokemonshowdown.com into a benchmark corpus.
+
+Walks search.json for each username and downloads up to --limit replay JSON
+documents per user (each replay once), then writes them to
+benchmarks/fixtures/replays.jsonl.gz for stub_server.py and run_benchmarks.py.
+Run from the repository root:
+
+    python benchmarks/record_fixtures.py USER [USER ...] [--limit 500] [--rps 5]
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fixtures import DEFAULT_FIXTURES_PATH, save_fixtures  # noqa: E402
+from showdown_http import RETRYABLE_EXCEPTIONS, ShowdownClient, format_stats  # noqa: E402
+from showdown_scraper_username import iter_search_pages  # noqa: E402
+
+
+def record(usernames, limit, client):
+    """Return the replay JSON documents of up to `limit` replays per username."""
+    replays = {}
+    for username in usernames:
+        ids = []
+        for page in iter_search_pages(username, client):
+            ids.extend(row["id"] for row in page)
+            if len(ids) >= limit:
+                break
+        for replay_id in ids[:limit]:
+            if replay_id in replays:
+                continue
+            try:
+                response = client.replay_json(replay_id)
+            except RETRYABLE_EXCEPTIONS as e:
+                print(f"❌ Error fetching {replay_id}: {e}")
+                continue
+            if response.status_code == 200:
+                replays[replay_id] = response.json()
+        print(f"✅ {username}: {len(ids[:limit])} replays listed, {len(replays)} recorded so far")
+    return list(replays.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("usernames", nargs="+", help="Showdown usernames whose replays to record")
+    parser.add_argument("--limit", type=int, default=500, help="replays to record per user")
+    parser.add_argument("--rps", type=float, default=5.0, help="maximum requests per second to Showdown")
+    parser.add_argument("--out", default=DEFAULT_FIXTURES_PATH, help="corpus file to write")
+    args = parser.parse_args()
+
+    client = ShowdownClient(requests_per_second=args.rps)
+    replays = record(args.usernames, args.limit, client)
+    save_fixtures(replays, args.out)
+    print(f"💾 Wrote {len(replays)} replays to {args.out}")
+    print(f"🔌 HTTP: {format_stats(client.stats())}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""End-to-end offline benchmark suite: a regression baseline for performance changes.
+
+Serves a replay corpus (the recorded one in benchmarks/fixtures if present,
+otherwise synthetic replays) from a local stub Showdown server and reports:
+
+  * replays/sec for showdown_scraper_username.fetch_replays_by_username (cold and warm cache)
+  * replays/sec for showdown_scraper.process_replay_csv (cold and warm cache)
+  * µs/replay for showdown_scraper_username.extract_teams_and_opponent
+  * replays/sec for replay_ingest.ingest_replays reading the corpus from a .jsonl.gz dump
+  * time and peak traced memory of the team statistics step (process_replays) at scale
+
+Run from the repository root:
+
+    python benchmarks/run_benchmarks.py [--latency 0.02] [--error-rate 0.01] [--stats-rows 100000] [--json baseline.json]
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import showdown_scraper  # noqa: E402
+from bench_process_replay_csv import make_fetched_csv  # noqa: E402
+from fixtures import load_corpus  # noqa: E402
+from instrumentation import configure_logging, get_default_metrics  # noqa: E402
+from replay_cache import ReplayCache  # noqa: E402
+from replay_ingest import ingest_replays  # noqa: E402
+from replay_records import load_replays  # noqa: E402
+from showdown_http import ShowdownClient  # noqa: E402
+from showdown_scraper_username import extract_teams_and_opponent, fetch_replays_by_username, process_replays  # noqa: E402
+from stub_server import StubShowdownServer, to_id  # noqa: E402
+
+
+def timed(func, *args, **kwargs):
+    """Call func; return (seconds, result)."""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def make_client(stub, args):
+    # Generous rate limit and short backoff: we measure our code, not politeness delays
+    return ShowdownClient(base_url=stub.url, requests_per_second=args.rps, base_delay=0.01)
+
+
+def bench_fetch(stub, username, args):
+    client, cache = make_client(stub, args), ReplayCache(":memory:")
+    results = {}
+    for label in ("cold", "warm"):
+        seconds, frame = timed(fetch_replays_by_username, username, max_workers=args.workers,
+                                 client=client, cache=cache, save_path=None)
+        results[label] = {"replays": len(frame), "seconds": seconds, "replays_per_sec": len(frame) / seconds}
+    results["http"] = client.stats()
+    return results
+
+
+def bench_url_csv(stub, username, user_ids, tmp, args):
+    input_csv = os.path.join(tmp, "replay_urls.csv")
+    pd.DataFrame({"replay_url": [f"{stub.url}/{replay_id}" for replay_id in user_ids]}).to_csv(input_csv, index=False)
+    client, cache = make_client(stub, args), ReplayCache(":memory:")
+    results = {}
+    for label in ("cold", "warm"):
+        seconds, (df, _) = timed(showdown_scraper.process_replay_csv, username, input_csv,
+                                   os.path.join(tmp, "processed.csv"), os.path.join(tmp, "stats.csv"),
+                                   cache=cache, client=client, team_only=args.team_only,
+                                   max_workers=args.workers, parse_processes=args.parse_processes, failures_file=None)
+        results[label] = {"replays": len(df), "seconds": seconds, "replays_per_sec": len(df) / seconds}
+    return results
+
+
+def bench_extract(replays, username, repeat):
+    logs = [replay.get("log", "") for replay in replays.values()]
+
+    def run():
+        for log in logs:
+            extract_teams_and_opponent(log, username)
+
+    best = min(timeit.repeat(run, number=1, repeat=repeat))
+    return {"replays": len(logs), "us_per_replay": best / len(logs) * 1e6}
+
+
+def bench_ingest(replays, username, tmp, workers):
+    dump = os.path.join(tmp, "replays.jsonl.gz")
+    with gzip.open(dump, "wt", encoding="utf-8") as f:
+        for replay in replays.values():
+            f.write(json.dumps(replay) + "\n")
+    seconds, frame = timed(ingest_replays, dump, username, workers=workers)
+    return {"replays_read": len(replays), "replays": len(frame), "seconds": seconds,
+            "replays_per_sec": len(replays) / seconds}
+
+
+def bench_stats(rows, tmp):
+    input_csv = os.path.join(tmp, f"fetched_{rows}.csv")
+    make_fetched_csv(input_csv, rows)
+    frame = load_replays(input_csv)
+    tracemalloc.start()
+    seconds, (_, team_stats) = timed(process_replays, "BenchUser", frame)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"rows": rows, "teams": len(team_stats), "seconds": seconds, "peak_mib": peak / 2 ** 20}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fixtures", help="recorded corpus (default: benchmarks/fixtures, else synthetic)")
+    parser.add_argument("--synthetic", type=int, default=500, help="synthetic replays when no corpus is recorded")
+    parser.add_argument("--username", help="user to fetch (default: most frequent player in the corpus)")
+    parser.add_argument("--latency", type=float, default=0.02, help="stub server latency per request, seconds")
+    parser.add_argument("--jitter", type=float, default=0.01, help="extra random stub latency, up to seconds")
+    parser.add_argument("--error-rate", type=float, default=0.01, help="fraction of stub requests answered with 503")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent downloads for both fetch paths")
+    parser.add_argument("--parse-processes", type=int, default=0,
+                        help="worker processes parsing replay JSON in showdown_scraper.process_replay_csv")
+    parser.add_argument("--rps", type=float, default=1000.0, help="client rate limit against the stub")
+    parser.add_argument("--team-only", action="store_true",
+                        help="let showdown_scraper.process_replay_csv download only each log's team preview")
+    parser.add_argument("--ingest-workers", type=int, help="parse processes for ingest_replays (default: one per core)")
+    parser.add_argument("--stats-rows", type=int, nargs="+", default=[100_000], help="rows for the statistics step")
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions for the parse micro-benchmark")
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    args = parser.parse_args()
+    configure_logging("ERROR")  # injected 503s would otherwise log a retry warning each
+
+    replays, search, username, source = load_corpus(args.fixtures, args.synthetic)
+    username = args.username or username
+    user_ids = [row["id"] for row in search if to_id(username) in (to_id(p) for p in row.get("players") or ())]
+    print(f"🧪 {source}; user {username!r} has {len(user_ids)} replays")
+    print(f"   stub latency {args.latency * 1000:.0f} ms (+ up to {args.jitter * 1000:.0f} ms), "
+          f"error rate {args.error_rate:.1%}")
+
+    results = {"corpus": source, "username": username, "latency": args.latency,
+               "jitter": args.jitter, "error_rate": args.error_rate}
+    with tempfile.TemporaryDirectory() as tmp:
+        with StubShowdownServer(replays, search, latency=args.latency, jitter=args.jitter,
+                                error_rate=args.error_rate) as stub:
+            results["fetch_replays_by_username"] = fetch = bench_fetch(stub, username, args)
+            for label in ("cold", "warm"):
+                r = fetch[label]
+                print(f"fetch_replays_by_username ({label}): {r['replays']:>6} replays in {r['seconds']:6.2f}s "
+                      f"= {r['replays_per_sec']:8.1f} replays/s")
+            print(f"   HTTP: {fetch['http']['requests']} requests, {fetch['http']['retries']} retries, "
+                  f"p95 {fetch['http']['latency_ms_p95']:.0f} ms")
+
+            results["showdown_scraper.process_replay_csv"] = url_csv = bench_url_csv(stub, username, user_ids, tmp, args)
+            for label in ("cold", "warm"):
+                r = url_csv[label]
+                print(f"showdown_scraper.process_replay_csv ({label}): {r['replays']:>6} replays in {r['seconds']:6.2f}s "
+                      f"= {r['replays_per_sec']:8.1f} replays/s")
+
+        results["extract_teams_and_opponent"] = parse = bench_extract(replays, username, args.repeat)
+        print(f"extract_teams_and_opponent: {parse['us_per_replay']:.1f} µs/replay over {parse['replays']} logs")
+
+        results["ingest_replays"] = ingest = bench_ingest(replays, username, tmp, args.ingest_workers)
+        print(f"ingest_replays: {ingest['replays_read']} replays read in {ingest['seconds']:6.2f}s "
+              f"= {ingest['replays_per_sec']:8.1f} replays/s ({ingest['replays']} kept)")
+
+        results["team_statistics"] = []
+        for rows in args.stats_rows:
+            r = bench_stats(rows, tmp)
+            results["team_statistics"].append(r)
+            print(f"team statistics: {rows:>9,} rows, {r['teams']:,} team rows in {r['seconds']:6.2f}s, "
+                  f"peak {r['peak_mib']:7.1f} MiB traced")
+
+    results["metrics"] = get_default_metrics().snapshot()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
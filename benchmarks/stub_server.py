@@ -0,0 +1,176 @@
+"""Local stand-in for replay.pokemonshowdown.com used by the benchmarks.
+
+Serves a replay corpus the way Showdown does:
+
+    /search.json?user=&format=&page=&before=   newest first, 51 rows per page
+    /<id>.json                                  full replay document
+    /<id>.log                                   plain battle log
+
+Each request can be delayed by a fixed latency (plus jitter) and fail with a
+503 at a configurable rate, so retries and concurrency are exercised the way
+they are against the real server. Run it directly to point the app at it:
+
+    python benchmarks/stub_server.py [--port 8000] [--latency 0.05] [--error-rate 0.02]
+    SHOWDOWN_REPLAY_URL=http://127.0.0.1:8000 streamlit run app_username.py
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+PAGE_SIZE = 50  # search.json returns PAGE_SIZE + 1 rows so callers can tell a next page exists
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients hang up mid-body on purpose (partial log downloads); that's not an error
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+def to_id(name):
+    """Showdown's user id: lowercase letters and digits only."""
+    return re.sub(r"[^a-z0-9]", "", str(name).lower())
+
+
+class StubShowdownServer:
+    """Threaded HTTP server serving `replays` (id -> replay JSON) and their `search` rows.
+
+    Use as a context manager, or call start()/stop(); `url` is the base URL
+    to hand to ShowdownClient(base_url=...).
+    """
+
+    def __init__(self, replays, search, latency=0.0, jitter=0.0, error_rate=0.0,
+                 host="127.0.0.1", port=0, seed=0):
+        self.replays = replays
+        self.search = sorted(search, key=lambda r: r.get("uploadtime") or 0, reverse=True)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.server = _StubHTTPServer((host, port), self._handler_class())
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def search_page(self, query):
+        """Rows search.json would return for the given query parameters."""
+        rows = self.search
+        if query.get("user"):
+            user = to_id(query["user"])
+            rows = [r for r in rows if user in (to_id(p) for p in r.get("players") or ())]
+        if query.get("format"):
+            format_id = to_id(query["format"])
+            rows = [r for r in rows if r["id"].startswith(format_id + "-")]
+        if query.get("before"):
+            before = int(query["before"])
+            rows = [r for r in rows if (r.get("uploadtime") or 0) < before]
+        start = (max(1, int(query.get("page") or 1)) - 1) * PAGE_SIZE
+        return rows[start:start + PAGE_SIZE + 1]
+
+    def _delay_and_maybe_fail(self):
+        with self.lock:
+            self.requests += 1
+            delay = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0.0)
+            fail = self.error_rate and self.rng.random() < self.error_rate
+            if fail:
+                self.errors += 1
+        if delay:
+            time.sleep(delay)
+        return fail
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes; without this, delayed
+            # ACKs add ~40 ms to every response on loopback
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if stub._delay_and_maybe_fail():
+                    return self._send(503, b"Service Unavailable", "text/plain", {"Retry-After": "0"})
+                url = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                if url.path == "/search.json":
+                    return self._send(200, json.dumps(stub.search_page(query)).encode(), "application/json")
+
+                replay_id, _, ext = url.path.lstrip("/").rpartition(".")
+                replay = stub.replays.get(replay_id)
+                if replay is None or ext not in ("json", "log"):
+                    return self._send(404, b"Not Found", "text/plain")
+                if ext == "json":
+                    return self._send(200, json.dumps(replay).encode(), "application/json")
+                return self._send(200, replay.get("log", "").encode(), "text/plain")
+
+            def _send(self, status, body, content_type, headers=None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+def main():
+    from fixtures import load_corpus
+
+    parser = argparse.ArgumentParser(description="Serve a replay corpus like replay.pokemonshowdown.com.")
+    parser.add_argument("--fixtures", help="recorded corpus (default: benchmarks/fixtures, else synthetic)")
+    parser.add_argument("--synthetic", type=int, default=500, help="synthetic replays when no corpus is recorded")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random delay, up to this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    args = parser.parse_args()
+
+    replays, search, username, source = load_corpus(args.fixtures, args.synthetic)
+    stub = StubShowdownServer(replays, search, latency=args.latency, jitter=args.jitter,
+                              error_rate=args.error_rate, port=args.port)
+    print(f"🧪 Serving {source} at {stub.url} (try user {username!r}); Ctrl+C to stop")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stub.server.server_close()
+
+
+if __name__ == "__main__":
+    main()
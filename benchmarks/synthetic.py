@@ -0,0 +1,86 @@
+"""Deterministic synthetic Showdown replays for offline benchmarks.
+
+The logs follow the real protocol layout (player/poke header, team preview,
+then turns of switches, moves and damage) and are sized like typical VGC
+replays, so parse timings are representative without touching the network.
+"""
+import random
+
+SPECIES = [
+    "Incineroar", "Rillaboom", "Urshifu-Rapid-Strike", "Flutter Mane", "Amoonguss",
+    "Tornadus", "Chien-Pao", "Chi-Yu", "Landorus", "Ogerpon-Hearthflame",
+    "Farigiraf", "Indeedee-F", "Ursaluna", "Gholdengo", "Iron Hands",
+    "Raging Bolt", "Calyrex-Shadow", "Miraidon", "Koraidon", "Kyogre",
+    "Whimsicott", "Grimmsnarl", "Pelipper", "Archaludon", "Dragonite",
+    "Kingambit", "Annihilape", "Talonflame", "Porygon2", "Dondozo",
+]
+MOVES = ["Protect", "Fake Out", "Tailwind", "Spore", "Moonblast", "Heat Wave", "Surging Strikes", "Close Combat"]
+FORMATS = ["[Gen 9] VGC 2024 Reg G", "[Gen 9] VGC 2025 Reg G", "[Gen 9] VGC 2024 Reg F"]
+
+
+def make_log(p1, p2, team1, team2, winner, fmt, turns=12, rng=None):
+    """Build a battle log string for a game between two six-Pokémon teams."""
+    rng = rng or random.Random(0)
+    lines = [
+        f"|j|☆{p1}", f"|j|☆{p2}", "|t:|1700000000", "|gametype|doubles",
+        f"|player|p1|{p1}|102|1500", f"|player|p2|{p2}|265|1500",
+        "|teamsize|p1|6", "|teamsize|p2|6", "|gen|9", f"|tier|{fmt}", "|rated|",
+        "|rule|Species Clause: Limit one of each Pokémon", "|clearpoke",
+    ]
+    lines += [f"|poke|p1|{species}, L50, F|" for species in team1]
+    lines += [f"|poke|p2|{species}, L50|" for species in team2]
+    lines += ["|teampreview|4", "|", "|t:|1700000010", "|start"]
+    for side, team in (("p1", team1), ("p2", team2)):
+        for spot, species in zip("ab", team[:2]):
+            lines.append(f"|switch|{side}{spot}: {species}|{species}, L50|100/100")
+    for turn in range(1, turns + 1):
+        lines += ["|", f"|t:|{1700000010 + turn * 30}", f"|turn|{turn}"]
+        for side, foe in (("p1", "p2"), ("p2", "p1")):
+            for spot in "ab":
+                lines.append(f"|move|{side}{spot}: X|{rng.choice(MOVES)}|{foe}a: Y")
+                lines.append(f"|-damage|{foe}a: Y|{rng.randint(1, 100)}/100")
+                lines.append(f"|-damage|{foe}b: Z|{rng.randint(1, 100)}/100|[from] Spread")
+                lines.append(f"|-enditem|{side}{spot}: X|Sitrus Berry|[eat]")
+                lines.append(f"|-heal|{side}{spot}: X|{rng.randint(50, 100)}/100|[from] item: Sitrus Berry")
+            lines.append(f"|c|☆{p1}|gg {turn}")
+        if turn == turns // 2:
+            lines.append("|-terastallize|p1a: X|Fire")
+    lines += ["|faint|p2a: Y", "|", f"|win|{winner}"]
+    return "\n".join(lines) + "\n"
+
+
+def make_replays(count, username="BenchUser", seed=0, opponents=50):
+    """Return (replays_by_id, search_results) for `count` games played by `username`.
+
+    search_results mimic search.json rows (newest first); replays_by_id hold the
+    full replay JSON documents served at /<id>.json.
+    """
+    rng = random.Random(seed)
+    # A handful of "main" teams so Team ID grouping has something to find
+    main_teams = [rng.sample(SPECIES, 6) for _ in range(max(1, count // 20))]
+    replays = {}
+    search = []
+    for i in range(count):
+        fmt = FORMATS[i % len(FORMATS)]
+        format_id = fmt.lower().replace("[gen 9] ", "gen9").replace(" ", "")
+        replay_id = f"{format_id}-{2000000000 + i}"
+        opponent = f"Opponent{rng.randrange(opponents)}"
+        mine = list(rng.choice(main_teams)) if rng.random() < 0.8 else rng.sample(SPECIES, 6)
+        rng.shuffle(mine)
+        theirs = rng.sample(SPECIES, 6)
+        if rng.random() < 0.5:
+            p1, p2, team1, team2 = username, opponent, mine, theirs
+        else:
+            p1, p2, team1, team2 = opponent, username, theirs, mine
+        uploadtime = 1700000000 + (count - i) * 600
+        log = make_log(p1, p2, team1, team2, rng.choice([p1, p2]), fmt, turns=rng.randint(6, 18), rng=rng)
+        replays[replay_id] = {
+            "id": replay_id, "format": fmt, "players": [p1, p2], "log": log,
+            "uploadtime": uploadtime, "views": 1, "formatid": format_id,
+            "rating": 1500, "private": 0, "password": None,
+        }
+        search.append({
+            "uploadtime": uploadtime, "id": replay_id, "format": fmt,
+            "players": [p1, p2], "rating": 1500, "private": 0, "password": None,
+        })
+    return replays, search
@@ -0,0 +1,137 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# LogRecord attributes that are not user-supplied `extra` fields
+_STANDARD_LOG_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class Histogram:
+    """Count/sum/min/max of observed values plus a window of recent ones for percentiles."""
+
+    def __init__(self, window=10000):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.recent.append(value)
+
+    def summary(self):
+        values = sorted(self.recent)
+
+        def percentile(p):
+            return values[min(len(values) - 1, int(p * len(values)))] if values else 0.0
+
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "avg": self.total / self.count if self.count else 0.0,
+            "min": self.min if self.min is not None else 0.0,
+            "max": self.max if self.max is not None else 0.0,
+            "p50": percentile(0.5),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+        }
+
+
+class Metrics:
+    """Thread-safe counters and histograms for the fetch/parse/stats pipeline.
+
+    Names are dotted stage names, e.g. "search.pages" (counter) or
+    "replay.parse_seconds" (histogram). `timer` records wall-clock seconds.
+    `snapshot` / `dump` give everything recorded so far as plain JSON.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters = {}
+        self.histograms = {}
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name):
+        """Record how long the `with` block takes, in seconds, under `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "started": self.started,
+                "elapsed_seconds": time.time() - self.started,
+                "counters": dict(sorted(self.counters.items())),
+                "histograms": {name: h.summary() for name, h in sorted(self.histograms.items())},
+            }
+
+    def dump(self, path):
+        """Write snapshot() to `path` as JSON."""
+        with open(path, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.counters.clear()
+            self.histograms.clear()
+
+
+_default_metrics = Metrics()
+
+
+def get_default_metrics():
+    """Process-wide Metrics that the scrapers, HTTP client and cache record into."""
+    return _default_metrics
+
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per log line, including any `extra={...}` fields."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_LOG_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+def configure_logging(level="INFO", json_format=False):
+    """Send the scrapers' log records to stderr, as plain text or JSON lines."""
+    handler = logging.StreamHandler()
+    if json_format:
+        handler.setFormatter(JsonLogFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level.upper() if isinstance(level, str) else level)
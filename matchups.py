@@ -0,0 +1,164 @@
+"""Win rates per team, per species and per species matchup.
+
+Results come from the replay frame's `winner` column (filled in when replays
+are fetched with team_only=False). Species are interned to integer codes and
+every game is added to species x species NumPy count matrices with
+`np.bincount`, so a few hundred thousand games aggregate in one vectorized
+pass per chunk. Win rates are over decided games; ties are counted apart.
+"""
+import numpy as np
+import pandas as pd
+
+from replay_records import normalize_replay_frame
+from showdown_protocol import TIE
+
+WIN, LOSS, DRAW = "Win", "Loss", "Tie"
+
+
+def resolve_results(winners, username):
+    """Per game, "Win"/"Loss"/"Tie" from `username`'s side, or None where the winner is unknown."""
+    winners = pd.Series(winners, dtype=object).reset_index(drop=True)
+    known = winners.map(lambda winner: isinstance(winner, str) and winner != "")
+    results = pd.Series(None, index=winners.index, dtype=object)
+    results[known] = LOSS
+    results[known & (winners.str.lower() == username.lower())] = WIN
+    results[known & (winners == TIE)] = DRAW
+    return results.to_numpy()
+
+
+def player_and_opponent_teams(replays):
+    """(player teams, opponent teams) per row of a normalized replay frame, by `player_slot`."""
+    player_teams, opponent_teams = [], []
+    for p1, p2, slot in zip(replays["p1_team"].tolist(), replays["p2_team"].tolist(),
+                            replays["player_slot"].tolist()):
+        if slot == "p2":
+            player_teams.append(p2)
+            opponent_teams.append(p1)
+        else:
+            player_teams.append(p1)
+            opponent_teams.append(p2)
+    return player_teams, opponent_teams
+
+
+def team_win_rates(df_output):
+    """Wins, losses, ties and win rate per Team ID from a process_replays output table."""
+    columns = ["Team ID", "Team", "Games", "Wins", "Losses", "Ties", "Win_Rate"]
+    decided = df_output[df_output["Result"].notna()] if "Result" in df_output.columns else df_output.iloc[:0]
+    if decided.empty:
+        return pd.DataFrame(columns=columns)
+    stats = decided.assign(
+        _win=decided["Result"].eq(WIN), _loss=decided["Result"].eq(LOSS), _tie=decided["Result"].eq(DRAW),
+    ).groupby("Team ID", sort=True).agg(  # one row per Team ID, whatever the preview order
+        Team=("Team", "first"),
+        Games=("Result", "count"),
+        Wins=("_win", "sum"),
+        Losses=("_loss", "sum"),
+        Ties=("_tie", "sum"),
+    ).reset_index()
+    stats["Win_Rate"] = stats["Wins"] / (stats["Wins"] + stats["Losses"]).where(lambda n: n > 0)
+    return stats[columns]
+
+
+class MatchupMatrix:
+    """Games and wins of one player, by their species and their opponents' species.
+
+    pair_games[i, j] counts decided games where the player brought species i
+    and the opponent species j; pair_wins[i, j] how many of those the player
+    won. player_* and opponent_* count the same per single species.
+    """
+
+    def __init__(self):
+        self.species = {}  # name -> code
+        self.names = []
+        self.player_games = self.player_wins = np.zeros(0, dtype=np.int64)
+        self.opponent_games = self.opponent_wins = np.zeros(0, dtype=np.int64)
+        self.pair_games = self.pair_wins = np.zeros((0, 0), dtype=np.int64)
+
+    def _codes(self, teams):
+        """Padded (games x 6) species code matrix, -1 for no Pokémon; new species are interned."""
+        width = max((len(team) for team in teams), default=0)
+        codes = np.full((len(teams), width), -1, dtype=np.int64)
+        species = self.species
+        for row, team in enumerate(teams):
+            for column, name in enumerate(dict.fromkeys(team)):
+                code = species.get(name)
+                if code is None:
+                    code = species[name] = len(self.names)
+                    self.names.append(name)
+                codes[row, column] = code
+        return codes
+
+    def _grow(self):
+        size = len(self.names)
+        old = len(self.player_games)
+        if size == old:
+            return
+
+        def grown(counts):
+            bigger = np.zeros((size,) * counts.ndim, dtype=np.int64)
+            bigger[tuple(slice(0, old) for _ in range(counts.ndim))] = counts
+            return bigger
+
+        self.player_games, self.player_wins = grown(self.player_games), grown(self.player_wins)
+        self.opponent_games, self.opponent_wins = grown(self.opponent_games), grown(self.opponent_wins)
+        self.pair_games, self.pair_wins = grown(self.pair_games), grown(self.pair_wins)
+
+    def add_games(self, player_teams, opponent_teams, won):
+        """Add decided games: the two teams of each game and whether the player won it."""
+        player = self._codes(player_teams)
+        opponent = self._codes(opponent_teams)
+        self._grow()
+        size = len(self.names)
+        won = np.asarray(won, dtype=np.int64)
+
+        for codes, games, wins in ((player, self.player_games, self.player_wins),
+                                   (opponent, self.opponent_games, self.opponent_wins)):
+            valid = codes >= 0
+            games += np.bincount(codes[valid], minlength=size)
+            wins += np.bincount(codes[valid], weights=np.broadcast_to(won[:, None], codes.shape)[valid],
+                                minlength=size).astype(np.int64)
+
+        pairs = player[:, :, None] * size + opponent[:, None, :]
+        valid = (player[:, :, None] >= 0) & (opponent[:, None, :] >= 0)
+        pair_won = np.broadcast_to(won[:, None, None], pairs.shape)[valid]
+        self.pair_games += np.bincount(pairs[valid], minlength=size * size).reshape(size, size)
+        self.pair_wins += np.bincount(pairs[valid], weights=pair_won,
+                                      minlength=size * size).astype(np.int64).reshape(size, size)
+
+    def species_table(self, side="player", min_games=1):
+        """Win rate per species on the player's ("player") or the opponents' ("opponent") teams."""
+        games, wins = (self.player_games, self.player_wins) if side == "player" else \
+            (self.opponent_games, self.opponent_wins)
+        table = pd.DataFrame({"Pokémon": self.names, "Games": games, "Wins": wins})
+        table = table[table["Games"] >= min_games]
+        table["Win_Rate"] = table["Wins"] / table["Games"]
+        return table.sort_values(["Games", "Pokémon"], ascending=[False, True]).reset_index(drop=True)
+
+    def pair_table(self, min_games=1):
+        """Win rate for every (your Pokémon, opponent's Pokémon) pair seen in at least `min_games` games."""
+        rows, columns = np.nonzero(self.pair_games >= max(1, min_games))
+        names = np.array(self.names, dtype=object)
+        table = pd.DataFrame({
+            "Your Pokémon": names[rows],
+            "Opponent's Pokémon": names[columns],
+            "Games": self.pair_games[rows, columns],
+            "Wins": self.pair_wins[rows, columns],
+        })
+        table["Win_Rate"] = table["Wins"] / table["Games"]
+        return table.sort_values(["Games", "Your Pokémon", "Opponent's Pokémon"],
+                                 ascending=[False, True, True]).reset_index(drop=True)
+
+
+def build_matchup_matrix(username, replays, chunk_size=50_000):
+    """MatchupMatrix of `username`'s decided games in a replay frame, added `chunk_size` games at a time."""
+    replays = normalize_replay_frame(replays)
+    results = resolve_results(replays["winner"], username)
+    decided = np.flatnonzero((results == WIN) | (results == LOSS))
+    player_teams, opponent_teams = player_and_opponent_teams(replays)
+
+    matrix = MatchupMatrix()
+    for start in range(0, len(decided), chunk_size):
+        chunk = decided[start:start + chunk_size].tolist()
+        matrix.add_games([player_teams[i] for i in chunk], [opponent_teams[i] for i in chunk],
+                         results[chunk] == WIN)
+    return matrix
@@ -0,0 +1,122 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from instrumentation import get_default_metrics
+
+DEFAULT_CACHE_PATH = os.environ.get("SHOWDOWN_REPLAY_CACHE", "replay_cache.sqlite3")
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024  # 256 MB of compressed replay data
+
+
+class ReplayCache:
+    """On-disk cache of Showdown replays keyed by replay id.
+
+    Replays never change once uploaded, so entries never expire; the cache is
+    only trimmed (least recently used first) when it grows past `max_bytes`.
+    Each entry holds the raw replay JSON (zlib-compressed) and/or the parsed
+    teams and players, so callers can skip both the download and the parse.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS replays (
+                id TEXT PRIMARY KEY,
+                raw BLOB,
+                parsed TEXT,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )"""
+        )
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM replays").fetchone()[0]
+
+    def get(self, replay_id):
+        """Return (raw, parsed) for a cached replay, or None. Either half may be None."""
+        with self.lock:
+            row = self.conn.execute("SELECT raw, parsed FROM replays WHERE id = ?", (replay_id,)).fetchone()
+            if row is None:
+                self.misses += 1
+                get_default_metrics().incr("cache.misses")
+                return None
+            self.hits += 1
+            get_default_metrics().incr("cache.hits")
+            self.conn.execute("UPDATE replays SET last_access = ? WHERE id = ?", (time.time(), replay_id))
+            self.conn.commit()
+        raw = json.loads(zlib.decompress(row[0])) if row[0] is not None else None
+        parsed = json.loads(row[1]) if row[1] is not None else None
+        return raw, parsed
+
+    def put(self, replay_id, raw=None, parsed=None):
+        """Store a replay. `raw` is the JSON text (or dict); `parsed` the extracted teams/players.
+
+        Fields left as None keep whatever is already cached for that replay.
+        """
+        if isinstance(raw, dict):
+            raw = json.dumps(raw)
+        raw_blob = zlib.compress(raw.encode("utf-8")) if raw is not None else None
+        parsed_text = json.dumps(parsed) if parsed is not None else None
+
+        with self.lock:
+            row = self.conn.execute("SELECT raw, parsed, size FROM replays WHERE id = ?", (replay_id,)).fetchone()
+            if row is not None:
+                raw_blob = raw_blob if raw_blob is not None else row[0]
+                parsed_text = parsed_text if parsed_text is not None else row[1]
+                self.total_bytes -= row[2]
+            size = len(raw_blob or b"") + len(parsed_text or "")
+            self.conn.execute(
+                "INSERT OR REPLACE INTO replays (id, raw, parsed, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                (replay_id, raw_blob, parsed_text, size, time.time()),
+            )
+            self.total_bytes += size
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        """Drop least recently used entries until the cache is back under 90% of its limit."""
+        target = self.max_bytes * 0.9
+        rows = self.conn.execute("SELECT id, size FROM replays ORDER BY last_access ASC").fetchall()
+        for replay_id, size in rows:
+            if self.total_bytes <= target:
+                break
+            self.conn.execute("DELETE FROM replays WHERE id = ?", (replay_id,))
+            self.total_bytes -= size
+
+    def stats(self):
+        """Hit/miss counters and current size of the cache."""
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM replays").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": self.total_bytes,
+        }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    """Shared cache used by the scrapers when no cache is passed explicitly."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ReplayCache()
+        return _default_cache
@@ -0,0 +1,77 @@
+import json
+import os
+import re
+from dataclasses import dataclass
+
+ALL_FORMATS = "All Matches"
+
+# Optional JSON file with extra formats: {"Label": {"format_ids": [...], "pattern": "..."}, ...}
+FORMATS_FILE = os.environ.get("SHOWDOWN_FORMATS_FILE")
+
+
+@dataclass(slots=True)
+class ReplayFormat:
+    """A named group of Showdown formats the replay fetchers can filter on.
+
+    format_ids are the ids search.json accepts as its `format` parameter, so
+    the server filters for us; pattern is a case-insensitive regex on the
+    format name, used on search rows when no ids are known.
+    """
+    label: str
+    format_ids: tuple = ()
+    pattern: str = ""
+
+    def matches(self, format_name):
+        """True if a replay's format name belongs to this format group."""
+        if not self.pattern:
+            return True
+        return re.search(self.pattern, str(format_name), re.IGNORECASE) is not None
+
+
+FORMAT_REGISTRY = {}
+
+
+def register_format(label, format_ids=(), pattern=""):
+    """Add (or replace) a format group under `label`."""
+    FORMAT_REGISTRY[label] = ReplayFormat(label, tuple(format_ids), pattern)
+    return FORMAT_REGISTRY[label]
+
+
+def load_format_registry(path):
+    """Register every format group defined in a JSON file (see FORMATS_FILE)."""
+    with open(path, "r", encoding="utf-8") as f:
+        for label, spec in json.load(f).items():
+            register_format(label, spec.get("format_ids", ()), spec.get("pattern", ""))
+
+
+def format_labels():
+    """Labels to offer in a format picker, "All Matches" first."""
+    return [ALL_FORMATS] + list(FORMAT_REGISTRY)
+
+
+def get_format(replay_format):
+    """Resolve a label (or ReplayFormat, or None) to a ReplayFormat; None means no filtering."""
+    if replay_format is None or isinstance(replay_format, ReplayFormat):
+        return replay_format
+    if replay_format == ALL_FORMATS:
+        return None
+    try:
+        return FORMAT_REGISTRY[replay_format]
+    except KeyError:
+        raise ValueError(f"Unknown format {replay_format!r}; known formats: {format_labels()}") from None
+
+
+def filter_replay_frame(replays, replay_format):
+    """Keep only the rows of a replay frame whose `format` is in `replay_format`."""
+    replay_format = get_format(replay_format)
+    if replay_format is None or not replay_format.pattern:
+        return replays
+    return replays[replays["format"].str.contains(replay_format.pattern, case=False, na=False)]
+
+
+register_format("Reg G", ("gen9vgc2024regg", "gen9vgc2024reggbo3", "gen9vgc2025regg", "gen9vgc2025reggbo3"),
+                "VGC 2024 Reg G|VGC 2025 Reg G")
+register_format("Reg F", ("gen9vgc2024regf", "gen9vgc2024regfbo3"), "VGC 2024 Reg F")
+
+if FORMATS_FILE:
+    load_format_registry(FORMATS_FILE)
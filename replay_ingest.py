@@ -0,0 +1,285 @@
+"""Build replay tables from local replay dumps, without the network.
+
+Usage:
+    python replay_ingest.py SOURCE [SOURCE ...] --username USER [--output-dir DIR] [--format LABEL]
+                            [--workers N] [--save PATH] [--log-level LEVEL]
+
+A source is a directory (searched recursively), a tar archive (.tar, .tar.gz,
+.tgz, ...) or a JSON-lines dump (.jsonl / .ndjson, optionally .gz). Replays in
+them can be Showdown's replay JSON (as served at <replay>.json), a saved
+replay page (.html) or a raw battle log (.log); single files may be gzipped.
+
+Archives and dumps are streamed, never read whole; directory files are read
+by the parse worker processes themselves. Every replay goes through the same
+log parse as fetch_team_from_replay with a full download (teams, players,
+format and winner), and the result is a replay frame in the layout of
+fetch_replays_by_username, so process_replays builds the usual tables from
+it. Writes <user>_processed_replays.csv, <user>_team_statistics.csv and
+<user>_archetype_statistics.csv.
+"""
+import argparse
+import gzip
+import json
+import logging
+import multiprocessing
+import os
+import re
+import tarfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from instrumentation import configure_logging, get_default_metrics
+from replay_formats import ALL_FORMATS, format_labels, get_format
+from replay_records import ReplayRecord, records_to_frame, save_replays
+from showdown_scraper_username import archetype_statistics, parse_full_replay_log, process_replays, resolve_replay_teams
+
+REPLAY_FILE_SUFFIXES = (".json", ".html", ".htm", ".log")
+DUMP_SUFFIXES = (".jsonl", ".ndjson")
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+# Replays handed to a parse worker at a time
+INGEST_BATCH_SIZE = 256
+
+# Battle log embedded in a saved replay page; "/" is escaped as "\/" there
+HTML_LOG_PATTERN = re.compile(
+    r'<script[^>]*class="(?:battle-log-data|log)"[^>]*>(.*?)</script>', re.DOTALL | re.IGNORECASE)
+HTML_REPLAY_ID_PATTERN = re.compile(r'name="replayid"\s+value="([^"]+)"', re.IGNORECASE)
+
+log = logging.getLogger(__name__)
+metrics = get_default_metrics()
+
+
+def _suffix_of(name):
+    name = name.lower()
+    return name[:-3] if name.endswith(".gz") and not name.endswith(".tar.gz") else name
+
+
+def _replay_id_from_name(name):
+    """File name without directories and replay suffixes, e.g. "gen9vgc2024regg-123" for .../gen9vgc2024regg-123.json.gz.
+
+    Lines of a dump ("dump.jsonl#12") get the dump's name and the line number.
+    """
+    name, _, line = name.partition("#")
+    base = os.path.basename(name)
+    if base.lower().endswith(".gz"):
+        base = base[:-3]
+    base = os.path.splitext(base)[0]
+    return f"{base}-{line}" if line else base
+
+
+def _read_text(path):
+    opener = gzip.open if path.lower().endswith(".gz") else open
+    with opener(path, "rb") as f:
+        return f.read().decode("utf-8", errors="replace")
+
+
+def iter_dump_lines(lines, name):
+    """(name, text) per non-empty line of a JSON-lines dump."""
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if line:
+            yield f"{name}#{number}", line.decode("utf-8", errors="replace") if isinstance(line, bytes) else line
+
+
+def iter_tar(path):
+    """(name, text) per replay in a tar archive, read in one streaming pass."""
+    with tarfile.open(path, mode="r|*") as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            suffix = _suffix_of(member.name)
+            if not suffix.endswith(REPLAY_FILE_SUFFIXES + DUMP_SUFFIXES):
+                continue
+            data = archive.extractfile(member)
+            if member.name.lower().endswith(".gz"):
+                data = gzip.GzipFile(fileobj=data)
+            if suffix.endswith(DUMP_SUFFIXES):
+                yield from iter_dump_lines(data, member.name)
+            else:
+                yield member.name, data.read().decode("utf-8", errors="replace")
+
+
+def iter_replay_sources(source):
+    """Replays in a source, one item each: a file path (read by the parser) or a (name, text) pair."""
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for file_name in sorted(files):
+                yield from iter_replay_sources(os.path.join(root, file_name))
+        return
+
+    suffix = _suffix_of(source)
+    if suffix.endswith(TAR_SUFFIXES):
+        yield from iter_tar(source)
+    elif suffix.endswith(DUMP_SUFFIXES):
+        opener = gzip.open if source.lower().endswith(".gz") else open
+        with opener(source, "rb") as f:
+            yield from iter_dump_lines(f, source)
+    elif suffix.endswith(REPLAY_FILE_SUFFIXES):
+        yield source
+
+
+def parse_replay_document(name, text):
+    """Return (search-result-like metadata, fetch_parsed_replay-like parse) for one replay, or None.
+
+    `text` is a replay JSON object, a saved replay page or a raw battle log;
+    `name` (a file name) supplies the replay id when the text has none.
+    """
+    stripped = text.lstrip()
+    replay = {}
+    if stripped.startswith("{"):
+        try:
+            replay = json.loads(stripped)
+        except json.JSONDecodeError:
+            return None
+        replay_log = replay.get("log")
+    elif stripped.startswith("<"):
+        match = HTML_LOG_PATTERN.search(text)
+        if match is None:
+            return None
+        replay_log = match.group(1).replace("\\/", "/")
+        id_match = HTML_REPLAY_ID_PATTERN.search(text)
+        if id_match is not None:
+            replay["id"] = id_match.group(1)
+    else:
+        replay_log = text
+    if not isinstance(replay_log, str) or "|poke|" not in replay_log:
+        return None
+
+    parsed = parse_full_replay_log(replay_log)
+    players = replay.get("players") or [parsed["players"][slot] for slot in ("p1", "p2") if slot in parsed["players"]]
+    metadata = {
+        "id": replay.get("id") or _replay_id_from_name(name),
+        "format": replay.get("format") or parsed["format"] or "Unknown Format",
+        "uploadtime": replay.get("uploadtime") or parsed["started"],
+        "players": players,
+        "rating": replay.get("rating"),
+        "private": replay.get("private", 0),
+    }
+    return metadata, parsed
+
+
+def parse_replay_batch(items):
+    """parse_replay_document for each item of iter_replay_sources; run in the parse worker processes."""
+    results = []
+    for item in items:
+        try:
+            name, text = item if isinstance(item, tuple) else (item, _read_text(item))
+            results.append(parse_replay_document(name, text))
+        except (OSError, UnicodeError, EOFError) as e:
+            log.warning("⚠ Could not read %s: %s", item if isinstance(item, str) else item[0], e)
+            results.append(None)
+    return results
+
+
+def _batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_parsed_replays(sources, workers=None, batch_size=INGEST_BATCH_SIZE, lookahead=4):
+    """Yields parse_replay_document results for every replay in `sources`, in source order.
+
+    Batches of replays are parsed in `workers` processes (None: one per core,
+    0: in this process, as is done on a single core), with at most
+    `lookahead` batches per worker in flight, so memory stays bounded however
+    large the dump is. Workers take about a second each to start.
+    """
+    items = (item for source in sources for item in iter_replay_sources(source))
+    batches = _batches(items, batch_size)
+    if workers is None:
+        workers = os.cpu_count() or 1
+        workers = workers if workers > 1 else 0
+    if workers <= 0:
+        for batch in batches:
+            yield from parse_replay_batch(batch)
+        return
+
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        pending = deque()
+        for batch in batches:
+            pending.append(executor.submit(parse_replay_batch, batch))
+            if len(pending) > workers * lookahead:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def ingest_replays(sources, username, formats=None, workers=None, batch_size=INGEST_BATCH_SIZE):
+    """Replay frame of `username`'s games in local replay dumps (see the module docstring).
+
+    Replays the user didn't play in, replays outside `formats` and repeats of
+    a replay id already read are skipped. Rows are in source order.
+    """
+    if isinstance(sources, (str, os.PathLike)):
+        sources = [sources]
+    missing = [source for source in sources if not os.path.exists(source)]
+    if missing:
+        raise FileNotFoundError(f"Replay sources not found: {missing}")
+    replay_format = get_format(formats)
+    user = username.lower()
+
+    records, seen_ids = [], set()
+    counts = {"read": 0, "unparsed": 0, "other_players": 0, "other_formats": 0, "duplicates": 0}
+    with metrics.timer("ingest.seconds"):
+        for result in iter_parsed_replays(sources, workers, batch_size):
+            counts["read"] += 1
+            if result is None:
+                counts["unparsed"] += 1
+                continue
+            replay, parsed = result
+            if not any(str(name).lower() == user for name in parsed["players"].values()):
+                counts["other_players"] += 1
+            elif replay_format is not None and not replay_format.matches(replay["format"]):
+                counts["other_formats"] += 1
+            elif replay["id"] in seen_ids:
+                counts["duplicates"] += 1
+            else:
+                seen_ids.add(replay["id"])
+                records.append(ReplayRecord.from_search_result(replay, resolve_replay_teams(parsed, username)))
+
+    for name, value in counts.items():
+        metrics.incr(f"ingest.{name}", value)
+    log.info("📦 %d replays read: %d of %s's kept, %d unreadable, %d other players' games, "
+             "%d other formats, %d duplicates", counts["read"], len(records), username, counts["unparsed"],
+             counts["other_players"], counts["other_formats"], counts["duplicates"])
+    return records_to_frame(records)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build replay tables from local replay dumps, without the network.")
+    parser.add_argument("sources", nargs="+", help="directories, tar archives or JSON-lines dumps of replays")
+    parser.add_argument("--username", required=True, help="player whose games to analyze")
+    parser.add_argument("--output-dir", default=".", help="directory for the CSV files")
+    parser.add_argument("--format", default=ALL_FORMATS, choices=format_labels(), help="only use these formats")
+    parser.add_argument("--workers", type=int, help="parse processes (default: one per core, 0: none)")
+    parser.add_argument("--save", help="also save the replay frame here (.csv or .parquet)")
+    parser.add_argument("--log-level", default="INFO", help="DEBUG, INFO, WARNING or ERROR")
+    args = parser.parse_args(argv)
+    configure_logging(args.log_level)
+
+    replays = ingest_replays(args.sources, args.username, formats=args.format, workers=args.workers)
+    if args.save:
+        save_replays(replays, args.save)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    safe_name = re.sub(r"[^A-Za-z0-9_-]+", "_", args.username)
+    df, team_stats = process_replays(
+        args.username, replays,
+        os.path.join(args.output_dir, f"{safe_name}_processed_replays.csv"),
+        os.path.join(args.output_dir, f"{safe_name}_team_statistics.csv"),
+    )
+    if not df.empty:
+        archetype_statistics(df).to_csv(
+            os.path.join(args.output_dir, f"{safe_name}_archetype_statistics.csv"), index=False)
+    print(f"📊 {args.username}: {len(df)} replays, {len(team_stats)} team rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import ast
+import json
+import logging
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
+# Column order of an in-memory replay frame (see records_to_frame)
+REPLAY_COLUMNS = [
+    "uploadtime", "id", "format", "players", "rating", "private",
+    "p1_team", "p2_team", "opponent", "player_slot", "winner",
+]
+
+
+@dataclass(slots=True)
+class ReplayTeams:
+    """Both teams of a replay (and its winner, if known), resolved for the username that was searched."""
+    p1_team: tuple = ()
+    p2_team: tuple = ()
+    opponent: str = "Unknown"
+    player_slot: str = "p1"
+    winner: Optional[str] = None  # winner's name, showdown_protocol.TIE, or None if not parsed
+
+
+@dataclass(slots=True)
+class ReplayRecord:
+    """One fetched replay: the search.json metadata plus the extracted teams."""
+    id: str
+    format: str
+    uploadtime: Optional[int]
+    players: tuple = ()
+    rating: Optional[int] = None
+    private: int = 0
+    p1_team: tuple = ()
+    p2_team: tuple = ()
+    opponent: str = "Unknown"
+    player_slot: str = "p1"
+    winner: Optional[str] = None
+
+    @classmethod
+    def from_search_result(cls, replay, teams):
+        """Combine a search.json row with the ReplayTeams fetched for it."""
+        return cls(
+            id=replay["id"],
+            format=replay.get("format", "Unknown Format"),
+            uploadtime=replay.get("uploadtime"),
+            players=tuple(replay.get("players") or ()),
+            rating=replay.get("rating"),
+            private=replay.get("private", 0),
+            p1_team=teams.p1_team,
+            p2_team=teams.p2_team,
+            opponent=teams.opponent,
+            player_slot=teams.player_slot,
+            winner=teams.winner,
+        )
+
+
+def records_to_frame(records):
+    """Build a columnar replay DataFrame (list-typed team columns) from ReplayRecords."""
+    columns = {name: [] for name in REPLAY_COLUMNS}
+    for record in records:
+        for name in REPLAY_COLUMNS:
+            value = getattr(record, name)
+            columns[name].append(list(value) if isinstance(value, tuple) else value)
+    return pd.DataFrame(columns, columns=REPLAY_COLUMNS)
+
+
+def normalize_replay_frame(df):
+    """Bring a replay frame from any source into the in-memory layout.
+
+    Older CSVs store both teams as one JSON `teams` column and `players` as a
+    Python list literal; these are converted to `p1_team`/`p2_team` list
+    columns and a `players` list column. Missing columns get defaults.
+    """
+    df = df.copy()
+
+    if "p1_team" not in df.columns or "p2_team" not in df.columns:
+        if "teams" not in df.columns:
+            log.warning("⚠ 'teams' column missing in replay data. Using empty teams.")
+            teams = [{}] * len(df)
+        else:
+            teams = [json.loads(x) if isinstance(x, str) else x for x in df["teams"].tolist()]
+        df["p1_team"] = [t.get("p1", []) if isinstance(t, dict) else [] for t in teams]
+        df["p2_team"] = [t.get("p2", []) if isinstance(t, dict) else [] for t in teams]
+    df = df.drop(columns="teams", errors="ignore")
+
+    if "opponent" not in df.columns:
+        df["opponent"] = "Unknown"
+
+    if "player_slot" not in df.columns:
+        log.warning("⚠ 'player_slot' column missing in replay data. Defaulting to 'p1'.")
+        df["player_slot"] = "p1"  # Default to p1 if not found
+
+    if "winner" not in df.columns:
+        df["winner"] = None  # fetched without results (team-only)
+
+    if "players" in df.columns:
+        # Player pairs repeat a lot, so parse each distinct string only once
+        players = df["players"].tolist()
+        parsed_players = {
+            x: ast.literal_eval(x)
+            for x in set(x for x in players if isinstance(x, str) and x.startswith("["))
+        }
+        df["players"] = [parsed_players.get(x, x) if isinstance(x, str) else x for x in players]
+
+    return df
+
+
+def to_csv_frame(df):
+    """Convert an in-memory replay frame to the CSV layout (JSON `teams` column)."""
+    df = df.copy()
+    df["teams"] = [
+        json.dumps({"p1": list(p1), "p2": list(p2)})
+        for p1, p2 in zip(df["p1_team"].tolist(), df["p2_team"].tolist())
+    ]
+    return df.drop(columns=["p1_team", "p2_team"])
+
+
+def _is_parquet(path):
+    return str(path).endswith((".parquet", ".pq"))
+
+
+def save_replays(df, path):
+    """Write a replay frame to `path`.
+
+    `.parquet` files keep list-typed `players`/`p1_team`/`p2_team` columns
+    (requires pyarrow); anything else is written as CSV in the layout
+    `fetched_replays.csv` has always used.
+    """
+    if _is_parquet(path):
+        df.to_parquet(path, index=False)
+    else:
+        to_csv_frame(df).to_csv(path, index=False)
+
+
+def load_replays(path):
+    """Read a replay frame written by save_replays (or an older fetched_replays.csv)."""
+    if _is_parquet(path):
+        df = pd.read_parquet(path)
+        for column in ("players", "p1_team", "p2_team"):
+            if column in df.columns:
+                df[column] = [list(x) if x is not None else [] for x in df[column].tolist()]
+        return df
+    return normalize_replay_frame(pd.read_csv(path))
+
+
+def iter_replay_chunks(path, chunk_size=100_000):
+    """Yield a stored replay dataset as frames of at most `chunk_size` rows, in load_replays' layout.
+
+    Only one chunk is in memory at a time; formats are read as categoricals.
+    """
+    if _is_parquet(path):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            df = batch.to_pandas()
+            for column in ("players", "p1_team", "p2_team"):
+                if column in df.columns:
+                    df[column] = [list(x) if x is not None else [] for x in df[column].tolist()]
+            yield df
+    else:
+        for df in pd.read_csv(path, chunksize=chunk_size, dtype={"format": "category"}):
+            yield normalize_replay_frame(df)
+
+
+def drop_user_replays(path, username):
+    """Remove `username`'s replays from a stored replay dataset, keeping everyone else's.
+
+    A row belongs to the user whose name is in its `player_slot`, i.e. the
+    user it was fetched for; a game two synced users played is stored once
+    for each of them.
+    """
+    df = load_replays(path)
+    user = username.lower()
+    keep = [
+        not (isinstance(players, list) and len(players) == 2
+             and str(players[1 if slot == "p2" else 0]).lower() == user)
+        for players, slot in zip(df["players"].tolist(), df["player_slot"].tolist())
+    ] if "players" in df.columns else [True] * len(df)
+    save_replays(df[keep], path)
+
+
+def append_replays(df_new, path):
+    """Append rows to a stored replay dataset, creating it if needed."""
+    if not os.path.exists(path):
+        save_replays(df_new, path)
+    elif _is_parquet(path):
+        save_replays(pd.concat([load_replays(path), df_new], ignore_index=True), path)
+    else:
+        # Keep the stored column order so the appended rows line up
+        columns = pd.read_csv(path, nrows=0).columns.tolist()
+        to_csv_frame(df_new).reindex(columns=columns).to_csv(path, mode="a", header=False, index=False)
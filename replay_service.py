@@ -0,0 +1,451 @@
+"""Local HTTP/JSON service over the team registry, for dashboards and bots.
+
+Usage:
+    python replay_service.py [--host HOST] [--port PORT] [--registry PATH] [--watch USER ...]
+                             [--refresh-interval SECONDS] [--refresh-workers N] [--with-results]
+                             [--rps R] [--log-level LEVEL]
+
+Endpoints (all GET, JSON):
+
+    /health                          status, refresh jobs
+    /metrics                         instrumentation counters and timings
+    /users                           users in the registry, with their data version
+    /users/<user>/summary            games, date range, formats, results, top teams and Pokémon
+    /users/<user>/teams              team statistics (TeamRegistry.team_statistics)
+    /users/<user>/replays?limit=&offset=
+                                     processed replays, newest first
+    /users/<user>/usage?kind=team|species&days=30&format=LABEL&by_format=1
+                                     rolling usage (usage_timeseries.rolling_usage)
+    /users/<user>/refresh            state of the user's refresh job; POST starts one
+
+Reads are answered from the registry only and never wait on Showdown. New
+replays come in through background refresh jobs (team_registry.
+refresh_team_statistics), at most one per user at a time however many
+clients ask; a user not in the registry yet gets a 202 while the first one
+runs. Watched users are refreshed every --refresh-interval seconds.
+
+Responses are cached per user data version (TeamRegistry.version), and a
+refresh precomputes the summary, teams and default usage responses, so
+most reads are a dictionary lookup. Every response has an ETag derived
+from that version; a request with a matching If-None-Match gets a 304
+without the response being built at all.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import configure_logging, get_default_metrics
+from showdown_http import ShowdownClient
+from team_registry import TeamRegistry, get_default_registry, refresh_team_statistics
+from usage_timeseries import SPECIES, TEAM, day_dates
+
+# Responses kept in memory across all users and versions
+RESPONSE_CACHE_SIZE = 1024
+
+# Rows in a summary's top teams / top Pokémon lists
+SUMMARY_TOP = 10
+
+# /users/<user>/replays page size when no limit is given, and the largest allowed
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 5000
+
+log = logging.getLogger(__name__)
+metrics = get_default_metrics()
+
+
+class ServiceError(Exception):
+    """A request the service answers with an error status instead of a result."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def frame_records(frame):
+    """A DataFrame as a list of row dicts, missing values as None."""
+    return frame.astype(object).where(frame.notna(), None).to_dict("records")
+
+
+def encode_json(payload):
+    return json.dumps(payload, default=_json_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class RefreshJobs:
+    """Background refresh_team_statistics runs, at most one per user at a time.
+
+    submit() returns immediately; a user whose job is queued or running is
+    not queued again. on_refresh(user) is called after every finished job
+    (with new games or not), from the worker thread.
+    """
+
+    def __init__(self, registry, workers=2, client=None, cache=None, team_only=True, on_refresh=None):
+        self.registry = registry
+        self.client = client
+        self.cache = cache
+        self.team_only = team_only
+        self.on_refresh = on_refresh
+        self.lock = threading.Lock()
+        self.jobs = {}  # user -> status dict of the latest job
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="refresh")
+
+    def submit(self, username):
+        """Queue a refresh of `username` unless one is pending; returns the job's status."""
+        user = username.lower()
+        with self.lock:
+            job = self.jobs.get(user)
+            if job is not None and job["state"] in ("queued", "running"):
+                return dict(job)
+            job = self.jobs[user] = {"username": user, "state": "queued", "submitted": time.time(),
+                                     "started": None, "finished": None, "new_replays": None, "error": None}
+            self.executor.submit(self._run, user)
+            metrics.incr("service.refresh_jobs")
+            return dict(job)
+
+    def status(self, username):
+        with self.lock:
+            job = self.jobs.get(username.lower())
+            return dict(job) if job is not None else None
+
+    def all_statuses(self):
+        with self.lock:
+            return [dict(job) for job in self.jobs.values()]
+
+    def _run(self, user):
+        with self.lock:
+            self.jobs[user].update(state="running", started=time.time())
+        before = self.registry.replay_count(user)
+        try:
+            with metrics.timer("service.refresh_seconds"):
+                refresh_team_statistics(user, self.registry, client=self.client, cache=self.cache,
+                                        team_only=self.team_only)
+            new_replays = self.registry.replay_count(user) - before
+            if self.on_refresh is not None:
+                self.on_refresh(user)
+        except Exception as e:  # a failed job must not take the worker down
+            metrics.incr("service.refresh_errors")
+            log.error("❌ Refresh of '%s' failed: %s", user, e, extra={"username": user})
+            with self.lock:
+                self.jobs[user].update(state="failed", finished=time.time(), error=str(e))
+            return
+        with self.lock:
+            self.jobs[user].update(state="done", finished=time.time(), new_replays=new_replays)
+        log.info("🔄 Refreshed '%s': %d new replays", user, new_replays, extra={"username": user})
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class QueryService:
+    """The service's queries, response cache and refresh scheduling, without the HTTP layer.
+
+    Responses are (status, body bytes, etag). Bodies are cached per
+    (path, query, user data version), so a user's cached responses go stale
+    exactly when new games are ingested for them.
+    """
+
+    def __init__(self, registry=None, refresh_workers=2, client=None, cache=None, team_only=True,
+                 watch=(), refresh_interval=None):
+        self.registry = registry if registry is not None else get_default_registry()
+        self.jobs = RefreshJobs(self.registry, refresh_workers, client, cache, team_only, self.precompute)
+        self.responses = OrderedDict()
+        self.responses_lock = threading.Lock()
+        self.watch = {user.lower() for user in watch}
+        self.refresh_interval = refresh_interval
+        self.stopped = threading.Event()
+        self.scheduler = None
+
+    def start(self):
+        """Refresh watched users now, then every refresh_interval seconds (if set)."""
+        for user in self.watch:
+            self.jobs.submit(user)
+        if self.refresh_interval:
+            self.scheduler = threading.Thread(target=self._schedule, name="refresh-scheduler", daemon=True)
+            self.scheduler.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.jobs.shutdown()
+
+    def _schedule(self):
+        while not self.stopped.wait(self.refresh_interval):
+            for user in sorted(self.watch):
+                self.jobs.submit(user)
+
+    # --- responses ---
+
+    def etag(self, path, query, version):
+        digest = hashlib.sha1(f"{path}?{sorted(query.items())}#{version}".encode("utf-8")).hexdigest()
+        return f'"{digest[:20]}"'
+
+    def get(self, path, query, if_none_match=None):
+        """Answer a GET of `path` with `query` ({name: value}); returns (status, body, etag)."""
+        parts = [unquote(part) for part in path.strip("/").split("/") if part]
+        if parts == ["health"]:
+            return 200, encode_json({"status": "ok", "jobs": self.jobs.all_statuses()}), None
+        if parts == ["metrics"]:
+            return 200, encode_json(metrics.snapshot()), None
+        if parts == ["users"]:
+            return 200, encode_json(frame_records(self.registry.users())), None
+        if len(parts) != 3 or parts[0] != "users" or parts[2] not in USER_ROUTES:
+            raise ServiceError(404, f"Unknown path {path!r}")
+
+        username, route = parts[1], parts[2]
+        if route == "refresh":
+            job = self.jobs.status(username)
+            if job is None:
+                raise ServiceError(404, f"No refresh of {username!r} has run")
+            return 200, encode_json(job), None
+
+        version = self.registry.version(username)
+        if version is None:
+            # Fetch a new user once; after that only POST .../refresh tries again
+            job = self.jobs.status(username)
+            if job is not None and job["state"] == "done":
+                raise ServiceError(404, f"No replays found for {username!r}")
+            if job is not None and job["state"] == "failed":
+                raise ServiceError(502, f"Fetching {username!r} failed: {job['error']}")
+            job = self.jobs.submit(username)
+            return 202, encode_json({"status": "refreshing", "job": job}), None
+        etag = self.etag(path, query, version[0])
+        if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+            metrics.incr("service.not_modified")
+            return 304, b"", etag
+        return 200, self.response(username, route, query, version), etag
+
+    def response(self, username, route, query, version):
+        """Body of a user route, from the cache or freshly built."""
+        key = (username.lower(), route, tuple(sorted(query.items())), version[0])
+        with self.responses_lock:
+            body = self.responses.get(key)
+            if body is not None:
+                self.responses.move_to_end(key)
+                metrics.incr("service.cache_hits")
+                return body
+        metrics.incr("service.cache_misses")
+        with metrics.timer("service.build_seconds"):
+            payload = USER_ROUTES[route](self, username, query)
+            payload = {"username": username.lower(), "version": version[0], "updated": version[1], **payload}
+            body = encode_json(payload)
+        with self.responses_lock:
+            self.responses[key] = body
+            while len(self.responses) > RESPONSE_CACHE_SIZE:
+                self.responses.popitem(last=False)
+        return body
+
+    def precompute(self, username):
+        """Build the responses most clients ask for, right after a refresh, and drop older versions'."""
+        version = self.registry.version(username)
+        if version is None:
+            return
+        user = username.lower()
+        with self.responses_lock:
+            for key in [key for key in self.responses if key[0] == user and key[3] != version[0]]:
+                del self.responses[key]
+        for route in ("summary", "teams", "usage"):
+            self.response(user, route, {}, version)
+        self.response(user, "usage", {"kind": SPECIES}, version)
+
+    # --- user routes: (service, username, query) -> payload dict ---
+
+    def summary(self, username, query):
+        buckets = self.registry.daily_buckets(username)
+        games = buckets[buckets["Kind"] == TEAM]
+        per_format = games.groupby("Format")["Games"].sum().sort_values(ascending=False)
+        decided, wins = int(games["Decided"].sum()), int(games["Wins"].sum())
+        teams = self.registry.team_statistics(username).sort_values(
+            ["Times_Used", "Team ID"], ascending=[False, True], kind="stable")
+        species = self.registry.rolling_usage(username, SPECIES, days=30)
+        return {
+            "games": int(games["Games"].sum()),
+            "teams": int(teams["Team ID"].nunique()),
+            "first_day": day_dates([games["Day"].min()])[0].date().isoformat() if not games.empty else None,
+            "last_day": day_dates([games["Day"].max()])[0].date().isoformat() if not games.empty else None,
+            "formats": {str(name): int(count) for name, count in per_format.items()},
+            "decided": decided,
+            "wins": wins,
+            "win_rate": wins / decided if decided else None,
+            "top_teams": frame_records(teams.head(SUMMARY_TOP)),
+            "top_species_30d": frame_records(species.head(SUMMARY_TOP)),
+        }
+
+    def teams(self, username, query):
+        return {"teams": frame_records(self.registry.team_statistics(username))}
+
+    def replays(self, username, query):
+        limit = _int_param(query, "limit", DEFAULT_PAGE_SIZE, 1, MAX_PAGE_SIZE)
+        offset = _int_param(query, "offset", 0, 0, None)
+        page = self.registry.replays(username, limit, offset)
+        return {"total": self.registry.replay_count(username), "offset": offset, "replays": frame_records(page)}
+
+    def usage(self, username, query):
+        kind = query.get("kind", TEAM)
+        if kind not in (TEAM, SPECIES):
+            raise ServiceError(400, f"kind must be {TEAM!r} or {SPECIES!r}")
+        days = _int_param(query, "days", 30, 1, None)
+        by_format = query.get("by_format", "0").lower() in ("1", "true", "yes")
+        try:
+            usage = self.registry.rolling_usage(username, kind, days, query.get("format"), by_format)
+        except ValueError as e:  # unknown format label
+            raise ServiceError(400, str(e)) from None
+        return {"kind": kind, "days": days, "usage": frame_records(usage)}
+
+
+USER_ROUTES = {
+    "summary": QueryService.summary,
+    "teams": QueryService.teams,
+    "replays": QueryService.replays,
+    "usage": QueryService.usage,
+    "refresh": None,  # job status, answered in QueryService.get
+}
+
+
+def _int_param(query, name, default, minimum, maximum):
+    try:
+        value = int(query.get(name, default))
+    except ValueError:
+        raise ServiceError(400, f"{name} must be an integer") from None
+    if value < minimum or (maximum is not None and value > maximum):
+        raise ServiceError(400, f"{name} must be between {minimum} and {maximum or 'any'}")
+    return value
+
+
+class _ServiceHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class ReplayService:
+    """Threaded HTTP server in front of a QueryService.
+
+    Use as a context manager, or call start()/stop(); `url` is the base URL
+    clients should use.
+    """
+
+    def __init__(self, queries, host="127.0.0.1", port=8080):
+        self.queries = queries
+        self.server = _ServiceHTTPServer((host, port), self._handler_class())
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.queries.start()
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def serve_forever(self):
+        self.queries.start()
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.queries.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handler_class(self):
+        queries = self.queries
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+                metrics.incr("service.requests")
+                try:
+                    with metrics.timer("service.request_seconds"):
+                        status, body, etag = queries.get(url.path, query, self.headers.get("If-None-Match"))
+                except ServiceError as e:
+                    status, body, etag = e.status, encode_json({"error": str(e)}), None
+                except Exception as e:
+                    log.error("❌ Error answering %s: %s", self.path, e)
+                    status, body, etag = 500, encode_json({"error": "internal error"}), None
+                self.send(status, body, etag)
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                parts = [unquote(part) for part in url.path.strip("/").split("/") if part]
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))  # ignored
+                if len(parts) == 3 and parts[0] == "users" and parts[2] == "refresh":
+                    self.send(202, encode_json(queries.jobs.submit(parts[1])))
+                else:
+                    self.send(404, encode_json({"error": f"Unknown path {url.path!r}"}))
+
+            def send(self, status, body, etag=None):
+                self.send_response(status)
+                if status != 304:
+                    self.send_header("Content-Type", "application/json; charset=utf-8")
+                if etag is not None:
+                    self.send_header("ETag", etag)
+                    self.send_header("Cache-Control", "no-cache")  # revalidate with If-None-Match
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve replay statistics from the team registry over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on")
+    parser.add_argument("--registry", help="team registry database (default: SHOWDOWN_TEAM_REGISTRY)")
+    parser.add_argument("--watch", nargs="*", default=[], help="users to refresh at start and periodically")
+    parser.add_argument("--refresh-interval", type=float, help="seconds between refreshes of watched users")
+    parser.add_argument("--refresh-workers", type=int, default=2, help="users refreshed at the same time")
+    parser.add_argument("--with-results", action="store_true",
+                        help="download whole replays to record who won (slower; needed for win rates)")
+    parser.add_argument("--rps", type=float, default=10.0, help="maximum requests per second to Showdown")
+    parser.add_argument("--log-level", default="INFO", help="DEBUG, INFO, WARNING or ERROR")
+    args = parser.parse_args(argv)
+    configure_logging(args.log_level)
+
+    registry = TeamRegistry(args.registry) if args.registry else get_default_registry()
+    queries = QueryService(registry, args.refresh_workers, ShowdownClient(requests_per_second=args.rps),
+                           team_only=not args.with_results, watch=args.watch,
+                           refresh_interval=args.refresh_interval)
+    service = ReplayService(queries, args.host, args.port)
+    print(f"🌐 Serving on {service.url}", file=sys.stderr)
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        queries.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+import codecs
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from instrumentation import get_default_metrics
+
+log = logging.getLogger(__name__)
+
+# Overridable so the scrapers can be pointed at a local stub (see benchmarks/stub_server.py)
+REPLAY_BASE_URL = os.environ.get("SHOWDOWN_REPLAY_URL", "https://replay.pokemonshowdown.com")
+
+# Status codes that mean "slow down / try again" rather than a hard failure
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Network errors worth retrying (dropped connections, timeouts)
+RETRYABLE_EXCEPTIONS = (requests.ConnectionError, requests.Timeout)
+
+
+class TokenBucket:
+    """Thread-safe token bucket limiting how fast we hit Showdown.
+
+    Tokens refill at `rate` per second up to `capacity`. Every request takes
+    one token; `backoff` pauses all callers when the server pushes back.
+    """
+
+    def __init__(self, rate=10.0, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available, then consume it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def backoff(self, delay):
+        """Stop handing out tokens for `delay` seconds (e.g. after a 429)."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            self.tokens = 0.0
+
+
+class ShowdownClient:
+    """Pooled, rate-limited HTTP client shared by every scraper fetch path.
+
+    One `requests.Session` keeps connections alive across requests (so only
+    the first request to a host pays the TCP+TLS handshake), asks for gzip,
+    applies per-request timeouts, and retries 429/5xx responses and network
+    errors with jittered exponential backoff. All requests go through one
+    TokenBucket. `stats()` reports request latency and connection reuse.
+    """
+
+    def __init__(self, base_url=REPLAY_BASE_URL, requests_per_second=10.0, max_retries=4,
+                 base_delay=1.0, timeout=(5, 30), pool_size=16):
+        self.base_url = base_url.rstrip("/")
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.timeout = timeout
+        self.rate_limiter = TokenBucket(requests_per_second)
+        self.metrics = get_default_metrics()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Accept-Encoding": "gzip, deflate",
+            "User-Agent": "showdown-replay-analyzer",
+        })
+
+        self.stats_lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.bytes_received = 0
+        self.connections_dropped = 0  # streamed responses closed before their end
+        self.latencies = deque(maxlen=10000)  # seconds, most recent requests
+
+    def url(self, path):
+        """Absolute URL for a path on the replay server (absolute URLs pass through)."""
+        if path.startswith(("http://", "https://")):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def get(self, path, params=None, stream=False):
+        """GET `path`, retrying 429/5xx and network errors with jittered backoff.
+
+        Returns the last response received (which may still be an error
+        status); re-raises the network error if every attempt failed.
+        """
+        url = self.url(path)
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout, stream=stream)
+            except RETRYABLE_EXCEPTIONS as e:
+                self._record(time.perf_counter() - start, None, stream)
+                if attempt == self.max_retries:
+                    with self.stats_lock:
+                        self.failures += 1
+                    self.metrics.incr("http.failures")
+                    raise
+                delay = self._delay(attempt, None)
+                log.warning("⏳ %s for %s, retrying in %.1fs (attempt %d/%d)", type(e).__name__, url, delay,
+                            attempt + 1, self.max_retries,
+                            extra={"url": url, "error": type(e).__name__, "attempt": attempt + 1})
+            else:
+                self._record(time.perf_counter() - start, response, stream)
+                if response.status_code not in RETRYABLE_STATUS_CODES or attempt == self.max_retries:
+                    if response.status_code >= 400:
+                        with self.stats_lock:
+                            self.failures += 1
+                        self.metrics.incr("http.failures")
+                    return response
+                delay = self._delay(attempt, response)
+                log.warning("⏳ %d from %s, backing off %.1fs (attempt %d/%d)", response.status_code, url, delay,
+                            attempt + 1, self.max_retries,
+                            extra={"url": url, "status": response.status_code, "attempt": attempt + 1})
+            with self.stats_lock:
+                self.retries += 1
+            self.metrics.incr("http.retries")
+            self.rate_limiter.backoff(delay)
+
+    def search(self, params):
+        """GET search.json with the given query parameters."""
+        return self.get("search.json", params=params)
+
+    def replay_json(self, replay_id):
+        """GET the full JSON document of one replay."""
+        return self.get(f"{replay_id}.json")
+
+    def replay_log_head(self, replay_id, markers):
+        """Stream the plain-text log of one replay only up to the first of `markers`.
+
+        Returns (status_code, text before the marker); see get_text_until.
+        """
+        return self.get_text_until(f"{replay_id}.log", markers)
+
+    def get_text_until(self, path, markers, chunk_size=2048, drain_bytes=4096):
+        """GET a UTF-8 text body, reading it only until one of `markers` appears.
+
+        Returns (status_code, text) where text stops just before the first
+        marker, or is the whole body if no marker occurs ("" on errors). The
+        rest of the body is not downloaded: if at most `drain_bytes` of it are
+        left they are read and discarded so the connection can be reused,
+        otherwise the connection is closed.
+        """
+        response = self.get(path, stream=True)
+        if response.status_code != 200:
+            self._finish_stream(response, drain_bytes)
+            return response.status_code, ""
+
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        longest = max(len(marker) for marker in markers)
+        text = ""
+        end = -1
+        try:
+            for chunk in response.iter_content(chunk_size):
+                # A marker may straddle two chunks, so rescan the tail of the previous one
+                scan_from = max(0, len(text) - longest + 1)
+                text += decoder.decode(chunk)
+                found = [i for i in (text.find(marker, scan_from) for marker in markers) if i != -1]
+                if found:
+                    end = min(found)
+                    break
+            else:
+                text += decoder.decode(b"", final=True)
+        finally:
+            self._finish_stream(response, drain_bytes)
+        return response.status_code, text if end == -1 else text[:end]
+
+    def _finish_stream(self, response, drain_bytes):
+        """Drain a short unread remainder (keeping the connection) or drop the connection, and count the bytes."""
+        raw = response.raw
+        try:
+            length = response.headers.get("Content-Length", "")
+            limit = raw.tell() + drain_bytes
+            if not length.isdigit() or int(length) <= limit:
+                while raw.tell() < limit and raw.read(min(8192, limit - raw.tell()), decode_content=False):
+                    pass
+            finished = raw.tell() == int(length) if length.isdigit() else not raw.read(1, decode_content=False)
+        except Exception:
+            finished = False
+        self.add_bytes(raw.tell())
+        if not finished:
+            with self.stats_lock:
+                self.connections_dropped += 1
+            self.metrics.incr("http.streams_cut_short")
+        response.close()
+
+    def _delay(self, attempt, response):
+        retry_after = response.headers.get("Retry-After", "") if response is not None else ""
+        if retry_after.isdigit():
+            return float(retry_after)
+        return self.base_delay * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+    def _record(self, elapsed, response, stream=False):
+        # Streamed bodies are counted by whoever reads them (see add_bytes)
+        size = len(response.content) if response is not None and not stream else 0
+        with self.stats_lock:
+            self.requests += 1
+            self.latencies.append(elapsed)
+            self.bytes_received += size
+        self.metrics.incr("http.requests")
+        self.metrics.incr("http.bytes_received", size)
+        self.metrics.observe("http.request_seconds", elapsed)
+
+    def add_bytes(self, count):
+        """Count bytes read from a streamed response."""
+        with self.stats_lock:
+            self.bytes_received += count
+        self.metrics.incr("http.bytes_received", count)
+
+    def connections_opened(self):
+        """Number of TCP connections the session's pools have opened so far."""
+        # A connection closed mid-body is reopened by the same pool slot, so count those too
+        with self.stats_lock:
+            opened = self.connections_dropped
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is not None:
+                    opened += pool.num_connections
+        return opened
+
+    def stats(self):
+        """Request counts, latency percentiles and connection reuse so far."""
+        with self.stats_lock:
+            latencies = sorted(self.latencies)
+            requests_made = self.requests
+            retries, failures, bytes_received = self.retries, self.failures, self.bytes_received
+        opened = self.connections_opened()
+
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+        return {
+            "requests": requests_made,
+            "retries": retries,
+            "failures": failures,
+            "bytes_received": bytes_received,
+            "latency_ms_avg": sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+            "latency_ms_p50": percentile(0.5),
+            "latency_ms_p95": percentile(0.95),
+            "connections_opened": opened,
+            "connections_reused": max(0, requests_made - opened),
+        }
+
+    def close(self):
+        self.session.close()
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_default_client():
+    """Shared client used by the scrapers when no client is passed explicitly."""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = ShowdownClient()
+        return _default_client
+
+
+def format_stats(stats):
+    """One-line summary of ShowdownClient.stats() for logs."""
+    return (
+        f"{stats['requests']} requests over {stats['connections_opened']} connections "
+        f"({stats['connections_reused']} reused), {stats['retries']} retries, "
+        f"avg {stats['latency_ms_avg']:.0f} ms, p95 {stats['latency_ms_p95']:.0f} ms"
+    )
@@ -0,0 +1,266 @@
+"""Single-pass tokenizer for the Pokémon Showdown battle-log protocol.
+
+A replay log is a sequence of lines like ``|poke|p1|Incineroar, L50, F|`` or
+``|move|p1a: Rillaboom|Fake Out|p2a: Amoonguss``. `iter_events` walks the log
+once with a regex that only matches the tags the caller asked for, only
+splits those lines, and yields small typed events. Callers can stop early,
+either by breaking out of the loop or by passing `until` tags (e.g. stop at
+``|start``); the stop line is found with `str.find` first, so nothing past
+it is scanned. parse_team_preview, parse_header_metadata and parse_winner,
+which the scrapers use, are built on it.
+"""
+import re
+from functools import lru_cache
+from typing import NamedTuple
+
+
+class PlayerEvent(NamedTuple):
+    slot: str
+    name: str
+
+
+class PokeEvent(NamedTuple):
+    slot: str
+    species: str
+    details: str
+
+
+class SwitchEvent(NamedTuple):
+    position: str
+    species: str
+    details: str
+    hp: str
+
+
+class MoveEvent(NamedTuple):
+    position: str
+    move: str
+    target: str
+
+
+class TurnEvent(NamedTuple):
+    number: int
+
+
+class FaintEvent(NamedTuple):
+    position: str
+
+
+class TeraEvent(NamedTuple):
+    position: str
+    tera_type: str
+
+
+class TierEvent(NamedTuple):
+    name: str
+
+
+class TimestampEvent(NamedTuple):
+    time: int
+
+
+class WinEvent(NamedTuple):
+    name: str
+
+
+class TieEvent(NamedTuple):
+    pass
+
+
+class TeamPreviewEvent(NamedTuple):
+    pass
+
+
+class StartEvent(NamedTuple):
+    pass
+
+
+def _player(args):
+    # "|player|p1|" (no name) is sent when a player leaves; it carries no mapping
+    if len(args) < 2 or not args[1]:
+        return None
+    return PlayerEvent(args[0], args[1])
+
+
+def _poke(args):
+    if len(args) < 2:
+        return None
+    details = args[1]
+    return PokeEvent(args[0], details.split(",", 1)[0], details)
+
+
+def _switch(args):
+    if len(args) < 2:
+        return None
+    details = args[1]
+    return SwitchEvent(args[0], details.split(",", 1)[0], details, args[2] if len(args) > 2 else "")
+
+
+def _move(args):
+    if len(args) < 2:
+        return None
+    return MoveEvent(args[0], args[1], args[2] if len(args) > 2 else "")
+
+
+def _turn(args):
+    try:
+        return TurnEvent(int(args[0]))
+    except (IndexError, ValueError):
+        return None
+
+
+def _faint(args):
+    return FaintEvent(args[0]) if args else None
+
+
+def _tera(args):
+    if len(args) < 2:
+        return None
+    return TeraEvent(args[0], args[1])
+
+
+def _tier(args):
+    return TierEvent(args[0]) if args else None
+
+
+def _timestamp(args):
+    try:
+        return TimestampEvent(int(args[0]))
+    except (IndexError, ValueError):
+        return None
+
+
+def _win(args):
+    return WinEvent(args[0]) if args else None
+
+
+# Protocol tag -> event builder. Builders get the "|"-separated fields after the tag.
+EVENT_BUILDERS = {
+    "player": _player,
+    "poke": _poke,
+    "switch": _switch,
+    "drag": _switch,
+    "replace": _switch,
+    "move": _move,
+    "turn": _turn,
+    "faint": _faint,
+    "-terastallize": _tera,
+    "tier": _tier,
+    "t:": _timestamp,
+    "win": _win,
+    "tie": lambda args: TieEvent(),
+    "teampreview": lambda args: TeamPreviewEvent(),
+    "start": lambda args: StartEvent(),
+}
+
+# Tags after which no more |player|/|poke| lines can appear
+TEAM_PREVIEW_END = frozenset({"teampreview", "start"})
+
+# Tags read by parse_team_preview, parse_header_metadata and parse_winner
+TEAM_PREVIEW_KINDS = frozenset({"player", "poke"})
+HEADER_METADATA_KINDS = frozenset({"tier", "t:"})
+RESULT_KINDS = frozenset({"win", "tie"})
+
+# The same boundary as it appears in raw log text (used to stop downloads early)
+TEAM_PREVIEW_MARKERS = ("\n|teampreview", "\n|start")
+
+
+@lru_cache(maxsize=64)
+def _line_pattern(kinds):
+    """Regex matching the lines whose tag is in `kinds` (None: any tag with a builder), with the "\n" before them.
+
+    Group 1 is the tag, group 2 the rest of the line from its "|" on ("" if
+    the line is just the tag). Starting at a literal "\n|" lets the regex
+    engine skip from line to line instead of trying every character.
+    """
+    tags = EVENT_BUILDERS if kinds is None else kinds
+    alternatives = "|".join(re.escape(tag) for tag in sorted(tags, key=len, reverse=True))
+    return re.compile(rf"\n\|({alternatives})(\|[^\n]*)?$", re.MULTILINE)
+
+
+def _until_index(text, until):
+    """Index of the "\n" before the first line tagged with one of `until` (len(text) if none is)."""
+    end = len(text)
+    for tag in until:
+        marker = "\n|" + tag
+        i = text.find(marker, 0, end)
+        while i != -1:
+            after = i + len(marker)
+            if after == len(text) or text[after] in "|\n":
+                end = i
+                break
+            i = text.find(marker, after, end)
+    return end
+
+
+def iter_events(log, kinds=None, until=None):
+    """Yield typed events from a battle log in a single pass.
+
+    kinds: optional set of protocol tags (keys of EVENT_BUILDERS) to emit;
+        lines with other tags are skipped without being split.
+    until: optional set of tags; iteration stops when the first of them is
+        reached (that line itself is not emitted).
+    """
+    text = "\n" + log  # so the first line starts with "\n|" like the others
+    end = _until_index(text, until) if until is not None else len(text)
+    builders = EVENT_BUILDERS
+    for tag, rest in _line_pattern(None if kinds is None else frozenset(kinds)).findall(text, 0, end):
+        event = builders[tag](rest[1:].split("|") if rest else [])
+        if event is not None:
+            yield event
+
+
+def parse_team_preview(log):
+    """Return (teams, players) from the team-preview header of a log.
+
+    teams is {"p1": [species, ...], "p2": [...]} in log order and players maps
+    slot -> player name. Tokenizing stops at |teampreview / |start, and only
+    |player| and |poke| lines are split.
+    """
+    teams = {"p1": [], "p2": []}
+    players = {}
+    for event in iter_events(log, kinds=TEAM_PREVIEW_KINDS, until=TEAM_PREVIEW_END):
+        if type(event) is PokeEvent:
+            team = teams.get(event.slot)
+            if team is not None:
+                team.append(event.species)
+        else:
+            players[event.slot] = event.name
+    return teams, players
+
+
+def parse_header_metadata(log):
+    """Return {"format": ..., "started": ...} from the team-preview header of a log.
+
+    format is the |tier| name (e.g. "[Gen 9] VGC 2024 Reg G") and started the
+    first |t:| timestamp; either is None if the header doesn't have it. This
+    lets a caller that only downloaded the header do without the replay JSON.
+    """
+    metadata = {"format": None, "started": None}
+    for event in iter_events(log, kinds=HEADER_METADATA_KINDS, until=TEAM_PREVIEW_END):
+        if type(event) is TierEvent:
+            if metadata["format"] is None:
+                metadata["format"] = event.name
+        elif metadata["started"] is None:
+            metadata["started"] = event.time
+        if metadata["format"] is not None and metadata["started"] is not None:
+            break
+    return metadata
+
+
+# parse_winner's value for a tied game; "|" can't appear in a username, so this is never a player
+TIE = "|tie"
+
+
+def parse_winner(log):
+    """Return the winner's name from a full log, TIE for a tie, or None if the log has no result.
+
+    The result is on one of the last lines, so only the log from the last
+    |win| (or |tie|) line on is tokenized.
+    """
+    for marker in ("\n|win|", "\n|tie"):
+        start = log.rfind(marker)
+        if start != -1:
+            for event in iter_events(log[start + 1:], kinds=RESULT_KINDS):
+                return TIE if type(event) is TieEvent else event.name
+    return None
@@ -1,7 +1,40 @@
-import requests
 import json
+import logging
+import multiprocessing
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from dataclasses import dataclass
 from datetime import datetime
 import pandas as pd
+import requests
+from instrumentation import get_default_metrics
+from replay_cache import get_default_cache
+from showdown_http import format_stats, get_default_client
+from showdown_protocol import TEAM_PREVIEW_MARKERS, parse_header_metadata, parse_team_preview
+
+# Fields of a replay's JSON that process_replay_csv's rows are built from
+REPLAY_FIELDS = ("format", "players", "uploadtime")
+
+# Errors that fail one replay's download; they are recorded as that URL's failure (ValueError: a malformed URL)
+DOWNLOAD_EXCEPTIONS = (requests.RequestException, ValueError)
+
+log = logging.getLogger(__name__)
+metrics = get_default_metrics()
+
+@dataclass(slots=True)
+class FetchedReplay:
+    """A replay URL on its way through download and parsing.
+
+    replay_data (REPLAY_FIELDS of the replay JSON) and parsed (teams and
+    players) are set once known; raw is downloaded JSON text still to be
+    parsed; error says why the replay was given up on.
+    """
+    replay_url: str
+    replay_data: dict = None
+    parsed: dict = None
+    raw: str = None
+    error: str = None
 
 def format_upload_time(timestamp):
     """Convert Unix timestamp to MM-DD-YYYY format."""
@@ -22,19 +55,126 @@ def generate_team_id(team, existing_teams):
         existing_teams[sorted_team] = new_id
         return new_id
 
-def get_showdown_replay_data(username, replay_url, existing_teams):
-    """Fetch replay data and extract match details based on username."""
-    json_url = replay_url + ".json"
+def replay_id_from_url(replay_url):
+    """Return the replay id (last path segment) of a replay URL."""
+    return replay_url.rstrip("/").rsplit("/", 1)[-1]
 
-    response = requests.get(json_url)
-    if response.status_code != 200:
-        return None
+def fetch_replay_header(replay_url, cache, client):
+    """Download a replay's log only up to team preview and parse teams, players, format and start time.
+
+    Returns (parsed, None), parsed also being stored in `cache`, or (None, reason) on failure.
+    """
+    replay_id = replay_id_from_url(replay_url)
+    log_url = replay_url + ".log"
+    try:
+        with metrics.timer("replay.download_seconds"):
+            status_code, header = client.get_text_until(log_url, TEAM_PREVIEW_MARKERS)
+    except DOWNLOAD_EXCEPTIONS as e:
+        metrics.incr("replay.download_errors")
+        log.error("❌ Error fetching %s: %s", log_url, e, extra={"replay_id": replay_id})
+        return None, f"download failed: {e}"
+    if status_code != 200:
+        metrics.incr("replay.download_errors")
+        return None, f"HTTP {status_code}"
+
+    metrics.incr("replay.downloads")
+    metrics.observe("replay.download_bytes", len(header.encode("utf-8")))
+    with metrics.timer("replay.parse_seconds"):
+        teams, players = parse_team_preview(header)
+        parsed = {"teams": teams, "players": players, **parse_header_metadata(header)}
+    cache.put(replay_id, parsed=parsed)
+    return parsed, None
 
+def parse_replay_json(text):
+    """Return (replay_data, parsed) for a replay's JSON text, or (None, None) if it isn't valid JSON.
+
+    replay_data keeps only the REPLAY_FIELDS rows are built from. This is a
+    plain module-level function so that it can run in parse worker processes.
+    """
     try:
-        replay_data = response.json()
+        replay_data = json.loads(text)
     except json.JSONDecodeError:
-        return None
+        return None, None
+    teams, players = parse_team_preview(replay_data.get('log', ''))
+    return slim_replay_data(replay_data), {"teams": teams, "players": players}
+
+def slim_replay_data(replay_data):
+    return {key: replay_data[key] for key in REPLAY_FIELDS if key in replay_data}
+
+def download_replay(replay_url, cache, client, team_only=False):
+    """Look a replay up in `cache`, downloading what is missing; return a FetchedReplay.
+
+    Team-only headers are parsed straight away (they are a few hundred
+    bytes). A downloaded replay JSON is left in `raw` for parse_replay_json
+    (see finish_replay), so that it can be parsed in another process.
+    """
+    fetched = FetchedReplay(replay_url)
+    replay_id = replay_id_from_url(replay_url)
+
+    entry = cache.get(replay_id)
+    replay_data, parsed = entry if entry is not None else (None, None)
+    if replay_data is not None:
+        if parsed is None:
+            teams, players = parse_team_preview(replay_data.get('log', ''))
+            parsed = {"teams": teams, "players": players}
+            cache.put(replay_id, parsed=parsed)
+        fetched.replay_data, fetched.parsed = slim_replay_data(replay_data), parsed
+        return fetched
+
+    if team_only:
+        if parsed is None or "format" not in parsed:
+            parsed, fetched.error = fetch_replay_header(replay_url, cache, client)
+            if parsed is None:
+                return fetched
+        fetched.parsed = parsed
+        fetched.replay_data = {
+            "format": parsed["format"] or "Unknown Format",
+            "players": [parsed["players"][slot] for slot in ("p1", "p2") if slot in parsed["players"]],
+            "uploadtime": parsed["started"],
+        }
+        return fetched
+
+    json_url = replay_url + ".json"
+    try:
+        with metrics.timer("replay.download_seconds"):
+            response = client.get(json_url)
+    except DOWNLOAD_EXCEPTIONS as e:
+        metrics.incr("replay.download_errors")
+        log.error("❌ Error fetching %s: %s", json_url, e, extra={"replay_id": replay_id})
+        fetched.error = f"download failed: {e}"
+        return fetched
+    if response.status_code != 200:
+        metrics.incr("replay.download_errors")
+        fetched.error = f"HTTP {response.status_code}"
+        return fetched
+
+    metrics.incr("replay.downloads")
+    metrics.observe("replay.download_bytes", len(response.content))
+    fetched.raw = response.text
+    return fetched
+
+def finish_replay(fetched, cache, replay_data, parsed):
+    """Store parse_replay_json's result for a downloaded replay in `fetched` and `cache`."""
+    if replay_data is None:
+        fetched.error = "invalid replay JSON"
+    else:
+        fetched.replay_data, fetched.parsed = replay_data, parsed
+        cache.put(replay_id_from_url(fetched.replay_url), raw=fetched.raw, parsed=parsed)
+    fetched.raw = None
+    return fetched
+
+def load_replay(replay_url, cache, client, team_only=False):
+    """download_replay plus, for a downloaded replay JSON, parsing it in this thread."""
+    fetched = download_replay(replay_url, cache, client, team_only)
+    if fetched.raw is not None:
+        with metrics.timer("replay.parse_seconds"):
+            replay_data, parsed = parse_replay_json(fetched.raw)
+        finish_replay(fetched, cache, replay_data, parsed)
+    return fetched
 
+def build_replay_row(username, fetched):
+    """Return (row, team) for a fetched replay: its process_replay_csv row, less the Team ID, and the user's team."""
+    replay_data, parsed = fetched.replay_data, fetched.parsed
     match_format = replay_data.get('format', 'Unknown Format')
     players = replay_data.get("players", [])
     match_title = f"{match_format}: {' vs. '.join(players)}" if len(players) >= 2 else "Unknown Title"
@@ -62,62 +202,177 @@ def get_showdown_replay_data(username, replay_url, existing_teams):
     if not player_slot:
         player_slot = 'p1'
 
-    # Extract Pokémon team from log
-    team = set()
-    for line in replay_data.get('log', '').split('\n'):
-        if f"|poke|{player_slot}|" in line:
-            pokemon_name = line.split('|')[3].split(',')[0]
-            team.add(pokemon_name)
+    # Pokémon team parsed from the log, sorted so a team always reads (and groups) the same
+    team = sorted(set(parsed["teams"].get(player_slot, [])))
 
-    team_id = generate_team_id(team, existing_teams)  # Assign simple numerical ID
-
-    return {
+    row = {
         'Match Title': match_title,
         'Match Date': match_date,
-        'Replay URL': replay_url,
+        'Replay URL': fetched.replay_url,
         'Exact User Name Match': "Yes" if exact_user_match else "No",
         'Team': ', '.join(team) if team else "Unknown",
-        'Team ID': team_id
     }
+    return row, team
+
+def get_showdown_replay_data(username, replay_url, existing_teams, cache=None, client=None, team_only=False):
+    """Fetch replay data and extract match details based on username.
+
+    The replay JSON and its parsed teams are looked up in `cache` (the shared
+    on-disk cache by default) before going to the network through `client`
+    (the shared pooled ShowdownClient by default).
+
+    With team_only, only the start of the replay's log is downloaded (see
+    fetch_replay_header). The format and players then come from the log's
+    |tier| and |player| lines, and the match date from the battle's start
+    time instead of its upload time, so a game uploaded after midnight can
+    be dated a day earlier.
+    """
+    if cache is None:
+        cache = get_default_cache()
+    if client is None:
+        client = get_default_client()
+
+    fetched = load_replay(replay_url, cache, client, team_only)
+    if fetched.error is not None:
+        return None
+    row, team = build_replay_row(username, fetched)
+    row['Team ID'] = generate_team_id(team, existing_teams)  # Assign simple numerical ID
+    return row
+
+def fetch_replay_rows(username, replay_urls, cache=None, client=None, team_only=False, max_workers=8,
+                      parse_processes=0, registry=None):
+    """Fetch and parse many replay URLs concurrently; return (rows, failures).
+
+    Downloads run on `max_workers` threads. Downloaded replay JSON is parsed
+    in the download threads, or in `parse_processes` worker processes when
+    that is > 0; that only pays off when thousands of full replays come in
+    faster than one core can decode them (e.g. from a local mirror), as the
+    workers take a second or so to start. Each distinct URL is fetched once.
+
+    rows are get_showdown_replay_data's rows in the order of `replay_urls`,
+    with Team IDs assigned in that order too, so the result doesn't depend on
+    which download finishes first; with a team_registry.TeamRegistry they are
+    its persistent IDs instead. failures has a {"Replay URL", "Error"} dict
+    per URL that could not be fetched or parsed.
+    """
+    if cache is None:
+        cache = get_default_cache()
+    if client is None:
+        client = get_default_client()
+    unique_urls = list(dict.fromkeys(replay_urls))
+
+    fetched = {}
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as downloads, \
+            (ProcessPoolExecutor(parse_processes, mp_context=multiprocessing.get_context("spawn"))
+             if parse_processes else nullcontext()) as parser:
+        task = download_replay if parser is not None else load_replay
+        pending = {downloads.submit(task, url, cache, client, team_only): url for url in unique_urls}
+        parsing = {}
+        while pending or parsing:
+            done, _ = wait(set(pending) | set(parsing), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in pending:
+                    item = fetched[pending.pop(future)] = future.result()
+                    if item.raw is not None:
+                        parsing[parser.submit(parse_replay_json, item.raw)] = item
+                else:
+                    item = parsing.pop(future)
+                    try:
+                        replay_data, parsed = future.result()
+                    except Exception as e:  # a crashed worker process must not lose the whole upload
+                        log.error("❌ Error parsing %s: %s", item.replay_url, e)
+                        replay_data, parsed = None, None
+                    finish_replay(item, cache, replay_data, parsed)
+
+    existing_teams = {}
+    rows, teams, failures = [], [], []
+    for url in replay_urls:
+        item = fetched[url]
+        if item.error is not None:
+            failures.append({"Replay URL": url, "Error": item.error})
+            continue
+        row, team = build_replay_row(username, item)
+        row['Team ID'] = generate_team_id(team, existing_teams)
+        rows.append(row)
+        teams.append(team)
+
+    if registry is not None and existing_teams:
+        team_ids = dict(zip(existing_teams, registry.team_ids(list(existing_teams)).tolist()))
+        for row, team in zip(rows, teams):
+            if team:
+                row['Team ID'] = team_ids[",".join(sorted(team))]
+
+    metrics.incr("replay.failures", len(failures))
+    if failures:
+        reasons = Counter(failure["Error"] for failure in failures)
+        log.warning("⚠ %d of %d replays failed: %s", len(failures), len(replay_urls),
+                    ", ".join(f"{reason} ({count})" for reason, count in reasons.most_common(5)))
+    return rows, failures
 
-def process_replay_csv(username, csv_file, output_file="processed_replays.csv", team_stats_file="team_statistics.csv"):
-    """Process fetched replay URLs, extract data, and generate statistics."""
-    print(f"📂 Loading CSV: {csv_file}")
+def process_replay_csv(username, csv_file, output_file="processed_replays.csv", team_stats_file="team_statistics.csv", cache=None, client=None, team_only=False,
+                       max_workers=8, parse_processes=0, failures_file="failed_replays.csv", registry=None):
+    """Process fetched replay URLs, extract data, and generate statistics.
+
+    team_only downloads only the team-preview part of each log (see get_showdown_replay_data).
+    max_workers / parse_processes / registry: see fetch_replay_rows. URLs that
+    could not be processed are listed in `failures_file`, if there are any.
+    """
+    log.info("📂 Loading CSV: %s", csv_file)
 
     df_input = pd.read_csv(csv_file)
 
     if "replay_url" not in df_input.columns:
-        print("❌ CSV file is missing 'replay_url' column!")
+        log.error("❌ CSV file is missing 'replay_url' column!")
         return pd.DataFrame(), pd.DataFrame()
 
-    replay_urls = df_input["replay_url"].dropna().tolist()
-    print(f"🔍 Found {len(replay_urls)} replay URLs for processing.")
+    df_output, team_stats, failures = process_replay_urls(
+        username, df_input["replay_url"].dropna().tolist(), output_file, team_stats_file, cache, client,
+        team_only, max_workers, parse_processes, registry)
+    if failures_file and not failures.empty:
+        failures.to_csv(failures_file, index=False)
+        log.info("⚠ Failed replay URLs saved to %s", failures_file)
+    return df_output, team_stats
 
-    existing_teams = {}
-    results = []
-    for url in replay_urls:
-        data = get_showdown_replay_data(username, url, existing_teams)
-        if data:
-            results.append(data)
+def process_replay_urls(username, replay_urls, output_file=None, team_stats_file=None, cache=None, client=None,
+                        team_only=False, max_workers=8, parse_processes=0, registry=None):
+    """process_replay_csv for a list of replay URLs; returns (df_output, team_stats, failures).
+
+    failures is a frame of the URLs that could not be fetched or parsed, with
+    the reason in its "Error" column. The output tables are written to
+    `output_file` / `team_stats_file` when those are given.
+    """
+    log.info("🔍 Found %d replay URLs for processing.", len(replay_urls))
+
+    results, failures = fetch_replay_rows(username, replay_urls, cache, client, team_only, max_workers,
+                                          parse_processes, registry)
+    failures = pd.DataFrame(failures, columns=["Replay URL", "Error"])
+
+    cache_stats = (cache or get_default_cache()).stats()
+    log.info("💾 Replay cache: %d hits, %d misses", cache_stats['hits'], cache_stats['misses'])
+    log.info("🔌 HTTP: %s", format_stats((client or get_default_client()).stats()))
 
     if not results:
-        print("❌ No valid replay data found!")
-        return pd.DataFrame(), pd.DataFrame()
+        log.error("❌ No valid replay data found!")
+        return pd.DataFrame(), pd.DataFrame(), failures
 
     df_output = pd.DataFrame(results)
-    df_output.to_csv(output_file, index=False)
-    print(f"✅ Processed replay data saved to {output_file}")
+    if output_file:
+        df_output.to_csv(output_file, index=False)
+        log.info("✅ Processed replay data saved to %s", output_file)
 
     # Generate team statistics based on unique Team ID
-    df_output['Match Date'] = pd.to_datetime(df_output['Match Date'], format="%m-%d-%Y", errors='coerce')
-    df_output['Last Used'] = df_output.groupby('Team ID')['Match Date'].transform('max')
+    with metrics.timer("stats.aggregate_seconds"):
+        df_output['Match Date'] = pd.to_datetime(df_output['Match Date'], format="%m-%d-%Y", errors='coerce')
+        df_output['Last Used'] = df_output.groupby('Team ID')['Match Date'].transform('max')
 
-    team_stats = df_output.groupby(['Team ID', 'Team', 'Exact User Name Match']).agg(
-        Count=('Match Title', 'count'),
-        Last_Used=('Last Used', 'max')
-    ).reset_index()
+        team_stats = df_output.groupby(['Team ID', 'Team', 'Exact User Name Match']).agg(
+            Count=('Match Title', 'count'),
+            Last_Used=('Last Used', 'max')
+        ).reset_index()
+    metrics.incr("stats.rows", len(df_output))
 
-    team_stats.to_csv(team_stats_file, index=False)
-    print(f"✅ Team stats saved to {team_stats_file}")
+    if team_stats_file:
+        team_stats.to_csv(team_stats_file, index=False)
+        log.info("✅ Team stats saved to %s", team_stats_file)
 
-    return df_output, team_stats
+    return df_output, team_stats, failures
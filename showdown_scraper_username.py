@@ -1,69 +1,373 @@
-import requests
+import numpy as np
 import pandas as pd
+import heapq
+import itertools
 import json
-import time
-import ast 
+import logging
 import re
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation import get_default_metrics
+from matchups import resolve_results
+from replay_cache import get_default_cache
+from replay_formats import get_format
+from showdown_http import RETRYABLE_EXCEPTIONS, format_stats, get_default_client
+from showdown_protocol import TEAM_PREVIEW_MARKERS, parse_header_metadata, parse_team_preview, parse_winner
+from team_index import TeamIndex
+from team_key_store import TeamKeyStore
+from replay_records import (
+    ReplayRecord, ReplayTeams, append_replays, drop_user_replays, iter_replay_chunks, load_replays,
+    normalize_replay_frame, records_to_frame, save_replays
+)
+
+SYNC_STATE_FILE = "sync_state.json"
+
+# Columns of process_replays' processed replay table
+OUTPUT_COLUMNS = ['Team ID', 'Archetype', 'Match Title', 'Match Date', 'Replay URL', 'Team', 'Result']
+
+# Teams sharing at least this many Pokémon with an archetype's leading team belong to it
+ARCHETYPE_MIN_SHARED = 5
+
+log = logging.getLogger(__name__)
+metrics = get_default_metrics()
+
+def fetch_replays_by_username(username, max_workers=8, client=None, cache=None,
+                              save_path="fetched_replays.csv", formats=None, team_only=True):
+    """Fetch replays for a given username using Showdown's API
+
+    Search pages are walked on the calling thread while replay logs are
+    downloaded concurrently on a thread pool. All requests go through
+    `client` (the shared pooled, rate-limited ShowdownClient by default).
+    Replays already in `cache` (the shared on-disk cache by default) are
+    not downloaded again. `formats` (a replay_formats label or ReplayFormat)
+    restricts the fetch to those formats before any log is downloaded.
+    team_only=False downloads whole replays so the `winner` column is filled
+    in (see fetch_parsed_replay); by default only teams are fetched.
+
+    Returns an in-memory replay frame (see replay_records.records_to_frame)
+    that can go straight into `process_replays`. It is also written to
+    `save_path` (CSV, or Parquet for a `.parquet` path) unless that is None.
+    """
+    if client is None:
+        client = get_default_client()
+    if cache is None:
+        cache = get_default_cache()
 
-SHOWDOWN_API_URL = "https://replay.pokemonshowdown.com/search.json"
+    records = []
+    for batch in iter_replay_batches(username, max_workers=max_workers, client=client, cache=cache,
+                                     formats=formats, team_only=team_only):
+        records.extend(batch)
+
+    cache_stats = cache.stats()
+    log.info("💾 Replay cache: %d hits, %d misses", cache_stats['hits'], cache_stats['misses'])
+    log.info("🔌 HTTP: %s", format_stats(client.stats()))
+
+    if not records:
+        return pd.DataFrame()
+
+    df = records_to_frame(records)
+    if save_path:
+        save_replays(df, save_path)
+        log.info("✅ Saved %d replays to %s", len(df), save_path)
+    return df
+
+
+def iter_replay_batches(username, max_workers=8, client=None, cache=None, lookahead=2, formats=None,
+                        team_only=True):
+    """Yields a user's replays page by page, as lists of ReplayRecords.
+
+    Each search page's log downloads are queued on a thread pool as soon as
+    the page arrives, and up to `lookahead` further pages are fetched while
+    they run. A page is yielded, in search order, once all of its logs are
+    in, so the first batch is available after roughly one page's latency.
+    Only replays in `formats` are listed (see iter_user_search_pages).
+    """
+    if client is None:
+        client = get_default_client()
+    if cache is None:
+        cache = get_default_cache()
+
+    log.info("🔍 Searching for replays of '%s'...", username, extra={"username": username})
+
+    pending_pages = deque()  # each entry: [(replay, future), ...] for one page
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for replays in iter_user_search_pages(username, client, formats):
+            # Queue the log downloads and keep walking pages while they run
+            pending_pages.append([
+                (replay, pool.submit(fetch_team_from_replay, replay["id"], username, client, cache, team_only))
+                for replay in replays
+            ])
+            while pending_pages and (
+                len(pending_pages) > lookahead or all(future.done() for _, future in pending_pages[0])
+            ):
+                yield _collect_records(pending_pages.popleft())
+
+        while pending_pages:
+            yield _collect_records(pending_pages.popleft())
+
+
+def iter_user_search_pages(username, client=None, formats=None, page_size=50):
+    """Yields search.json pages for `username`, restricted to `formats`.
+
+    With no formats this is iter_search_pages. Otherwise the format group's
+    ids are passed to the search API (one walk per id, merged newest first
+    and re-chunked into pages of `page_size`), and rows are also checked
+    against its name pattern, which is all that is used when it has no ids.
+    Either way no replay outside the formats reaches the log download.
+    """
+    replay_format = get_format(formats)
+    if replay_format is None:
+        yield from iter_search_pages(username, client)
+        return
+
+    if len(replay_format.format_ids) == 1:
+        pages = iter_search_pages(username, client, replay_format.format_ids[0])
+    elif replay_format.format_ids:
+        walks = [
+            (replay for page in iter_search_pages(username, client, format_id) for replay in page)
+            for format_id in replay_format.format_ids
+        ]
+        merged = heapq.merge(*walks, key=lambda replay: replay.get("uploadtime") or 0, reverse=True)
+        pages = iter(lambda: list(itertools.islice(merged, page_size)), [])
+    else:
+        pages = iter_search_pages(username, client)
+
+    for replays in pages:
+        kept = [replay for replay in replays if replay_format.matches(replay.get("format", ""))]
+        metrics.incr("search.rows_filtered", len(replays) - len(kept))
+        if kept:
+            yield kept
 
-def fetch_replays_by_username(username):
-    """Fetch replays for a given username using Showdown's API"""
-    all_replays = []
-    page = 1
 
-    print(f"🔍 Searching for replays of '{username}'...")
+def iter_search_pages(username, client=None, format_id=None):
+    """Yields each page of search.json results for `username` until an empty page or an error.
 
+    `format_id` (e.g. "gen9vgc2024regg") is passed to the API to list only
+    that format. Showdown returns 51 rows per 50-row page (the extra row is
+    the first of the next page), so rows already yielded are dropped.
+    """
+    if client is None:
+        client = get_default_client()
+    seen_ids = set()
+    page = 1
     while True:
         params = {"user": username, "page": page}
-        print(f"🌐 Fetching page {page} from {SHOWDOWN_API_URL} with params: {params}")
+        if format_id:
+            params["format"] = format_id
+        replays = _search_page(client, params)
+        if replays is None:
+            return
+        if not replays:
+            log.info("✅ Pagination Complete: No more replays found.", extra={"username": username, "pages": page - 1})
+            return
+
+        log.info("✅ Fetched %d replays from page %d", len(replays), page,
+                 extra={"username": username, "page": page, "rows": len(replays)})
+        replays = [replay for replay in replays if replay["id"] not in seen_ids]
+        seen_ids.update(replay["id"] for replay in replays)
+        if replays:
+            yield replays
+        page += 1
 
-        response = requests.get(SHOWDOWN_API_URL, params=params)
-        if response.status_code != 200:
-            print(f"❌ Error fetching page {page}: {response.status_code}")
-            break
 
-        replays = response.json()
-        if not replays:
-            print("✅ Pagination Complete: No more replays found.")
-            break
+def _search_page(client, params):
+    """One search.json request: its rows ([] past the last page), or None on an error, which is logged.
 
-        for replay in replays:
-            replay_id = replay["id"]
-            replay_data_json = fetch_team_from_replay(replay_id, username)
-            
-            # Parse the JSON string back into a dictionary
-            replay_data = json.loads(replay_data_json)
-            
-            # Store the team data, opponent name, and player slot in the replay object
-            replay["teams"] = json.dumps(replay_data["teams"])  # Store teams as JSON string
-            replay["opponent"] = replay_data["opponent"]  # Store opponent's name
-            replay["player_slot"] = replay_data["player_slot"]  # Store which slot is the player
-
-        all_replays.extend(replays)
-        print(f"✅ Fetched {len(replays)} replays from page {page}")
+    `params` are the API's (user, and page or before, optionally format).
+    iter_search_pages and fetch_new_replays both walk the results with it,
+    so requests are timed, counted and logged the same way.
+    """
+    extra = {"username": params.get("user"), **{key: value for key, value in params.items() if key != "user"}}
+    log.debug("🌐 Fetching %s with params: %s", client.url('search.json'), params)
+    try:
+        with metrics.timer("search.page_seconds"):
+            response = client.search(params)
+    except RETRYABLE_EXCEPTIONS as e:
+        metrics.incr("search.errors")
+        log.error("❌ Error fetching search results %s: %s", params, e, extra=extra)
+        return None
+    if response.status_code != 200:
+        metrics.incr("search.errors")
+        log.error("❌ Error fetching search results %s: %d", params, response.status_code,
+                  extra={**extra, "status": response.status_code})
+        return None
+
+    replays = response.json()
+    if replays:
+        metrics.incr("search.pages")
+        metrics.incr("search.rows", len(replays))
+    return replays
+
+
+def _collect_records(pending):
+    """Waits for queued fetch_team_from_replay futures and pairs each result with its search row.
+
+    Replays that couldn't be fetched get empty teams.
+    """
+    records = []
+    for replay, future in pending:
+        teams = future.result()
+        records.append(ReplayRecord.from_search_result(replay, teams if teams is not None else ReplayTeams()))
+    return records
 
-        page += 1
-        time.sleep(1)  # Avoid excessive requests
 
-    if not all_replays:
+def load_sync_state(state_file=SYNC_STATE_FILE):
+    """Loads the per-username sync cursors ({username: {"uploadtime": ..., "ids": [...]}})."""
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_sync_state(state, state_file=SYNC_STATE_FILE):
+    """Writes the sync cursors atomically so an interrupted run can't corrupt them."""
+    tmp_file = state_file + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_file, state_file)
+
+
+def sync_replays_by_username(username, dataset_path="fetched_replays.csv", state_file=SYNC_STATE_FILE,
+                             max_workers=8, client=None, cache=None):
+    """Incrementally fetch a user's replays, appending only new ones to `dataset_path`.
+
+    The newest uploadtime (and the replay ids sharing it) stored for each
+    user is remembered in `state_file`. Search results are walked newest-first
+    with the API's `before` time cursor and the walk stops at the first known
+    replay, so a refresh with nothing new costs a single search request. If
+    the dataset file is missing or holds no cursor for the user, a full sync
+    is done and replaces the user's rows in it; other users' rows are kept.
+
+    Only replays fetch_new_replays reports as safe to store are appended, so
+    the cursor never moves past a replay that failed to download or a part
+    of the history the search walk didn't reach; the next sync picks them up.
+
+    Returns a DataFrame of the newly stored replays only.
+    """
+    state = load_sync_state(state_file)
+    key = username.lower()
+    cursor = state.get(key) if os.path.exists(dataset_path) else None
+    known_time = cursor["uploadtime"] if cursor else None
+    known_ids = set(cursor["ids"]) if cursor else set()
+
+    records, _ = fetch_new_replays(username, known_time, known_ids, max_workers, client, cache)
+    if not records:
         return pd.DataFrame()
 
-    df = pd.DataFrame(all_replays)
-    df.to_csv("fetched_replays.csv", index=False)
-    print(f"✅ Saved {len(df)} replays to fetched_replays.csv")
-    return df
+    df_new = records_to_frame(records)
+    if cursor is None and os.path.exists(dataset_path):
+        drop_user_replays(dataset_path, username)  # full sync: start this user's rows over
+    append_replays(df_new, dataset_path)
+    log.info("✅ Appended %d replays to %s", len(df_new), dataset_path)
+
+    newest_time = max(record.uploadtime for record in records)
+    newest_ids = [record.id for record in records if record.uploadtime == newest_time]
+    if newest_time == known_time:
+        newest_ids += sorted(known_ids)
+    state[key] = {"uploadtime": newest_time, "ids": newest_ids}
+    save_sync_state(state, state_file)
 
+    return df_new
 
-def fetch_team_from_replay(replay_id, username):
+
+def fetch_new_replays(username, known_time=None, known_ids=(), max_workers=8, client=None, cache=None,
+                      team_only=True):
+    """The search walk of sync_replays_by_username: (ReplayRecords, complete) of replays past a cursor.
+
+    The cursor is the newest uploadtime already held (None: fetch everything)
+    and the ids of the replays uploaded at that time. `complete` is True if
+    the walk reached the cursor (or the end of the results) and every replay
+    on the way was fetched.
+
+    The records are the replays that can be stored without skipping any, as
+    callers resume from the newest one stored: none if the walk stopped on a
+    search error, and only those older than every failed download otherwise.
+    Failed downloads are never returned as empty teams.
+    """
+    known_ids = set(known_ids)
+    new_replays = []
+    pending = []  # (replay, future) pairs in search order
+    seen_ids = set()
+    before = None
+    if client is None:
+        client = get_default_client()
+    if cache is None:
+        cache = get_default_cache()
+
+    log.info("🔄 Syncing replays of '%s' newer than %s...", username, known_time or 'the beginning',
+             extra={"username": username})
+
+    complete = True
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        reached_known = False
+        while not reached_known:
+            params = {"user": username}
+            if before is not None:
+                params["before"] = before
+            replays = _search_page(client, params)
+            if replays is None:
+                complete = False
+                break
+            if not replays:
+                log.info("✅ Pagination Complete: No more replays found.", extra={"username": username})
+                break
+
+            for replay in replays:
+                if replay["id"] in seen_ids:
+                    continue
+                seen_ids.add(replay["id"])
+                if known_time is not None and (
+                    replay["uploadtime"] < known_time
+                    or (replay["uploadtime"] == known_time and replay["id"] in known_ids)
+                ):
+                    reached_known = True
+                    continue
+                future = pool.submit(fetch_team_from_replay, replay["id"], username, client, cache, team_only)
+                pending.append((replay, future))
+                new_replays.append(replay)
+
+            next_before = min(replay["uploadtime"] for replay in replays)
+            if next_before == before:
+                break  # cursor didn't move; avoid looping on the same page
+            before = next_before
+
+        fetched = [(replay, future.result()) for replay, future in pending]
+
+    failed_times = [replay["uploadtime"] for replay, teams in fetched if teams is None]
+    log.info("✅ Found %d new replays for '%s'", len(new_replays), username,
+             extra={"username": username, "new_replays": len(new_replays)})
+    if not complete:
+        log.warning("⚠ Search for '%s' stopped early; nothing stored, the next sync starts over from %s",
+                    username, known_time or 'the beginning', extra={"username": username})
+        return [], False
+    if failed_times:
+        metrics.incr("sync.failed_fetches", len(failed_times))
+        log.warning("⚠ %d replays of '%s' failed to download; keeping only older ones so they are retried",
+                    len(failed_times), username, extra={"username": username, "failed": len(failed_times)})
+    oldest_failure = min(failed_times, default=None)
+    records = [
+        ReplayRecord.from_search_result(replay, teams)
+        for replay, teams in fetched
+        if teams is not None and (oldest_failure is None or replay["uploadtime"] < oldest_failure)
+    ]
+    return records, not failed_times
+
+
+def fetch_team_from_replay(replay_id, username, client=None, cache=None, team_only=True):
     """Fetches a replay and extracts full teams + opponent's name + player's slot
     
     Parameters:
     replay_id (str): The ID of the replay to fetch
     username (str): The username to look for in the replay
+    client (ShowdownClient): HTTP client to use (defaults to the shared one)
+    cache (ReplayCache): Replay cache to consult first (defaults to the shared one)
+    team_only (bool): Download only the log's team-preview header (see fetch_parsed_replay)
     
     Returns:
-    str: JSON string containing teams, opponent name, and player slot
+    ReplayTeams: both teams, the opponent's name, and the player's slot,
+    or None if the replay couldn't be fetched
     """
     # Handle full URLs if they're passed instead of just IDs
     if isinstance(replay_id, str) and replay_id.startswith('http'):
@@ -72,77 +376,120 @@ def fetch_team_from_replay(replay_id, username):
         if match:
             replay_id = match.group(1)
         else:
-            print(f"❌ Invalid replay URL format: {replay_id}")
-            return json.dumps({
-                "teams": {"p1": [], "p2": []},
-                "opponent": "Unknown",
-                "player_slot": "p1"
-            })
+            log.error("❌ Invalid replay URL format: %s", replay_id)
+            return None
     
-    replay_url = f"https://replay.pokemonshowdown.com/{replay_id}.json"
+    parsed = fetch_parsed_replay(replay_id, client, cache, team_only)
+    if parsed is None:
+        return None
+    return resolve_replay_teams(parsed, username)
+
+
+def fetch_parsed_replay(replay_id, client=None, cache=None, team_only=True):
+    """Fetches (or reads from cache) one replay and parses it, independent of any username.
+
+    With team_only (the default) only the plain-text log is requested, and
+    only up to its |teampreview / |start line: the download stops there, so
+    a few KB are transferred instead of the whole replay. Otherwise the full
+    replay JSON is downloaded and kept in the cache as well, and the result
+    also has the game's "winner" (see showdown_protocol.parse_winner).
+
+    Returns {"teams": {"p1": [...], "p2": [...]}, "players": {slot: name},
+    "format": tier name, "started": first |t:| timestamp[, "winner": ...]},
+    or None if the replay could not be fetched.
+    """
+    if cache is None:
+        cache = get_default_cache()
+
+    entry = cache.get(replay_id)
+    raw, parsed = entry if entry is not None else (None, None)
+    if parsed is not None and (team_only or "winner" in parsed):
+        return parsed
+    if raw is not None:
+        # Parsed team-only before, but the full replay is cached already
+        parsed = parse_full_replay_log(raw.get("log", ""))
+        cache.put(replay_id, parsed=parsed)
+        return parsed
+
+    if client is None:
+        client = get_default_client()
+
     try:
-        response = requests.get(replay_url)
+        response = None
+        with metrics.timer("replay.download_seconds"):
+            if team_only:
+                status_code, replay_log = client.replay_log_head(replay_id, TEAM_PREVIEW_MARKERS)
+            else:
+                response = client.replay_json(replay_id)
+                status_code = response.status_code
         
-        if response.status_code != 200:
-            print(f"❌ Error fetching replay {replay_id}: Status code {response.status_code}")
-            return json.dumps({
-                "teams": {"p1": [], "p2": []},
-                "opponent": "Unknown",
-                "player_slot": "p1"
-            })
-
-        data = response.json()
-        replay_log = data.get("log", "")
-
-        print(f"🔍 Fetching replay data for {replay_id}")
-        print(replay_log[:200])  # Print first 200 characters to check log structure
-
-        teams, opponent, player_slot = extract_teams_and_opponent(replay_log, username)
-
-        # Store the complete information in a dictionary
-        result = {
-            "teams": teams,
-            "opponent": opponent,
-            "player_slot": player_slot
-        }
-
-        return json.dumps(result)  # Return all data as a JSON string
+        if status_code != 200:
+            metrics.incr("replay.download_errors")
+            log.error("❌ Error fetching replay %s: Status code %d", replay_id, status_code,
+                      extra={"replay_id": replay_id, "status": status_code})
+            return None
+
+        metrics.incr("replay.downloads")
+        if response is not None:
+            metrics.observe("replay.download_bytes", len(response.content))
+            replay_log = response.json().get("log", "")
+        else:
+            metrics.observe("replay.download_bytes", len(replay_log.encode("utf-8")))
+
+        if log.isEnabledFor(logging.DEBUG):
+            # First 200 characters, to check the log structure
+            log.debug("🔍 Fetched replay data for %s: %r", replay_id, replay_log[:200], extra={"replay_id": replay_id})
+
+        with metrics.timer("replay.parse_seconds"):
+            if team_only:
+                teams, players = parse_replay_log(replay_log)
+                parsed = {"teams": teams, "players": players, **parse_header_metadata(replay_log)}
+            else:
+                parsed = parse_full_replay_log(replay_log)
+        cache.put(replay_id, raw=response.text if response is not None else None, parsed=parsed)
+        return parsed
         
     except Exception as e:
-        print(f"❌ Exception when fetching replay {replay_id}: {str(e)}")
-        return json.dumps({
-            "teams": {"p1": [], "p2": []},
-            "opponent": "Unknown",
-            "player_slot": "p1"
-        })
+        metrics.incr("replay.download_errors")
+        log.error("❌ Exception when fetching replay %s: %s", replay_id, e, extra={"replay_id": replay_id})
+        return None
 
 
-def extract_teams_and_opponent(replay_log, username):
-    """Extracts full teams and finds opponent's name and player's slot from the replay log."""
-    teams = {"p1": [], "p2": []}
-    opponent = "Unknown"
-    player_slot = None  # Will store which slot (p1/p2) belongs to the input username
-    lines = replay_log.split("\n")
+def parse_full_replay_log(replay_log):
+    """fetch_parsed_replay's result for a complete log: teams, players, header metadata and winner."""
+    teams, players = parse_replay_log(replay_log)
+    return {"teams": teams, "players": players, **parse_header_metadata(replay_log),
+            "winner": parse_winner(replay_log)}
+
 
-    player_dict = {}  # Store player mapping (p1 -> player1, p2 -> player2)
-    for line in lines:
-        parts = line.split("|")
-        if len(parts) < 4:  # Ensure there are at least 4 parts
-            continue  # Skip this line if it's too short
+def resolve_replay_teams(parsed, username):
+    """Turns a username-independent parse (see fetch_parsed_replay) into ReplayTeams for `username`."""
+    opponent, player_slot = resolve_player_slot(parsed["players"], username)
+    teams = parsed["teams"]
+    return ReplayTeams(tuple(teams["p1"]), tuple(teams["p2"]), opponent, player_slot, parsed.get("winner"))
 
-        if parts[1] == "player":
-            slot, player_name = parts[2], parts[3]
-            player_dict[slot] = player_name
-            if player_name.lower() == username.lower():
-                player_slot = slot  # Found the slot for our player
 
-        if parts[1] == "poke" and len(parts) >= 4:  # Check that parts[3] exists
-            player, pokemon = parts[2], parts[3].split(",")[0]
-            if player in teams:
-                teams[player].append(pokemon)
+def parse_replay_log(replay_log):
+    """Extracts both full teams and the slot -> player name mapping from a replay log.
+
+    Nothing here depends on who is searching, so the result can be cached per
+    replay and resolved for any username with `resolve_player_slot`. Only the
+    team-preview header is scanned (see showdown_protocol.parse_team_preview).
+    """
+    return parse_team_preview(replay_log)
+
+
+def resolve_player_slot(players, username):
+    """Returns (opponent, player_slot) for `username` given a slot -> name mapping."""
+    opponent = "Unknown"
+    player_slot = None  # Will store which slot (p1/p2) belongs to the input username
+
+    for slot, player_name in players.items():
+        if player_name.lower() == username.lower():
+            player_slot = slot  # Found the slot for our player
 
     # Determine opponent based on who isn't the searched username
-    for slot, player_name in player_dict.items():
+    for slot, player_name in players.items():
         if player_name.lower() != username.lower():
             opponent = player_name
             break
@@ -150,11 +497,66 @@ def extract_teams_and_opponent(replay_log, username):
     # If we couldn't determine the player's slot, default to p1
     if player_slot is None:
         player_slot = "p1"
-        print(f"⚠ Warning: Could not determine player slot for {username} in replay, defaulting to p1")
+        log.warning("⚠ Could not determine player slot for %s in replay, defaulting to p1", username)
+
+    return opponent, player_slot
+
 
+def extract_teams_and_opponent(replay_log, username):
+    """Extracts full teams and finds opponent's name and player's slot from the replay log."""
+    teams, players = parse_replay_log(replay_log)
+    opponent, player_slot = resolve_player_slot(players, username)
     return teams, opponent, player_slot
 
 
+def format_match_dates(uploadtime):
+    """Unix timestamps -> "%m-%d-%Y" strings, formatting each distinct day only once."""
+    days = pd.to_datetime(uploadtime, unit='s').dt.floor("D")
+    codes, unique_days = pd.factorize(days)
+    labels = np.append(np.asarray(unique_days.strftime("%m-%d-%Y"), dtype=object), np.nan)
+    return pd.Series(labels[codes], index=uploadtime.index)  # code -1 (missing) picks the NaN
+
+
+def canonical_team_key(team):
+    """Order-independent key for a team: its species sorted and comma-joined."""
+    return ",".join(sorted(team))
+
+
+def assign_archetypes(team_keys, times_used, min_shared=ARCHETYPE_MIN_SHARED):
+    """Archetype number for each canonical team key (see team_index.TeamIndex.archetypes).
+
+    The most used team leads archetype 1; every team sharing at least
+    `min_shared` Pokémon with a leader joins the first such archetype.
+    """
+    teams = [key.split(",") if key else [] for key in team_keys]
+    return TeamIndex(teams).archetypes(times_used, min_shared)
+
+
+def archetype_statistics(df_output):
+    """Usage per archetype from a process_replays output table.
+
+    One row per archetype: its leading (most used) team, how many distinct
+    Team IDs it groups, total games and the most recent match date.
+    """
+    if df_output.empty:
+        return pd.DataFrame(columns=["Archetype", "Lead Team", "Teams", "Times_Used", "Last_Used"])
+    match_dates = pd.to_datetime(df_output["Match Date"], format="%m-%d-%Y", errors="coerce")
+    usage = df_output.assign(_date=match_dates).groupby(["Archetype", "Team ID", "Team"], sort=False).agg(
+        Times_Used=("Team ID", "count"),
+        Last_Used=("_date", "max"),
+    ).reset_index()
+    # Leader = most used team, earliest Team ID on ties
+    usage = usage.sort_values(["Archetype", "Times_Used", "Team ID"], ascending=[True, False, True])
+    archetype_stats = usage.groupby("Archetype", sort=True).agg(
+        Lead_Team=("Team", "first"),
+        Teams=("Team ID", "nunique"),
+        Times_Used=("Times_Used", "sum"),
+        Last_Used=("Last_Used", "max"),
+    ).reset_index().rename(columns={"Lead_Team": "Lead Team"})
+    archetype_stats["Last_Used"] = archetype_stats["Last_Used"].dt.strftime("%m-%d-%Y")
+    return archetype_stats
+
+
 def assign_sequential_team_ids(team_list):
     """Assigns a unique numeric ID to each unique set of six Pokémon."""
     team_id_map = {}
@@ -172,98 +574,204 @@ def assign_sequential_team_ids(team_list):
     return get_team_id
 
 
-def process_replay_csv(username, input_csv, output_csv, team_stats_csv):
-    """Processes replay data and generates team statistics"""
-    df_input = pd.read_csv(input_csv)
+def process_replay_csv(username, input_csv, output_csv, team_stats_csv, chunk_size=None,
+                       max_memory_keys=1_000_000):
+    """Processes a stored replay dataset (CSV or Parquet) and generates team statistics
 
+    With `chunk_size`, the dataset is streamed in chunks of that many rows
+    instead of loaded whole (see process_replay_chunks); the processed table
+    then only goes to `output_csv`, and (None, team_stats) is returned.
+    """
+    if chunk_size:
+        return None, process_replay_chunks(username, input_csv, output_csv, team_stats_csv, chunk_size,
+                                           max_memory_keys)
+    return process_replays(username, load_replays(input_csv), output_csv, team_stats_csv)
+
+
+def process_replay_chunks(username, input_csv, output_csv, team_stats_csv, chunk_size=100_000,
+                          max_memory_keys=1_000_000):
+    """process_replay_csv in bounded memory, for histories too large to load at once.
+
+    A first pass reads `chunk_size` rows at a time, numbers teams through a
+    TeamKeyStore (spilled to disk past `max_memory_keys` distinct teams),
+    merges each chunk's Times_Used/Last_Used into running totals and spools
+    the processed rows to a temporary file. Archetypes need every team's
+    total usage, so a second pass adds them to the spooled rows on their way
+    to `output_csv`. The files written are the same as process_replays'.
+
+    Memory is one chunk plus what grows with distinct teams (the running
+    totals and the archetype index), never with rows. Returns the team
+    statistics table.
+    """
+    spool_columns = [column for column in OUTPUT_COLUMNS if column != "Archetype"]
+    usage = None
+    rows = 0
+    with TeamKeyStore(max_memory_keys) as store, tempfile.TemporaryDirectory(prefix="replay_chunks_") as tmp:
+        spool = os.path.join(tmp, "processed_rows.csv")
+        for chunk in iter_replay_chunks(input_csv, chunk_size):
+            if chunk.empty:
+                continue
+            chunk, team_keys = build_replay_rows(username, chunk)
+            chunk["Team ID"] = store.codes(team_keys) + 1
+            chunk[spool_columns].to_csv(spool, mode="a", header=rows == 0, index=False)
+
+            with metrics.timer("stats.aggregate_seconds"):
+                usage = merge_team_usage(usage, team_usage(chunk))
+            rows += len(chunk)
+            metrics.incr("stats.rows", len(chunk))
+            metrics.incr("stats.chunks")
+            log.debug("📦 %d rows processed, %d distinct teams (%d spilled to disk)", rows, len(store), store.spilled)
+
+        if usage is None:
+            log.error("❌ No data to process.")
+            return pd.DataFrame()
+
+        # Group near-identical teams (one or two Pokémon swapped) into archetypes
+        times_used = np.bincount(usage["Team ID"].to_numpy() - 1, weights=usage["Times_Used"].to_numpy(),
+                                 minlength=len(store)).astype(np.int64)
+        with metrics.timer("stats.archetype_seconds"):
+            archetypes = assign_archetypes(store.keys(), times_used)
+
+        if output_csv:
+            # "" is the only missing value, so text such as "None" survives the round trip
+            spooled = pd.read_csv(spool, chunksize=chunk_size, keep_default_na=False, na_values=[""],
+                                  dtype={column: str for column in spool_columns if column != "Team ID"})
+            for part, chunk in enumerate(spooled):
+                chunk.insert(1, "Archetype", archetypes[chunk["Team ID"].to_numpy() - 1])
+                chunk.to_csv(output_csv, mode="a" if part else "w", header=part == 0, index=False)
+
+    log.info("✅ %d rows in chunks of %d: %d distinct teams", rows, chunk_size, len(store))
+    if team_stats_csv:
+        usage.to_csv(team_stats_csv, index=False)
+    return usage
+
+
+def process_replays(username, df_input, output_csv=None, team_stats_csv=None, registry=None):
+    """Processes an in-memory replay frame and generates team statistics
+
+    Accepts the frame returned by `fetch_replays_by_username` (or anything
+    `normalize_replay_frame` understands). The output tables are written to
+    `output_csv` / `team_stats_csv` when those are given. With a
+    team_registry.TeamRegistry, Team IDs are the registry's persistent ones
+    instead of being numbered from 1 for this frame.
+    """
     if df_input.empty:
-        print("❌ No data to process.")
+        log.error("❌ No data to process.")
         return pd.DataFrame(), pd.DataFrame()
 
-    # ✅ Debug: Print existing columns
-    print(f"🔍 Existing Columns in Dataframe: {df_input.columns.tolist()}")
+    df_input, team_keys = build_replay_rows(username, df_input)
 
-    # Ensure 'teams', 'opponent', and 'player_slot' columns exist
-    if "teams" not in df_input.columns:
-        print("⚠ Warning: 'teams' column missing in CSV. Adding empty column.")
-        df_input["teams"] = "{}"  # Default empty JSON
+    # Assign Team IDs in order of first appearance of each canonical (sorted) team
+    team_codes, unique_keys = pd.factorize(team_keys, sort=False)
+    df_input["Team ID"] = team_codes + 1 if registry is None else registry.team_ids(unique_keys)[team_codes]
 
-    if "opponent" not in df_input.columns:
-        df_input["opponent"] = "Unknown"
-        
-    if "player_slot" not in df_input.columns:
-        print("⚠ Warning: 'player_slot' column missing in CSV. Defaulting to 'p1'.")
-        df_input["player_slot"] = "p1"  # Default to p1 if not found
+    # Group near-identical teams (one or two Pokémon swapped) into archetypes
+    with metrics.timer("stats.archetype_seconds"):
+        archetypes = assign_archetypes(unique_keys, np.bincount(team_codes, minlength=len(unique_keys)))
+    df_input["Archetype"] = archetypes[team_codes]
 
-    # Convert stored JSON strings into dictionaries
-    df_input["teams"] = df_input["teams"].apply(lambda x: json.loads(x) if isinstance(x, str) else x)
+    # ✅ Check for missing columns before proceeding
+    missing_columns = [col for col in OUTPUT_COLUMNS if col not in df_input.columns]
+
+    if missing_columns:
+        log.error("❌ Missing Columns: %s (existing: %s)", missing_columns, df_input.columns.tolist())
+        raise KeyError(f"Missing columns in dataframe: {missing_columns}")
+
+    # ✅ Processed Replay Data Table
+    df_output = df_input[OUTPUT_COLUMNS]
+    if output_csv:
+        df_output.to_csv(output_csv, index=False)
+
+    # ✅ Team Statistics Table
+    with metrics.timer("stats.aggregate_seconds"):
+        team_stats_df = team_usage(df_input)
+    metrics.incr("stats.rows", len(df_input))
+
+    if team_stats_csv:
+        team_stats_df.to_csv(team_stats_csv, index=False)
+
+    return df_output, team_stats_df
+
+
+def build_replay_rows(username, df_input):
+    """The per-replay columns of process_replays' output, before Team IDs and archetypes are known.
+
+    Returns the normalized frame with "Match Title", "Match Date", "Replay
+    URL", "Team" and "Result" added, and each row's canonical team key.
+    """
+    # ✅ Debug: Log existing columns
+    log.debug("🔍 Existing Columns in Dataframe: %s", df_input.columns.tolist())
+
+    # Ensure 'p1_team'/'p2_team', 'opponent', 'player_slot' and list-typed 'players' columns
+    df_input = normalize_replay_frame(df_input)
 
-    # ✅ Ensure 'players' column is properly parsed
     if "players" in df_input.columns:
-        df_input["players"] = df_input["players"].apply(
-            lambda x: ast.literal_eval(x) if isinstance(x, str) and x.startswith("[") else x
-        )
-
-        # ✅ Construct Match Titles using API data
-        df_input["Match Title"] = df_input.apply(
-            lambda row: f"{row['format']}: {row['players'][0]} vs. {row['players'][1]}"
-            if isinstance(row["players"], list) and len(row["players"]) == 2 
-            else f"{row['format']}: ??? vs. ???",
-            axis=1
-        )
+        # ✅ Construct Match Titles using API data (anything but a pair of names gets "???")
+        df_input["Match Title"] = [
+            f"{match_format}: {players[0]} vs. {players[1]}"
+            if isinstance(players, (list, tuple)) and len(players) == 2
+            else f"{match_format}: ??? vs. ???"
+            for match_format, players in zip(df_input["format"].astype(str).tolist(), df_input["players"].tolist())
+        ]
     else:
         df_input["Match Title"] = df_input['format'] + ": ??? vs. ???"  # Fallback
 
     # ✅ Debug: Check missing titles
     df_missing_titles = df_input[df_input["Match Title"].str.contains("\?\?\?")]
     if not df_missing_titles.empty:
-        print(f"⚠ Warning: Some replays are missing Match Titles! Here are a few:")
-        print(df_missing_titles[["format", "players"]].head(5))
+        log.warning("⚠ Some replays are missing Match Titles! Here are a few:\n%s",
+                    df_missing_titles[["format", "players"]].head(5))
 
     # Convert timestamp to readable format
-    df_input['Match Date'] = pd.to_datetime(df_input['uploadtime'], unit='s').dt.strftime("%m-%d-%Y")
+    df_input['Match Date'] = format_match_dates(df_input['uploadtime'])
 
     # ✅ Ensure 'Replay URL' column exists
     if "Replay URL" not in df_input.columns:
         df_input['Replay URL'] = "https://replay.pokemonshowdown.com/" + df_input['id'].astype(str)
 
     # ✅ Use the player's team based on their slot (p1 or p2), not always p1
-    # This is the key fix that was missing before
-    def get_player_team(row):
-        """Extract the team for the player based on their slot"""
-        player_slot = row["player_slot"]
-        teams = row["teams"]
-        # Return the player's team or an empty list if not found
-        return teams.get(player_slot, [])
-    
-    # Assign unique Team IDs based on the player's actual team
-    get_team_id = assign_sequential_team_ids(df_input.apply(get_player_team, axis=1))
-    
+    player_teams = [
+        p1 if slot == "p1" else p2 if slot == "p2" else []
+        for p1, p2, slot in zip(df_input["p1_team"].tolist(), df_input["p2_team"].tolist(),
+                                df_input["player_slot"].tolist())
+    ]
+
     # Store team as string using the player's team
-    df_input["Team"] = df_input.apply(lambda row: ", ".join(get_player_team(row)), axis=1)
-    
-    # Assign Team ID using the player's team
-    df_input["Team ID"] = df_input.apply(lambda row: get_team_id(get_player_team(row)), axis=1)
+    df_input["Team"] = [", ".join(team) for team in player_teams]
 
-    # ✅ Check for missing columns before proceeding
-    required_columns = ['Team ID', 'Match Title', 'Match Date', 'Replay URL', 'Team']
-    missing_columns = [col for col in required_columns if col not in df_input.columns]
+    # Win/Loss/Tie from the player's side; empty unless the replays were fetched in full
+    df_input["Result"] = resolve_results(df_input["winner"], username)
 
-    if missing_columns:
-        print(f"❌ Missing Columns: {missing_columns}")
-        print(f"🔍 Existing Columns: {df_input.columns.tolist()}")
-        raise KeyError(f"Missing columns in dataframe: {missing_columns}")
+    team_keys = pd.Series([canonical_team_key(team) for team in player_teams], index=df_input.index)
+    return df_input, team_keys
 
-    # ✅ Processed Replay Data Table
-    df_output = df_input[required_columns]
-    df_output.to_csv(output_csv, index=False)
 
-    # ✅ Team Statistics Table
-    team_stats_df = df_input.groupby(["Team ID", "Team"]).agg(
-        Times_Used=("Team ID", "count"),
-        Last_Used=("Match Date", "max")  # Get most recent date team was used
-    ).reset_index()
+def merge_team_usage(usage, new_usage):
+    """Running team_usage totals (None before the first part) with another part's team_usage added."""
+    if usage is None:
+        return new_usage
+    merged = pd.concat([usage, new_usage], ignore_index=True)
+    return team_usage(merged.rename(columns={"Last_Used": "Match Date"}), "Times_Used")
 
-    team_stats_df.to_csv(team_stats_csv, index=False)
 
-    return df_output, team_stats_df
+def team_usage(df, times_used=None):
+    """Times_Used and Last_Used per (Team ID, Team) of a frame with "Team ID", "Team" and "Match Date" columns.
+
+    Each row counts once, or `times_used` times if that column is named
+    (used to merge partial results). Last_Used is the greatest "Match Date".
+    """
+    # "max" of the dates is taken on their chronological rank so the groupby
+    # stays on the fast integer path; the "%m-%d-%Y" strings themselves would
+    # put December of one year after January of the next
+    date_codes, date_values = pd.factorize(df["Match Date"], sort=False)
+    dates = pd.to_datetime(date_values, format="%m-%d-%Y", errors="coerce").to_numpy()
+    order = np.argsort(dates, kind="stable")
+    rank = np.full(len(order) + 1, np.nan)  # code -1 (missing date) picks the NaN
+    rank[order] = np.arange(len(order))
+    team_stats_df = df.assign(_date_rank=rank[date_codes]).groupby(["Team ID", "Team"], sort=True).agg(
+        Times_Used=(times_used, "sum") if times_used else ("Team ID", "count"),
+        Last_Used=("_date_rank", "max")  # Get most recent date team was used
+    ).reset_index()
+    team_stats_df["Last_Used"] = pd.Series(np.asarray(date_values, dtype=object)[order]).reindex(
+        team_stats_df["Last_Used"]).to_numpy()
+    return team_stats_df
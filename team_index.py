@@ -0,0 +1,144 @@
+"""Bitset index over teams for near-duplicate and species queries.
+
+Species names are interned to integer codes and each team is stored as a
+row of a (teams x words) uint64 bitmask, so "how many Pokémon does every
+team share with this one" is one AND plus a popcount over the whole index.
+Archetype clustering finds candidate pairs by hashing every team's
+`min_shared`-species subsets, which avoids comparing all pairs of teams.
+"""
+from itertools import combinations
+
+import numpy as np
+
+if hasattr(np, "bitwise_count"):
+    def _popcount(words):
+        return np.bitwise_count(words)
+else:  # NumPy < 2.0
+    _BYTE_BITS = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(words):
+        counts = _BYTE_BITS[words.view(np.uint8)].reshape(*words.shape, 8)
+        return counts.sum(axis=-1, dtype=np.uint8)
+
+
+class TeamIndex:
+    """Teams as bitmasks over interned species.
+
+    teams: iterable of species lists (one per distinct team; order within a
+    team and duplicate species are ignored). Row i of the index is teams[i].
+    """
+
+    def __init__(self, teams):
+        self.species = {}  # name -> code
+        team_codes = []
+        for team in teams:
+            codes = sorted({self.species.setdefault(name, len(self.species)) for name in team})
+            team_codes.append(codes)
+
+        self.width = max((len(codes) for codes in team_codes), default=0)
+        # Sorted species codes per team, padded with -1
+        self.codes = np.full((len(team_codes), self.width), -1, dtype=np.int64)
+        for row, codes in enumerate(team_codes):
+            self.codes[row, :len(codes)] = codes
+        self.sizes = np.array([len(codes) for codes in team_codes], dtype=np.int64)
+
+        self.words = max(1, (len(self.species) + 63) // 64)
+        self.masks = np.zeros((len(team_codes), self.words), dtype=np.uint64)
+        rows, columns = np.nonzero(self.codes >= 0)
+        species_codes = self.codes[rows, columns]
+        np.bitwise_or.at(self.masks, (rows, species_codes // 64),
+                         np.left_shift(np.uint64(1), (species_codes % 64).astype(np.uint64)))
+
+    def __len__(self):
+        return len(self.masks)
+
+    def mask(self, species):
+        """Bitmask of a species list; names the index has never seen are ignored."""
+        mask = np.zeros(self.words, dtype=np.uint64)
+        for name in species:
+            code = self.species.get(name)
+            if code is not None:
+                mask[code // 64] |= np.uint64(1) << np.uint64(code % 64)
+        return mask
+
+    def shared_counts(self, team):
+        """Number of species every indexed team shares with `team`."""
+        return _popcount(self.masks & self.mask(team)).sum(axis=1, dtype=np.int64)
+
+    def similar(self, team, min_shared=5):
+        """Rows of the teams sharing at least `min_shared` species with `team`."""
+        return np.flatnonzero(self.shared_counts(team) >= min_shared)
+
+    def containing(self, *species):
+        """Rows of the teams that include every one of `species`."""
+        if any(name not in self.species for name in species):
+            return np.array([], dtype=np.int64)
+        query = self.mask(species)
+        return np.flatnonzero(((self.masks & query) == query).all(axis=1))
+
+    def _shared_pairs(self, min_shared):
+        """(a, b) row pairs, a != b, of teams sharing at least `min_shared` species (possibly repeated)."""
+        if min_shared <= 0 or self.width < min_shared:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        # Two teams share >= k species exactly when they have a k-species subset in common
+        keys, rows = [], []
+        radix = np.int64(len(self.species) + 1)
+        for columns in combinations(range(self.width), min_shared):
+            subset = self.codes[:, columns]
+            valid = (subset >= 0).all(axis=1)
+            key = np.zeros(len(subset), dtype=np.int64)
+            for column in range(min_shared):
+                key = key * radix + subset[:, column]
+            keys.append(key[valid])
+            rows.append(np.flatnonzero(valid))
+        if not keys:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        keys, rows = np.concatenate(keys), np.concatenate(rows)
+
+        order = np.argsort(keys, kind="stable")
+        keys, rows = keys[order], rows[order]
+        group_starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        group_sizes = np.diff(np.r_[group_starts, len(keys)])
+
+        # Pair every entry with every entry of its group: entry e of a group of
+        # size s starting at t expands to rows[t], ..., rows[t + s - 1]
+        entry_sizes = np.repeat(group_sizes, group_sizes)
+        entry_starts = np.repeat(group_starts, group_sizes)
+        shared = entry_sizes > 1
+        entries = np.flatnonzero(shared)
+        entry_sizes, entry_starts = entry_sizes[shared], entry_starts[shared]
+        pair_a = np.repeat(rows[entries], entry_sizes)
+        pair_offsets = np.arange(entry_sizes.sum()) - np.repeat(np.cumsum(entry_sizes) - entry_sizes, entry_sizes)
+        pair_b = rows[np.repeat(entry_starts, entry_sizes) + pair_offsets]
+        distinct = pair_a != pair_b
+        return pair_a[distinct], pair_b[distinct]
+
+    def archetypes(self, weights=None, min_shared=5):
+        """Cluster teams into archetypes; return an archetype number (1, 2, ...) per row.
+
+        Teams are taken in order of decreasing weight (e.g. times used, ties in
+        row order). Each team not yet assigned starts a new archetype and
+        claims every unassigned team sharing at least `min_shared` species with
+        it. Archetype 1 is therefore led by the most used team.
+        """
+        count = len(self)
+        weights = np.ones(count) if weights is None else np.asarray(weights)
+        order = np.argsort(-weights, kind="stable")
+
+        pairs_a, pairs_b = self._shared_pairs(min_shared)
+        pair_order = np.argsort(pairs_a, kind="stable")
+        neighbours = pairs_b[pair_order]
+        neighbour_starts = np.searchsorted(pairs_a[pair_order], np.arange(count + 1))
+
+        archetype = np.zeros(count, dtype=np.int64)
+        next_archetype = 1
+        starts = neighbour_starts.tolist()
+        for leader in order.tolist():
+            if archetype[leader]:
+                continue
+            archetype[leader] = next_archetype
+            if starts[leader] != starts[leader + 1]:
+                members = neighbours[starts[leader]:starts[leader + 1]]
+                archetype[members[archetype[members] == 0]] = next_archetype
+            next_archetype += 1
+        return archetype
@@ -0,0 +1,101 @@
+"""Team key -> Team ID map that spills to disk, for histories too large to hold in memory.
+
+Codes are handed out 0, 1, 2, ... in order of first appearance, like
+`pd.factorize(team_keys, sort=False)` over the whole history would, so chunked
+processing numbers teams exactly as in-memory processing does.
+"""
+import os
+import sqlite3
+import tempfile
+
+import pandas as pd
+
+# Values per "IN (...)" query in select_in: SQLite before 3.32 allows at most 999 "?" parameters per statement
+SQLITE_IN_BATCH = 900
+
+
+def select_in(conn, query, values, params=()):
+    """Rows of `query` for a list of values too long for one statement, queried in batches.
+
+    `query` has an "IN ({placeholders})" clause that gets each batch's "?"
+    list; `params` are bound before the batch's values.
+    """
+    for start in range(0, len(values), SQLITE_IN_BATCH):
+        batch = values[start:start + SQLITE_IN_BATCH]
+        yield from conn.execute(query.format(placeholders=",".join("?" * len(batch))), [*params, *batch])
+
+
+class TeamKeyStore:
+    """Canonical team key -> integer code, in memory up to `max_memory_keys` keys.
+
+    Past that limit the in-memory keys are moved to an SQLite file (`path`,
+    or a temporary file removed by close()) and the dict starts over, so
+    memory stays bounded by `max_memory_keys` however many teams there are.
+    """
+
+    def __init__(self, max_memory_keys=1_000_000, path=None):
+        self.max_memory_keys = max_memory_keys
+        self.memory = {}
+        self.size = 0
+        self.spilled = 0
+        self.path = path
+        self.conn = None
+        self._temp_dir = None
+
+    def __len__(self):
+        return self.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def codes(self, keys):
+        """Codes of a sequence of keys (a NumPy int64 array); keys not seen before get the next codes."""
+        key_codes, unique_keys = pd.factorize(pd.Series(keys, dtype=object), sort=False)
+        unique_keys = unique_keys.tolist()
+        found = [self.memory.get(key) for key in unique_keys]
+        if self.conn is not None:
+            missing = [key for key, code in zip(unique_keys, found) if code is None]
+            on_disk = self._lookup(missing)
+            found = [on_disk.get(key) if code is None else code for key, code in zip(unique_keys, found)]
+
+        for position, (key, code) in enumerate(zip(unique_keys, found)):
+            if code is None:
+                found[position] = self.memory[key] = self.size
+                self.size += 1
+        if len(self.memory) > self.max_memory_keys:
+            self._spill()
+        return pd.Series(found, dtype="int64").to_numpy()[key_codes]
+
+    def keys(self):
+        """Yield every key in code order."""
+        if self.conn is not None:
+            for (key,) in self.conn.execute("SELECT key FROM team_keys ORDER BY code"):
+                yield key
+        yield from self.memory  # codes above every spilled one, in insertion order
+
+    def _lookup(self, keys):
+        return dict(select_in(self.conn, "SELECT key, code FROM team_keys WHERE key IN ({placeholders})", keys))
+
+    def _spill(self):
+        if self.conn is None:
+            if self.path is None:
+                self._temp_dir = tempfile.TemporaryDirectory(prefix="team_keys_")
+                self.path = os.path.join(self._temp_dir.name, "team_keys.sqlite3")
+            self.conn = sqlite3.connect(self.path)
+            self.conn.execute("DROP TABLE IF EXISTS team_keys")  # codes restart at 0 with every store
+            self.conn.execute("CREATE TABLE team_keys (key TEXT PRIMARY KEY, code INTEGER NOT NULL)")
+        self.conn.executemany("INSERT INTO team_keys (key, code) VALUES (?, ?)", self.memory.items())
+        self.conn.commit()
+        self.spilled += len(self.memory)
+        self.memory = {}
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        if self._temp_dir is not None:
+            self._temp_dir.cleanup()
+            self._temp_dir = None
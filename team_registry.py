@@ -0,0 +1,330 @@
+"""Persistent Team IDs and incrementally maintained team statistics.
+
+Team IDs from process_replays and showdown_scraper.generate_team_id are
+numbered per run in order of appearance, so the same six Pokémon get a
+different ID whenever the input changes. A TeamRegistry keeps one SQLite
+table mapping each canonical team key (species sorted and comma-joined) to
+an ID handed out the first time the team is seen, so IDs stay put across
+runs, users and processes.
+
+Next to it the registry keeps every ingested game per user, a usage table
+(Times_Used and the newest upload time per team) and per-day usage buckets
+(see usage_timeseries), both updated with only the games not ingested
+before; refresh_team_statistics fetches a user's replays past the newest
+one held, so a refresh costs time proportional to the new games rather
+than the whole history.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import get_default_metrics
+from replay_records import records_to_frame
+from showdown_scraper_username import build_replay_rows, fetch_new_replays, format_match_dates
+from team_key_store import select_in
+from usage_timeseries import BUCKET_COLUMNS, TEAM, daily_buckets, rolling_usage
+
+DEFAULT_REGISTRY_PATH = os.environ.get("SHOWDOWN_TEAM_REGISTRY", "team_registry.sqlite3")
+
+log = logging.getLogger(__name__)
+metrics = get_default_metrics()
+
+
+class TeamRegistry:
+    """SQLite-backed team key -> Team ID map plus per-user game and usage tables.
+
+    Team IDs are assigned 1, 2, 3, ... in the order teams are first
+    registered and never change afterwards. Usernames are stored lowercased.
+    """
+
+    def __init__(self, path=DEFAULT_REGISTRY_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(
+            """CREATE TABLE IF NOT EXISTS teams (
+                team_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                team_key TEXT NOT NULL UNIQUE
+            );
+            CREATE TABLE IF NOT EXISTS user_replays (
+                username TEXT NOT NULL,
+                replay_id TEXT NOT NULL,
+                team_id INTEGER NOT NULL,
+                team TEXT NOT NULL,
+                uploadtime INTEGER,
+                format TEXT,
+                result TEXT,
+                PRIMARY KEY (username, replay_id)
+            );
+            CREATE INDEX IF NOT EXISTS user_replays_by_time ON user_replays (username, uploadtime);
+            CREATE TABLE IF NOT EXISTS team_usage (
+                username TEXT NOT NULL,
+                team_id INTEGER NOT NULL,
+                team TEXT NOT NULL,
+                times_used INTEGER NOT NULL,
+                last_used INTEGER,
+                PRIMARY KEY (username, team_id, team)
+            );
+            CREATE TABLE IF NOT EXISTS daily_usage (
+                username TEXT NOT NULL,
+                day INTEGER NOT NULL,
+                format TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                games INTEGER NOT NULL,
+                decided INTEGER NOT NULL,
+                wins INTEGER NOT NULL,
+                PRIMARY KEY (username, day, format, kind, key)
+            );
+            CREATE TABLE IF NOT EXISTS user_versions (
+                username TEXT PRIMARY KEY,
+                version INTEGER NOT NULL,
+                updated REAL NOT NULL
+            );"""
+        )
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def team_ids(self, team_keys):
+        """Team IDs (a NumPy int64 array) of a sequence of canonical team keys, registering new teams."""
+        with self.lock:
+            team_ids = self._team_ids(team_keys)
+            self.conn.commit()
+        return team_ids
+
+    def _team_ids(self, team_keys):
+        key_codes, unique_keys = pd.factorize(pd.Series(team_keys, dtype=object), sort=False)
+        unique_keys = unique_keys.tolist()
+        found = self._lookup(unique_keys)
+        missing = [key for key in unique_keys if key not in found]
+        if missing:
+            # In order of first appearance, so a fresh registry numbers teams as process_replays does
+            self.conn.executemany("INSERT OR IGNORE INTO teams (team_key) VALUES (?)", [(key,) for key in missing])
+            found.update(self._lookup(missing))
+            metrics.incr("registry.new_teams", len(missing))
+        ids = np.array([found[key] for key in unique_keys], dtype=np.int64)
+        return ids[key_codes]
+
+    def _lookup(self, keys):
+        return dict(select_in(self.conn, "SELECT team_key, team_id FROM teams WHERE team_key IN ({placeholders})",
+                              keys))
+
+    def _known_replays(self, user, replay_ids):
+        return {replay_id for (replay_id,) in select_in(
+            self.conn, "SELECT replay_id FROM user_replays WHERE username = ? AND replay_id IN ({placeholders})",
+            replay_ids, (user,))}
+
+    def ingest(self, username, df_input):
+        """Add a replay frame's games of `username` to the registry; returns how many were new.
+
+        Takes the frames process_replays takes. Replays already ingested for
+        the user are skipped, and the usage table and daily buckets are
+        updated with the new games only, so the cost follows the size of
+        `df_input`, not of the user's history. Each ingest that adds games
+        bumps the user's version (see version()).
+        """
+        if df_input.empty:
+            return 0
+        user = username.lower()
+        with metrics.timer("registry.ingest_seconds"):
+            df, team_keys = build_replay_rows(username, df_input)
+            replay_ids = df["id"].astype(str)
+            # One lock for check and insert, so concurrent ingests can't both add a replay
+            with self.lock:
+                new = self._ingest(user, username, df, team_keys, replay_ids)
+        if new:
+            metrics.incr("registry.new_replays", new)
+            log.info("🗃️ %d new replays of '%s' added to the team registry", new, username,
+                     extra={"username": username})
+        return new
+
+    def _ingest(self, user, username, df, team_keys, replay_ids):
+        known = self._known_replays(user, replay_ids.unique().tolist())
+        new = ~replay_ids.duplicated().to_numpy() & ~replay_ids.isin(known).to_numpy()
+        if not new.any():
+            return 0
+        df = df[new]
+        team_ids = self._team_ids(team_keys[new])
+        uploadtime = pd.to_numeric(df["uploadtime"], errors="coerce").astype("Int64")
+
+        games = pd.DataFrame({
+            "team_id": team_ids,
+            "team": df["Team"].to_numpy(),
+            "uploadtime": uploadtime.to_numpy(),
+        })
+        usage = games.groupby(["team_id", "team"], sort=False).agg(
+            times_used=("team_id", "count"),
+            last_used=("uploadtime", "max"),
+        ).reset_index()
+        buckets = daily_buckets(username, df)
+
+        rows = zip(replay_ids[new].tolist(), team_ids.tolist(), games["team"].tolist(),
+                   _nullable(uploadtime), df["format"].astype(str).tolist(), _nullable(df["Result"]))
+        self.conn.executemany(
+            "INSERT INTO user_replays (username, replay_id, team_id, team, uploadtime, format, result) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(user, *row) for row in rows],
+        )
+        # max() of SQLite returns NULL if either side is; coalesce so a missing time never wins
+        self.conn.executemany(
+            """INSERT INTO team_usage (username, team_id, team, times_used, last_used)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (username, team_id, team) DO UPDATE SET
+                times_used = times_used + excluded.times_used,
+                last_used = max(coalesce(last_used, excluded.last_used),
+                                coalesce(excluded.last_used, last_used))""",
+            [(user, *row) for row in zip(usage["team_id"].tolist(), usage["team"].tolist(),
+                                         usage["times_used"].tolist(), _nullable(usage["last_used"]))],
+        )
+        self.conn.executemany(
+            """INSERT INTO daily_usage (username, day, format, kind, key, games, decided, wins)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (username, day, format, kind, key) DO UPDATE SET
+                games = games + excluded.games,
+                decided = decided + excluded.decided,
+                wins = wins + excluded.wins""",
+            [(user, *row) for row in zip(*(buckets[column].tolist() for column in BUCKET_COLUMNS))],
+        )
+        self.conn.execute(
+            """INSERT INTO user_versions (username, version, updated) VALUES (?, 1, ?)
+            ON CONFLICT (username) DO UPDATE SET version = version + 1, updated = excluded.updated""",
+            (user, time.time()),
+        )
+        self.conn.commit()
+        return int(new.sum())
+
+    def team_statistics(self, username):
+        """process_replays' team statistics table for everything ingested for `username`.
+
+        Times_Used and Last_Used ("%m-%d-%Y" of the newest game) per
+        (Team ID, Team), read from the usage table without touching the games.
+        """
+        with self.lock:
+            usage = pd.read_sql_query(
+                "SELECT team_id AS 'Team ID', team AS Team, times_used AS Times_Used, last_used AS Last_Used "
+                "FROM team_usage WHERE username = ? ORDER BY team_id, team",
+                self.conn, params=(username.lower(),))
+        usage["Last_Used"] = format_match_dates(pd.to_numeric(usage["Last_Used"]))
+        return usage
+
+    def daily_buckets(self, username, since_day=None):
+        """`username`'s per-day usage buckets (see usage_timeseries.BUCKET_COLUMNS), from `since_day` on."""
+        with self.lock:
+            buckets = pd.read_sql_query(
+                "SELECT day AS Day, format AS Format, kind AS Kind, key AS Key, games AS Games, "
+                "decided AS Decided, wins AS Wins FROM daily_usage WHERE username = ? AND day >= ? "
+                "ORDER BY day, format, kind, key",
+                self.conn, params=(username.lower(), since_day if since_day is not None else -2**62))
+        return buckets
+
+    def rolling_usage(self, username, kind=TEAM, days=30, formats=None, by_format=False):
+        """usage_timeseries.rolling_usage over the `days` days up to `username`'s newest game.
+
+        Only the buckets inside the window are read.
+        """
+        with self.lock:
+            newest = self.conn.execute("SELECT max(day) FROM daily_usage WHERE username = ?",
+                                       (username.lower(),)).fetchone()[0]
+        buckets = self.daily_buckets(username, newest - days + 1 if newest is not None else None)
+        return rolling_usage(buckets, kind, days, formats, newest, by_format)
+
+    def sync_cursor(self, username):
+        """(newest uploadtime, ids of the replays uploaded then) of `username`'s games, or (None, set())."""
+        user = username.lower()
+        with self.lock:
+            newest = self.conn.execute("SELECT max(uploadtime) FROM user_replays WHERE username = ?",
+                                       (user,)).fetchone()[0]
+            if newest is None:
+                return None, set()
+            ids = self.conn.execute("SELECT replay_id FROM user_replays WHERE username = ? AND uploadtime = ?",
+                                    (user, newest)).fetchall()
+        return newest, {replay_id for (replay_id,) in ids}
+
+    def version(self, username):
+        """(version, time of the last change) of `username`'s data, or None if nothing was ingested.
+
+        The version goes up with every ingest that adds games, in any process
+        using the same registry file, so it can key caches of derived results.
+        """
+        with self.lock:
+            return self.conn.execute("SELECT version, updated FROM user_versions WHERE username = ?",
+                                     (username.lower(),)).fetchone()
+
+    def users(self):
+        """Every user with ingested games: a frame of Username, Version and Updated (Unix time)."""
+        with self.lock:
+            return pd.read_sql_query(
+                "SELECT username AS Username, version AS Version, updated AS Updated FROM user_versions "
+                "ORDER BY username", self.conn)
+
+    def replays(self, username, limit=None, offset=0):
+        """`username`'s ingested games, newest first: Team ID, Match Date, Replay URL, Team, Format and Result."""
+        with self.lock:
+            games = pd.read_sql_query(
+                "SELECT team_id AS 'Team ID', uploadtime, replay_id, team AS Team, format AS Format, "
+                "result AS Result FROM user_replays WHERE username = ? "
+                "ORDER BY uploadtime DESC, replay_id LIMIT ? OFFSET ?",
+                self.conn, params=(username.lower(), -1 if limit is None else limit, offset))
+        games.insert(1, "Match Date", format_match_dates(pd.to_numeric(games.pop("uploadtime"))))
+        games.insert(2, "Replay URL", "https://replay.pokemonshowdown.com/" + games.pop("replay_id"))
+        return games
+
+    def replay_count(self, username):
+        """Number of games ingested for `username`."""
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM user_replays WHERE username = ?",
+                                     (username.lower(),)).fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def _nullable(values):
+    """A column as a list with missing values as None, for SQLite parameters."""
+    values = pd.Series(values, dtype=object)
+    return values.where(values.notna(), None).tolist()
+
+
+def refresh_team_statistics(username, registry=None, max_workers=8, client=None, cache=None, team_only=True):
+    """Fetch `username`'s replays newer than the newest one in the registry, ingest them and return team statistics.
+
+    The walk over search results stops at the first replay the registry
+    already holds (see showdown_scraper_username.fetch_new_replays), so with
+    nothing new this is one search request and one small query. With
+    team_only=False whole replays are downloaded, so results are recorded.
+
+    Nothing is ingested past a failed download or a search error (the walk
+    resumes from the newest replay held), so those games come in with a
+    later refresh instead of being stored as empty teams.
+    """
+    if registry is None:
+        registry = get_default_registry()
+    known_time, known_ids = registry.sync_cursor(username)
+    records, _ = fetch_new_replays(username, known_time, known_ids, max_workers, client, cache, team_only)
+    if records:
+        registry.ingest(username, records_to_frame(records))
+    return registry.team_statistics(username)
+
+
+_default_registry = None
+_default_registry_lock = threading.Lock()
+
+
+def get_default_registry():
+    """Shared registry at DEFAULT_REGISTRY_PATH (set with SHOWDOWN_TEAM_REGISTRY)."""
+    global _default_registry
+    with _default_registry_lock:
+        if _default_registry is None:
+            _default_registry = TeamRegistry()
+        return _default_registry
@@ -0,0 +1,158 @@
+"""Usage over time: games per team and per species, pre-aggregated into daily buckets.
+
+A bucket is one (day, format, team or species) with its game, decided-game
+and win counts. Days are UTC days since the epoch, taken from each replay's
+upload time, so they order correctly across months and years. Rolling
+windows (the last 7/30/90 days) and usage charts are summed from the buckets
+alone. Buckets of new games combine with existing ones by adding counts;
+team_registry stores them in SQLite and adds each ingest's buckets with an
+upsert.
+"""
+import numpy as np
+import pandas as pd
+
+from matchups import WIN, player_and_opponent_teams, resolve_results
+from replay_formats import get_format
+from replay_records import normalize_replay_frame
+from showdown_scraper_username import canonical_team_key
+
+SECONDS_PER_DAY = 86_400
+
+# Bucket kinds: whole teams (keyed by canonical team key) and single species
+TEAM, SPECIES = "team", "species"
+
+BUCKET_COLUMNS = ["Day", "Format", "Kind", "Key", "Games", "Decided", "Wins"]
+BUCKET_KEYS = ["Day", "Format", "Kind", "Key"]
+
+# Windows of rolling_summary, in days
+ROLLING_WINDOWS = (7, 30, 90)
+
+# Name of the Key column in query results, per kind
+KEY_LABELS = {TEAM: "Team", SPECIES: "Pokémon"}
+
+
+def empty_buckets():
+    return pd.DataFrame({
+        "Day": pd.Series(dtype="int64"), "Format": pd.Series(dtype=object), "Kind": pd.Series(dtype=object),
+        "Key": pd.Series(dtype=object), "Games": pd.Series(dtype="int64"), "Decided": pd.Series(dtype="int64"),
+        "Wins": pd.Series(dtype="int64"),
+    })
+
+
+def daily_buckets(username, replays):
+    """Per-day usage buckets of `username`'s teams and species in a replay frame (see BUCKET_COLUMNS).
+
+    Decided and Wins count games with a known winner (replays fetched with
+    team_only=False). Replays without an upload time are left out.
+    """
+    if replays.empty:
+        return empty_buckets()
+    replays = normalize_replay_frame(replays)
+    player_teams, _ = player_and_opponent_teams(replays)
+    results = resolve_results(replays["winner"], username)
+    games = pd.DataFrame({
+        "Day": pd.to_numeric(replays["uploadtime"], errors="coerce").to_numpy() // SECONDS_PER_DAY,
+        "Format": replays["format"].astype(str).to_numpy(),
+        "Team": player_teams,
+        "Decided": pd.notna(results),
+        "Wins": results == WIN,
+    }).dropna(subset="Day")
+
+    teams = games.assign(Kind=TEAM, Key=[canonical_team_key(team) for team in games["Team"]])
+    species = games.explode("Team").dropna(subset="Team")  # empty teams explode to a missing species
+    species = species.assign(Kind=SPECIES, Key=species["Team"])
+    buckets = pd.concat([teams, species], ignore_index=True).groupby(BUCKET_KEYS, sort=True).agg(
+        Games=("Decided", "size"),
+        Decided=("Decided", "sum"),
+        Wins=("Wins", "sum"),
+    ).reset_index()
+    return buckets.astype({"Day": "int64", "Games": "int64", "Decided": "int64", "Wins": "int64"})[BUCKET_COLUMNS]
+
+
+def select_buckets(buckets, kind=None, formats=None):
+    """Buckets of one kind (None: both) and of the formats in a replay_formats label (None: all)."""
+    if kind is not None:
+        buckets = buckets[buckets["Kind"] == kind]
+    replay_format = get_format(formats)
+    if replay_format is not None:
+        # Few distinct format names, so each is matched once rather than per bucket
+        keep = [name for name in buckets["Format"].unique() if replay_format.matches(name)]
+        buckets = buckets[buckets["Format"].isin(keep)]
+    return buckets
+
+
+def day_dates(days):
+    """Day numbers -> datetime64 dates."""
+    return pd.to_datetime(np.asarray(days, dtype="int64"), unit="D")
+
+
+def rolling_usage(buckets, kind=TEAM, days=30, formats=None, end_day=None, by_format=False):
+    """Usage per team or species over the `days` days ending at `end_day` (default: the newest day).
+
+    Columns: Team/Pokémon ([Format] first with by_format), Games, Share (of
+    all games in the window), Decided, Wins and Win_Rate (over decided
+    games), most used first. Only the window's buckets are summed.
+    """
+    buckets = select_buckets(buckets, formats=formats)
+    label = KEY_LABELS[kind]
+    group = ["Format", "Key"] if by_format else ["Key"]
+    columns = group[:-1] + [label, "Games", "Share", "Decided", "Wins", "Win_Rate"]
+    if buckets.empty:
+        return pd.DataFrame(columns=columns)
+    if end_day is None:
+        end_day = buckets["Day"].max()
+    window = buckets[(buckets["Day"] > end_day - days) & (buckets["Day"] <= end_day)]
+
+    # Every game has exactly one team bucket, so team Games sum to the games played
+    team_games = window[window["Kind"] == TEAM]
+    totals = team_games.groupby(group[:-1])["Games"].sum() if by_format else team_games["Games"].sum()
+    usage = window[window["Kind"] == kind].groupby(group, sort=True)[["Games", "Decided", "Wins"]].sum()
+    usage = usage.reset_index()
+    if by_format:
+        usage["Share"] = usage["Games"] / usage["Format"].map(totals).to_numpy()
+    else:
+        usage["Share"] = usage["Games"] / totals if totals else np.nan
+    usage["Win_Rate"] = usage["Wins"] / usage["Decided"].where(lambda n: n > 0)
+    usage = usage.sort_values(group[:-1] + ["Games", "Key"], ascending=[True] * (len(group) - 1) + [False, True])
+    return usage.rename(columns={"Key": label})[columns].reset_index(drop=True)
+
+
+def rolling_summary(buckets, kind=TEAM, windows=ROLLING_WINDOWS, formats=None, end_day=None):
+    """Games and Share per team or species in each rolling window, e.g. Games_7d, Share_7d, Games_30d, ...
+
+    All windows end at the same day (default: the newest day in the buckets).
+    Rows are every key used within the longest window, most used there first.
+    """
+    buckets = select_buckets(buckets, formats=formats)
+    label = KEY_LABELS[kind]
+    if buckets.empty:
+        return pd.DataFrame(columns=[label] + [f"{name}_{days}d" for days in windows for name in ("Games", "Share")])
+    if end_day is None:
+        end_day = buckets["Day"].max()
+    summary = None
+    for days in sorted(windows, reverse=True):
+        usage = rolling_usage(buckets, kind, days, end_day=end_day)[[label, "Games", "Share"]]
+        usage = usage.rename(columns={"Games": f"Games_{days}d", "Share": f"Share_{days}d"})
+        summary = usage if summary is None else summary.merge(usage, on=label, how="left")
+    games_columns = [f"Games_{days}d" for days in windows]
+    summary[games_columns] = summary[games_columns].fillna(0).astype("int64")
+    summary = summary.fillna({f"Share_{days}d": 0.0 for days in windows})
+    return summary[[label] + [f"{name}_{days}d" for days in windows for name in ("Games", "Share")]]
+
+
+def usage_over_time(buckets, kind=TEAM, keys=None, top=5, freq="W", formats=None):
+    """Games per period (a pandas frequency, "D", "W", "MS", ...) of some teams or species, for charting.
+
+    One column per key (default: the `top` most used overall), one row per
+    period from the first game to the last; periods without games are 0.
+    """
+    buckets = select_buckets(buckets, kind, formats)
+    if keys is None:
+        keys = buckets.groupby("Key")["Games"].sum().sort_values(ascending=False, kind="stable").index[:top].tolist()
+    buckets = buckets[buckets["Key"].isin(keys)]
+    if buckets.empty:
+        return pd.DataFrame(columns=list(keys), dtype="int64")
+    counts = buckets.assign(Date=day_dates(buckets["Day"])).pivot_table(
+        index="Date", columns="Key", values="Games", aggfunc="sum", fill_value=0)
+    counts = counts.resample(freq).sum()
+    return counts.reindex(columns=[key for key in keys if key in counts.columns]).rename_axis(columns=KEY_LABELS[kind])